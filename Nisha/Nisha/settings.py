@@ -1,15 +1,27 @@
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# True under `manage.py test` (tests get their own cache, see CACHES)
+TESTING = sys.argv[1:2] == ['test']
+
 SECRET_KEY = os.environ.get('SECRET_KEY', 'django-insecure-your-secret-key-here')
 DEBUG = os.environ.get('DEBUG', 'False') == 'True'
 
 ALLOWED_HOSTS = ['.onrender.com', 'localhost', '127.0.0.1']
 
+# Serverless deployments (api/index.py) can defer admin autodiscovery until the
+# first /admin/ request; see Nisha/urls.py. Off by default because system
+# checks and management commands expect admin models to be registered up front.
+LAZY_ADMIN = os.environ.get('LAZY_ADMIN', 'False') == 'True'
+
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    'django.contrib.admin.apps.SimpleAdminConfig' if LAZY_ADMIN else 'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -22,10 +34,15 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'chat.middleware.CompressionMiddleware',  # br/gzip for dynamic responses (static files are precompressed)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chat.middleware.CachedAuthenticationMiddleware',  # AuthenticationMiddleware with a user cache for polling
+    'chat.middleware.ProfilingMiddleware',  # Stack samples + SQL for slow or X-Chat-Profile requests
+    'chat.middleware.MemoryMonitorMiddleware',  # Allocation sampling / RSS recycling (opt-in)
+    'chat.middleware.RateLimitMiddleware',
+    'chat.middleware.HashingBusyMiddleware',  # 503 + Retry-After when password hashing is saturated
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -57,6 +74,20 @@ DATABASES = {
     }
 }
 
+# Optional message sharding (chat/sharding.py)
+# CHAT_SHARD_COUNT > 0 stores room messages in that many extra SQLite files
+# ('shard0', 'shard1', ...) so busy rooms do not share one write lock. Create
+# their tables with `python manage.py shards migrate`.
+CHAT_SHARD_COUNT = int(os.environ.get('CHAT_SHARD_COUNT', 0))
+for _index in range(CHAT_SHARD_COUNT):
+    DATABASES[f'shard{_index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'shard{_index}.sqlite3',
+        # Take the write lock up front so message id assignment is serialized
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    }
+DATABASE_ROUTERS = ['chat.routers.ShardRouter'] if CHAT_SHARD_COUNT else []
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',},
@@ -72,10 +103,235 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = [BASE_DIR / 'static', BASE_DIR / 'home/static',]
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage' if DEBUG else 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    # Hashed, compressed assets in production so WhiteNoise can send far-future cache headers
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedStaticFilesStorage' if DEBUG else 'Nisha.storage.NishaStaticFilesStorage',
+    },
+}
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Shared cache
+# 'sqlite' (chat/sqlite_cache.py) keeps one cache file per node that every
+# worker process reads and writes, so cached rooms, pages and invalidations are
+# shared without running Redis or Memcached. 'locmem' is Django's per-process
+# cache. Compare them with `manage.py bench_cache`.
+# Cached values are pickled, so the file lives in a directory private to the
+# user running the app (mode 0700; SQLiteCache refuses files owned by anyone
+# else). The temp directory is used because BASE_DIR is read-only on Vercel.
+# Test runs get a fresh directory of their own, so they neither clear the
+# cache of a server on the same host nor share it with other test runs.
+CHAT_CACHE_BACKEND = os.environ.get('CHAT_CACHE_BACKEND', 'sqlite')
+CHAT_CACHE_LOCATION = os.environ.get('CHAT_CACHE_LOCATION', os.path.join(
+    tempfile.gettempdir(), f'nisha-cache-{os.getuid() if hasattr(os, "getuid") else "user"}', 'cache.sqlite3',
+))
+if TESTING:
+    _test_cache_dir = tempfile.mkdtemp(prefix='nisha-test-cache-')  # Mode 0700
+    atexit.register(shutil.rmtree, _test_cache_dir, ignore_errors=True)
+    CHAT_CACHE_LOCATION = os.path.join(_test_cache_dir, 'cache.sqlite3')
+if CHAT_CACHE_BACKEND == 'sqlite':
+    CACHES = {
+        'default': {
+            'BACKEND': 'chat.sqlite_cache.SQLiteCache',
+            'LOCATION': CHAT_CACHE_LOCATION,
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.environ.get('CHAT_CACHE_MAX_ENTRIES', 20000)),  # LRU eviction beyond this
+                'CULL_FREQUENCY': 4,  # Evict down to 3/4 of MAX_ENTRIES
+            },
+        },
+    }
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Chat room/membership cache (chat/cache.py)
+# Entries are served from a per-process LRU for CHAT_CACHE_LOCAL_TTL seconds and
+# from the shared cache for CHAT_CACHE_TIMEOUT seconds; signals invalidate both.
+CHAT_CACHE_LOCAL_MAXSIZE = int(os.environ.get('CHAT_CACHE_LOCAL_MAXSIZE', 1024))
+CHAT_CACHE_LOCAL_TTL = float(os.environ.get('CHAT_CACHE_LOCAL_TTL', 5))
+CHAT_CACHE_TIMEOUT = int(os.environ.get('CHAT_CACHE_TIMEOUT', 300))
+
+# Session storage
+# 'db' (Django's default) reads django_session on every request.
+# 'signed_cookies' keeps the session in the signed cookie itself: no query, but
+# logging out cannot revoke copies of the cookie and its size counts against
+# every request. 'cached_db' reads through CACHES and falls back to the
+# database; it needs a cache shared by all workers for logouts to apply at once.
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'db')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSION_BACKEND}'
+
+# Resolved users are reused for CHAT_AUTH_CACHE_TTL seconds on these path
+# prefixes (the endpoints whatsapp.html polls), skipping the auth_user query
+CHAT_AUTH_CACHE_TTL = float(os.environ.get('CHAT_AUTH_CACHE_TTL', 10))
+CHAT_CACHED_AUTH_PATHS = ['/chat/room/', '/chat/sync/', '/chat/presence/', '/chat/messages/']
+
+# Page and fragment caching
+# The WhatsApp sidebar is cached per user and keyed by a version that changes
+# with the user's rooms and their latest messages, so the timeout only bounds
+# memory use. Static home pages are cached whole for HOME_PAGE_CACHE_TIMEOUT.
+CHAT_SIDEBAR_CACHE_TIMEOUT = int(os.environ.get('CHAT_SIDEBAR_CACHE_TIMEOUT', 3600))
+HOME_PAGE_CACHE_TIMEOUT = int(os.environ.get('HOME_PAGE_CACHE_TIMEOUT', 900))
+
+# Messages per page of room history; the chat UI loads older pages on scroll
+CHAT_MESSAGE_PAGE_SIZE = int(os.environ.get('CHAT_MESSAGE_PAGE_SIZE', 50))
+
+# Maximum new messages returned per room by /chat/sync/ (newest are kept)
+CHAT_SYNC_MESSAGES_PER_ROOM = int(os.environ.get('CHAT_SYNC_MESSAGES_PER_ROOM', 50))
+# Rooms per sync query: each room adds a term to the SQL condition, and SQLite
+# refuses expressions nested more than 1000 deep
+CHAT_SYNC_ROOM_BATCH = int(os.environ.get('CHAT_SYNC_ROOM_BATCH', 200))
+
+# Groups with more members than this never have their full member set loaded
+# (online counts are computed with a query over the online users instead)
+CHAT_LARGE_ROOM_MEMBERS = int(os.environ.get('CHAT_LARGE_ROOM_MEMBERS', 1000))
+
+# Homepage weather (home/weather.py)
+# Providers are asked in this order; a provider that has not answered within
+# its recent p95 latency is hedged with the next one. The page never waits
+# longer than WEATHER_TIMEOUT seconds and falls back to demo data.
+WEATHER_PROVIDERS = ['wttr', 'tsukumijima']
+WEATHER_TIMEOUT = float(os.environ.get('WEATHER_TIMEOUT', 3.0))
+WEATHER_HEDGE_MIN_MS = int(os.environ.get('WEATHER_HEDGE_MIN_MS', 50))  # Never hedge sooner than this
+WEATHER_HEDGE_DEFAULT_MS = int(os.environ.get('WEATHER_HEDGE_DEFAULT_MS', 500))  # Until 10 latencies are known
+WEATHER_BREAKER_FAILURES = int(os.environ.get('WEATHER_BREAKER_FAILURES', 5))  # Failures in a row that open a breaker
+WEATHER_BREAKER_RESET = int(os.environ.get('WEATHER_BREAKER_RESET', 30))  # Seconds before a trial request
+WEATHER_CACHE_TIMEOUT = int(os.environ.get('WEATHER_CACHE_TIMEOUT', 600))  # Seconds a city's weather is reused
+
+# Cold-start budget enforced by `manage.py check_cold_start` (milliseconds of
+# cumulative import time for the serverless entry point api/index.py)
+COLD_START_BUDGET_MS = int(os.environ.get('COLD_START_BUDGET_MS', 600))
+
+# Presence tracking (chat/presence.py)
+# Users are online for CHAT_PRESENCE_TTL seconds after their last request;
+# last_seen/is_online are written to UserProfile in bulk at most every
+# CHAT_PRESENCE_FLUSH_INTERVAL seconds.
+CHAT_PRESENCE_TTL = int(os.environ.get('CHAT_PRESENCE_TTL', 30))
+CHAT_PRESENCE_FLUSH_INTERVAL = int(os.environ.get('CHAT_PRESENCE_FLUSH_INTERVAL', 60))
+
+# Ephemeral room events such as typing indicators (chat/events.py)
+# Events never touch the database; each (room, user, kind) broadcasts at most
+# once per CHAT_EVENT_MIN_INTERVAL seconds and expires after CHAT_EVENT_TTL.
+CHAT_EVENT_TTL = float(os.environ.get('CHAT_EVENT_TTL', 5))
+CHAT_EVENT_MIN_INTERVAL = float(os.environ.get('CHAT_EVENT_MIN_INTERVAL', 0.5))
+CHAT_EVENT_ROOM_LIMIT = int(os.environ.get('CHAT_EVENT_ROOM_LIMIT', 50))
+
+# Response compression (chat.middleware.CompressionMiddleware)
+# Brotli needs the optional `brotli` package and is limited to these content
+# types (JSON, where trailing whitespace is harmless); everything else falls
+# back to gzip. Both add random padding against BREACH-style attacks, since
+# JSON responses carry private messages too.
+CHAT_COMPRESS_MIN_SIZE = int(os.environ.get('CHAT_COMPRESS_MIN_SIZE', 512))
+CHAT_BROTLI_QUALITY = int(os.environ.get('CHAT_BROTLI_QUALITY', 5))
+CHAT_BROTLI_CONTENT_TYPES = ['application/json']
+
+# Chat event log consumers (chat/eventlog.py), run by `manage.py consume_events`
+# Dotted paths to eventlog.Consumer subclasses; each processes up to
+# CHAT_EVENT_BATCH_SIZE events per transaction.
+CHAT_EVENT_CONSUMERS = [
+    'chat.attachments.ThumbnailConsumer',  # Thumbnails of image attachments (needs Pillow)
+    'chat.rollups.ActivityRollupConsumer',  # Per room/user activity counts (staff report)
+]
+CHAT_EVENT_BATCH_SIZE = int(os.environ.get('CHAT_EVENT_BATCH_SIZE', 500))
+
+# Token bucket rate limits per URL name (chat/ratelimit.py)
+# 'rate' is the refill rate, 'burst' the bucket size. Rules with scope 'room'
+# share one bucket between everybody posting into the same room.
+# Backend 'local' keeps buckets per worker; 'cache' shares them via CACHES
+# (atomically with the 'sqlite' cache backend).
+CHAT_RATE_LIMITS_ENABLED = os.environ.get('CHAT_RATE_LIMITS_ENABLED', 'True') == 'True'
+CHAT_RATE_LIMIT_BACKEND = os.environ.get('CHAT_RATE_LIMIT_BACKEND', 'local')
+# Anonymous requests are limited per client IP. Set this to the number of
+# proxies in front of the app (1 on Render) to take the IP from
+# X-Forwarded-For; with 0 the header is ignored because clients can forge it.
+CHAT_RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('CHAT_RATE_LIMIT_TRUSTED_PROXIES', 0))
+CHAT_RATE_LIMITS = {
+    'chat:send_message': [
+        {'rate': '2/s', 'burst': 10},
+        {'rate': '20/s', 'burst': 40, 'scope': 'room'},
+    ],
+    'chat:create_chat_room': {'rate': '10/m', 'burst': 5},
+    'chat:join_chat_room': {'rate': '30/m', 'burst': 10},
+    'chat:direct_room': {'rate': '30/m', 'burst': 10},
+    'chat:start_upload': {'rate': '30/m', 'burst': 10},
+    'chat:room_members': {'rate': '2/s', 'burst': 10},
+    'chat:add_room_members': {'rate': '10/m', 'burst': 5},
+    'chat:remove_room_members': {'rate': '10/m', 'burst': 5},
+    'chat:get_messages': {'rate': '2/s', 'burst': 10},
+    'chat:get_room_messages': {'rate': '2/s', 'burst': 10},
+    'chat:sync': {'rate': '2/s', 'burst': 10},
+    'chat:room_changes': {'rate': '2/s', 'burst': 10},
+    'chat:edit_message': {'rate': '30/m', 'burst': 10},
+    'chat:delete_message': {'rate': '30/m', 'burst': 10},
+    'chat:room_event': {'rate': '5/s', 'burst': 10},
+    'chat:get_presence': {'rate': '1/s', 'burst': 5},
+}
+
+# Authentication
+# BoundedHashingBackend hashes passwords on a small thread pool (chat/hashing.py)
+# so login/signup bursts cannot occupy every web worker. ModelBackend stays
+# listed so existing sessions that reference it remain valid.
+AUTHENTICATION_BACKENDS = [
+    'chat.backends.BoundedHashingBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+CHAT_HASHING_WORKERS = int(os.environ.get('CHAT_HASHING_WORKERS', 2))  # Concurrent hashes per process
+CHAT_HASHING_QUEUE = int(os.environ.get('CHAT_HASHING_QUEUE', 8))  # Waiting hashes before answering 503
+CHAT_HASHING_TIMEOUT = float(os.environ.get('CHAT_HASHING_TIMEOUT', 10))  # Seconds to wait for a hash
+
+# Sampling profiler (chat/profiling.py)
+# Staff can profile any request with the X-Chat-Profile: 1 header; requests
+# slower than CHAT_PROFILER_SLOW_MS (0 = off) are profiled automatically.
+# Profiles are listed at /chat/stats/profiles/ (staff only).
+CHAT_PROFILER_ENABLED = os.environ.get('CHAT_PROFILER_ENABLED', 'True') == 'True'
+CHAT_PROFILER_SLOW_MS = int(os.environ.get('CHAT_PROFILER_SLOW_MS', 0))
+CHAT_PROFILER_INTERVAL_MS = int(os.environ.get('CHAT_PROFILER_INTERVAL_MS', 5))  # Time between stack samples
+CHAT_PROFILER_KEEP = int(os.environ.get('CHAT_PROFILER_KEEP', 50))  # Profiles kept per worker
+
+# Memory watchdog (chat/memory.py)
+# CHAT_MEMORY_MONITOR=True traces allocations (tracemalloc) in every worker and
+# samples the top allocation sites every CHAT_MEMORY_INTERVAL seconds; staff
+# see samples and snapshot diffs at /chat/stats/memory/. Workers whose RSS
+# exceeds CHAT_MEMORY_RECYCLE_MB (0 = off) exit gracefully and are replaced.
+CHAT_MEMORY_MONITOR = os.environ.get('CHAT_MEMORY_MONITOR', 'False') == 'True'
+CHAT_MEMORY_INTERVAL = float(os.environ.get('CHAT_MEMORY_INTERVAL', 60))
+CHAT_MEMORY_FRAMES = int(os.environ.get('CHAT_MEMORY_FRAMES', 10))  # Stack depth per traced allocation
+CHAT_MEMORY_TOP = int(os.environ.get('CHAT_MEMORY_TOP', 25))  # Allocation sites per sample/diff
+CHAT_MEMORY_KEEP = int(os.environ.get('CHAT_MEMORY_KEEP', 60))  # Samples kept per worker
+CHAT_MEMORY_RECYCLE_MB = int(os.environ.get('CHAT_MEMORY_RECYCLE_MB', 0))
+
+# File attachments (chat/attachments.py)
+# Files are stored once per content (SHA-256) under CHAT_ATTACHMENT_ROOT and
+# uploaded in resumable chunks. Set CHAT_ATTACHMENT_SENDFILE_HEADER (e.g.
+# 'X-Accel-Redirect' for nginx, 'X-Sendfile' for Apache) to let the proxy send
+# downloads; CHAT_ATTACHMENT_SENDFILE_PREFIX is the internal location mapped
+# to CHAT_ATTACHMENT_ROOT.
+CHAT_ATTACHMENT_ROOT = Path(os.environ.get('CHAT_ATTACHMENT_ROOT', BASE_DIR / 'attachments'))
+CHAT_ATTACHMENT_MAX_SIZE = int(os.environ.get('CHAT_ATTACHMENT_MAX_SIZE', 100 * 1024 * 1024))  # Bytes per file
+CHAT_UPLOAD_CHUNK_SIZE = int(os.environ.get('CHAT_UPLOAD_CHUNK_SIZE', 1024 * 1024))  # Suggested chunk size
+CHAT_UPLOAD_EXPIRY_HOURS = int(os.environ.get('CHAT_UPLOAD_EXPIRY_HOURS', 24))  # Unfinished uploads are removed after
+CHAT_ATTACHMENT_SENDFILE_HEADER = os.environ.get('CHAT_ATTACHMENT_SENDFILE_HEADER', '')
+CHAT_ATTACHMENT_SENDFILE_PREFIX = os.environ.get('CHAT_ATTACHMENT_SENDFILE_PREFIX', '/protected-attachments/')
+
+# Logging
+# Application loggers ('chat', 'home') write to stderr, which gunicorn and
+# Render collect. LOG_LEVEL=DEBUG includes per-request details such as the
+# homepage weather data.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'chat': {'handlers': ['console'], 'level': os.environ.get('LOG_LEVEL', 'INFO'), 'propagate': False},
+        'home': {'handlers': ['console'], 'level': os.environ.get('LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
 LOGIN_REDIRECT_URL = '/chat/whatsapp/'
 LOGOUT_REDIRECT_URL = '/home/'
 LOGIN_URL = '/login/'
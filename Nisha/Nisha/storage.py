@@ -0,0 +1,25 @@
+# Static file storage for the Nisha project
+# Hashed file names (e.g. whatsapp.3f9c1b.js) let WhiteNoise serve assets with
+# far-future cache headers, so browsers download them once per deploy.
+
+from whitenoise.storage import CompressedManifestStaticFilesStorage  # Hashing + gzip/brotli variants
+
+
+class NishaStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """
+    Manifest storage that degrades gracefully instead of raising.
+
+    Django's manifest storage raises ValueError from {% static %} when a file
+    is missing from the manifest (for example before collectstatic has run,
+    in tests, or for an image referenced by a template but not committed).
+    That would turn a missing image into a 500 for the whole page, so we fall
+    back to the unhashed URL instead.
+    """
+
+    manifest_strict = False
+
+    def url(self, name, force=False):
+        try:
+            return super().url(name, force)
+        except ValueError:
+            return self._url(lambda name: name, name, force)
@@ -2,18 +2,44 @@
 # This is the root URL configuration that routes requests to appropriate apps
 # It defines the main navigation structure of the entire website
 
+from django.conf import settings  # LAZY_ADMIN switch
 from django.contrib import admin  # Django admin interface
-from django.urls import path, include  # URL routing functions
+from django.urls import path, include, URLResolver  # URL routing functions
+from django.urls.resolvers import RoutePattern  # Route matcher for the lazy admin resolver
 from django.views.generic import RedirectView  # For redirecting requests
 from django.contrib.auth import views as auth_views  # Built-in authentication views
 from chat.views import register_view  # Import signup functionality
 
+
+class LazyAdminURLConf:
+    """
+    URLconf stand-in that runs admin autodiscovery on first use.
+
+    URLResolver reads `urlpatterns` only when a request (or reverse()) needs
+    to look inside /admin/, so serverless cold starts that serve other pages
+    never import every app's admin module or build the admin URL table.
+    """
+
+    app_name = 'admin'
+
+    @property
+    def urlpatterns(self):
+        admin.autodiscover()  # Idempotent; registers ModelAdmins from every app
+        return admin.site.get_urls()
+
+
+if settings.LAZY_ADMIN:
+    admin_urls = URLResolver(RoutePattern('admin/'), LazyAdminURLConf(), app_name='admin', namespace='admin')
+else:
+    admin_urls = path('admin/', admin.site.urls)
+
 # Main URL patterns for the entire Nisha project
 # These patterns define the top-level navigation structure
 urlpatterns = [
     # Django administration interface
     # Accessible at /admin/ - provides database management interface
-    path('admin/', admin.site.urls),
+    # (loaded lazily when LAZY_ADMIN is enabled, see LazyAdminURLConf)
+    admin_urls,
     
     # Root URL redirect to home page
     # When users visit the homepage, show the home page with weather and info first
@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 """
 Vercel serverless function entry point for Nisha Django app
+
+Everything done at import time is paid on every cold start, so this module
+only builds the WSGI application. Heavy optional modules (requests, auth
+forms, the admin URL table when LAZY_ADMIN=True) are imported on first use;
+`python manage.py check_cold_start` measures the import cost of this file
+and fails when it exceeds settings.COLD_START_BUDGET_MS.
 """
 import os
 import sys
@@ -16,11 +22,8 @@ sys.path.insert(0, str(nisha_path))
 # Set Django settings
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Nisha.settings')
 
-# Configure Django
-import django
-django.setup()
-
 # Import Django and WSGI application
+# get_wsgi_application() runs django.setup() itself, so it is not called twice
 from django.core.wsgi import get_wsgi_application
 
 # Create WSGI application
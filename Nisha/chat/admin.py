@@ -1,25 +1,199 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.core.paginator import Paginator
+from django.db.models import Max
+from django.utils.functional import cached_property
+from . import sharding
 from .models import Message, ChatRoom, UserProfile
 
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an exact COUNT(*) over a huge table.
+
+    Unfiltered lists use the highest id as the row count (ids are dense apart
+    from deletions); filtered lists, and message shards whose ids are not
+    dense, count at most `count_limit` rows, which is enough to render the
+    page links and stays cheap with an index.
+    """
+
+    count_limit = 10_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where and queryset.db == 'default':
+            return queryset.aggregate(estimate=Max('pk'))['estimate'] or 0
+        return queryset.order_by()[:self.count_limit].count()
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList with an "older" link that pages by id (?id__lt=<last id>).
+
+    Offset pagination gets slower with every page on a large table; seeking
+    below the last id shown reads only one page of the id index.
+    """
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.older_url = None
+        if ORDER_VAR in self.params:
+            return  # Keyset paging follows the default newest-first order only
+        results = list(self.result_list)
+        if len(results) == self.list_per_page:
+            self.older_url = self.get_query_string({'id__lt': results[-1].pk}, [PAGE_VAR])
+
+    def apply_select_related(self, qs):
+        if qs.db != 'default' and isinstance(self.list_select_related, (list, tuple)):
+            # Shards hold messages only: related rows are read from 'default'
+            # with one query per relation instead of a join
+            return qs.prefetch_related(*self.list_select_related)
+        return super().apply_select_related(qs)
+
+
+class MessageDatabaseFilter(admin.SimpleListFilter):
+    """
+    Pick the database whose messages are listed when CHAT_SHARD_COUNT > 0.
+
+    A query reads one database; without this filter (or a room id in the
+    room filter) the list shows the messages stored in 'default' only.
+    """
+
+    title = 'database'
+    parameter_name = 'db'
+
+    def lookups(self, request, model_admin):
+        if not sharding.SHARD_COUNT:
+            return ()  # Hides the filter
+        return [(alias, alias) for alias in sharding.message_aliases()]
+
+    def queryset(self, request, queryset):
+        if self.value() in sharding.message_aliases():
+            return queryset.using(self.value())
+        return queryset
+
+
+class RoomInputFilter(admin.SimpleListFilter):
+    """
+    Filter messages by room id or room name prefix typed into a box, instead
+    of listing every room in the sidebar.
+
+    A room id also selects the database storing the room's messages; a name
+    prefix matches rooms on the database being listed.
+    """
+
+    title = 'chat room'
+    parameter_name = 'room'
+    template = 'admin/chat/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        yield {
+            'value': self.value() or '',
+            'parameter_name': self.parameter_name,
+            'placeholder': 'Room id or name',
+            # Other active parameters are kept as hidden fields
+            'params': {k: v for k, v in changelist.params.items() if k not in (self.parameter_name, PAGE_VAR)},
+            'clear_query_string': changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        if not value:
+            return queryset
+        if value.isdigit():
+            return queryset.using(sharding.alias_for_room(int(value))).filter(chat_room_id=int(value))
+        # Evaluated here: rooms live in 'default', possibly not the listed database
+        room_ids = list(ChatRoom.objects.filter(name__istartswith=value).values_list('id', flat=True)[:100])
+        return queryset.filter(chat_room_id__in=room_ids)
+
+
 # Register your models here.
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ('username', 'content', 'timestamp', 'chat_room', 'is_read')
-    list_filter = ('timestamp', 'is_read', 'chat_room')
-    search_fields = ('username', 'content')
+    list_display = ('id', 'username', 'content', 'timestamp', 'chat_room', 'is_read')
+    list_filter = ('timestamp', 'is_read', MessageDatabaseFilter, RoomInputFilter)
+    list_select_related = ('chat_room',)  # One joined query instead of a room lookup per row
+    search_fields = ('^username',)  # Prefix search, served by the username index
+    search_help_text = 'Username prefix, or a message id. Prefix with "text:" to scan message content (slow).'
     readonly_fields = ('timestamp',)
+    autocomplete_fields = ('user', 'chat_room')  # The edit form must not load every user and room
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # Skip the second, unfiltered COUNT(*)
+    change_list_template = 'admin/chat/message/change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is None and from_field is None and str(object_id).isdigit():
+            # Change links carry only the id, which is unique across databases
+            for alias in sharding.shard_aliases():
+                obj = self.get_queryset(request).using(alias).filter(pk=int(object_id)).first()
+                if obj is not None:
+                    break
+        return obj
+
+    def lookup_allowed(self, lookup, value, request=None):
+        # Keyset pagination parameter used by KeysetChangeList
+        if lookup == 'id__lt':
+            return True
+        return super().lookup_allowed(lookup, value, request)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if term.isdigit():
+            return queryset.filter(id=int(term)), False
+        if term.startswith('text:'):
+            return queryset.filter(content__icontains=term[len('text:'):].strip()), False
+        return super().get_search_results(request, queryset, search_term)
 
 @admin.register(ChatRoom)
 class ChatRoomAdmin(admin.ModelAdmin):
-    list_display = ('name', 'created_by', 'created_at', 'is_group')
+    list_display = ('name', 'created_by', 'created_at', 'is_group', 'member_count')
     list_filter = ('created_at', 'is_group')
     search_fields = ('name', 'description')
-    readonly_fields = ('created_at',)
-    filter_horizontal = ('members',)
+    readonly_fields = ('created_at', 'member_count')
+    # Searched on demand instead of rendering every user in the system into the form
+    autocomplete_fields = ('created_by', 'members')
+    list_select_related = ('created_by',)
+
+    def get_exclude(self, request, obj=None):
+        # The members widget renders every current member; large groups are
+        # managed through the bulk member endpoints instead
+        if obj is not None and obj.member_count > settings.CHAT_LARGE_ROOM_MEMBERS:
+            return ('members',)
+        return super().get_exclude(request, obj)
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'avatar', 'status', 'is_online', 'last_seen')
-    list_filter = ('is_online', 'last_seen')
-    search_fields = ('user__username', 'status')
+    list_filter = ('is_online', 'last_seen')  # Date ranges on last_seen use chat_profile_last_seen_idx
+    list_select_related = ('user',)  # __str__ and the user column would otherwise query auth_user per row
+    search_fields = ('user__username',)  # Shows the search box; see get_search_results
+    search_help_text = 'Username prefix (case-sensitive). Prefix with "status:" to scan status messages (slow).'
     readonly_fields = ('last_seen',)
+    autocomplete_fields = ('user',)  # The edit form must not load every user
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # Skip the second, unfiltered COUNT(*)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if term.startswith('status:'):
+            return queryset.filter(status__icontains=term[len('status:'):].strip()), False
+        if term:
+            # A range on auth_user's unique username index (BINARY collation).
+            # '^' and startswith become LIKE on SQLite, which ignores case and
+            # therefore scans every user instead
+            return queryset.filter(user__username__gte=term, user__username__lt=term + '\U0010ffff'), False
+        return super().get_search_results(request, queryset, search_term)
@@ -0,0 +1,296 @@
+# File attachments for chat messages
+# Uploads are resumable and chunked: the client announces a file (name, size,
+# type), then sends it in chunks of any size, each appended to a temporary
+# file at the current offset. Request bodies are streamed to disk in small
+# blocks, so no upload is ever held in memory. After an interrupted transfer
+# the client asks for the offset and continues from there.
+#
+# A finished upload is hashed (SHA-256) and stored under its hash:
+#   CHAT_ATTACHMENT_ROOT/ab/cd/abcd...   (the content)
+#   CHAT_ATTACHMENT_ROOT/ab/cd/abcd....thumb.jpg   (thumbnail, images only)
+# Uploading a file that is already stored just discards the temporary copy.
+#
+# Downloads (see the attachment view) are FileResponses, which WSGI servers
+# send with sendfile(); byte ranges are answered with 206 responses, and
+# behind nginx or Apache the transfer can be handed to the proxy entirely
+# (CHAT_ATTACHMENT_SENDFILE_HEADER). Thumbnails are made off the request path
+# by ThumbnailConsumer, which tails the event log (chat/eventlog.py) and
+# needs the optional Pillow package.
+
+import hashlib  # Content addresses
+import os  # Atomic renames, file removal
+import re  # Range header parsing
+from datetime import timedelta  # Expiry of abandoned uploads
+from pathlib import Path  # Storage paths
+
+from django.conf import settings  # Storage location and limits
+from django.db import IntegrityError, transaction  # Deduplicating concurrent finalizations
+from django.db.models import F  # Compare-and-set of the upload offset
+from django.utils import timezone  # Upload expiry
+
+from . import eventlog  # 'attachment.created' events for the thumbnail consumer
+from .models import Attachment, Upload  # Stored blobs and uploads in progress
+
+try:
+    from PIL import Image  # Optional: `pip install Pillow` enables thumbnails
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None
+
+# Where blobs and partial uploads are stored
+ROOT = Path(getattr(settings, 'CHAT_ATTACHMENT_ROOT', settings.BASE_DIR / 'attachments'))
+
+# Largest file accepted (bytes)
+MAX_SIZE = getattr(settings, 'CHAT_ATTACHMENT_MAX_SIZE', 100 * 1024 * 1024)
+
+# Chunk size suggested to clients (bytes); any size up to MAX_CHUNK_SIZE is accepted
+CHUNK_SIZE = getattr(settings, 'CHAT_UPLOAD_CHUNK_SIZE', 1024 * 1024)
+MAX_CHUNK_SIZE = getattr(settings, 'CHAT_UPLOAD_MAX_CHUNK_SIZE', 8 * 1024 * 1024)
+
+# Unfinished uploads older than this are removed by `manage.py expire_uploads`
+UPLOAD_EXPIRY = timedelta(hours=getattr(settings, 'CHAT_UPLOAD_EXPIRY_HOURS', 24))
+
+# Longest side of generated thumbnails (pixels)
+THUMBNAIL_SIZE = getattr(settings, 'CHAT_THUMBNAIL_SIZE', 320)
+
+# Block size for streaming request bodies to disk and files to clients
+BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UploadError(Exception):
+    """An upload request that cannot be accepted (message is shown to the client)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def blob_path(sha256):
+    """Storage path of the blob with the given hash."""
+    return ROOT / sha256[:2] / sha256[2:4] / sha256
+
+
+def thumbnail_path(sha256):
+    """Storage path of the thumbnail of the blob with the given hash."""
+    return ROOT / sha256[:2] / sha256[2:4] / f'{sha256}.thumb.jpg'
+
+
+def part_path(upload):
+    """Temporary file collecting the chunks of `upload`."""
+    return ROOT / 'uploads' / f'{upload.id}.part'
+
+
+def start_upload(user, filename, size, content_type):
+    """
+    Register a new upload.
+
+    Returns:
+        The Upload (send chunks starting at offset 0)
+    """
+    if size <= 0:
+        raise UploadError('File is empty')
+    if size > MAX_SIZE:
+        raise UploadError(f'File is larger than {MAX_SIZE} bytes', status=413)
+    upload = Upload.objects.create(
+        user=user,
+        filename=os.path.basename(filename)[:255] or 'file',
+        content_type=(content_type or 'application/octet-stream')[:100],
+        size=size,
+    )
+    path = part_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    return upload
+
+
+def write_chunk(upload, offset, stream, length):
+    """
+    Append `length` bytes read from `stream` at `offset` of an unfinished upload.
+
+    The body is copied to disk BLOCK_SIZE bytes at a time. The offset must
+    match what the server has stored (a client that lost track asks for the
+    offset first); if two requests race for the same offset only one
+    advances it.
+
+    Returns:
+        The upload, finalized (attachment set) when this was the last chunk
+    """
+    if upload.attachment_id:
+        raise UploadError('Upload already complete', status=409)
+    if offset != upload.received:
+        raise UploadError(f'Expected offset {upload.received}', status=409)
+    if length <= 0 or length > MAX_CHUNK_SIZE:
+        raise UploadError(f'Chunks must be 1 to {MAX_CHUNK_SIZE} bytes', status=413)
+    if offset + length > upload.size:
+        raise UploadError('Chunk extends past the announced size', status=416)
+
+    written = 0
+    with open(part_path(upload), 'r+b') as part:
+        part.seek(offset)
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            part.write(block)
+            written += len(block)
+    if written != length:
+        raise UploadError('Request body shorter than Content-Length')
+
+    advanced = Upload.objects.filter(pk=upload.pk, received=offset).update(received=F('received') + written)
+    if not advanced:
+        raise UploadError('Another request uploaded this chunk', status=409)
+    upload.received = offset + written
+    if upload.received == upload.size:
+        finalize(upload)
+    return upload
+
+
+def finalize(upload):
+    """
+    Hash a complete upload and turn it into an Attachment (or reuse the
+    stored copy of the same content).
+    """
+    path = part_path(upload)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for block in iter(lambda: part.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+
+    attachment = Attachment.objects.filter(sha256=sha256).first()
+    if attachment is None:
+        target = blob_path(sha256)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)  # Atomic; a concurrent identical upload writes the same bytes
+        try:
+            with transaction.atomic():
+                attachment = Attachment.objects.create(sha256=sha256, size=upload.size, content_type=upload.content_type)
+                eventlog.append(
+                    'attachment.created',
+                    {'attachment_id': attachment.id, 'sha256': sha256, 'content_type': attachment.content_type},
+                    user_id=upload.user_id,
+                )
+        except IntegrityError:
+            attachment = Attachment.objects.get(sha256=sha256)
+    else:
+        path.unlink(missing_ok=True)  # Already stored: deduplicated
+
+    upload.attachment = attachment
+    upload.save(update_fields=['attachment', 'updated_at'])
+    return attachment
+
+
+def expire_uploads(now=None):
+    """
+    Delete unfinished uploads (and their partial files) idle for longer than UPLOAD_EXPIRY.
+
+    Returns:
+        Number of uploads removed
+    """
+    cutoff = (now or timezone.now()) - UPLOAD_EXPIRY
+    stale = list(Upload.objects.filter(attachment__isnull=True, updated_at__lt=cutoff))
+    for upload in stale:
+        part_path(upload).unlink(missing_ok=True)
+    Upload.objects.filter(pk__in=[upload.pk for upload in stale]).delete()
+    return len(stale)
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range Range header ("bytes=a-b", "bytes=a-", "bytes=-n").
+
+    Returns:
+        (start, end) inclusive, None to send the whole file (no or
+        unsupported header), or raises UploadError(416) for ranges outside the file
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise UploadError('Range not satisfiable', status=416)
+    return start, end
+
+
+def read_range(path, start, end):
+    """Yield bytes start..end (inclusive) of `path` in BLOCK_SIZE blocks."""
+    remaining = end - start + 1
+    with open(path, 'rb') as blob:
+        blob.seek(start)
+        while remaining > 0:
+            block = blob.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def describe(message):
+    """
+    Attachment details of a message for the JSON endpoints, or None.
+
+    Expects message.attachment to be loaded (see prefetch()).
+    """
+    attachment = message.attachment if message.attachment_id else None
+    if attachment is None:
+        return None
+    url = f'/chat/attachments/{attachment.id}/'
+    return {
+        'id': attachment.id,
+        'name': message.attachment_name,
+        'size': attachment.size,
+        'content_type': attachment.content_type,
+        'url': url,
+        'thumbnail_url': f'{url}?thumbnail=1' if attachment.has_thumbnail else None,
+    }
+
+
+def prefetch(messages):
+    """Load the attachments of `messages` with one query (they live in 'default')."""
+    ids = {message.attachment_id for message in messages if message.attachment_id}
+    blobs = Attachment.objects.in_bulk(ids) if ids else {}
+    for message in messages:
+        if message.attachment_id:
+            message.attachment = blobs.get(message.attachment_id)
+    return messages
+
+
+class ThumbnailConsumer(eventlog.Consumer):
+    """
+    Event log consumer that writes JPEG thumbnails of new image attachments.
+
+    Without Pillow installed it only advances its checkpoint, so enabling
+    Pillow later and rebuilding (`consume_events --rebuild thumbnails`)
+    produces the missing thumbnails.
+    """
+
+    name = 'thumbnails'
+    kinds = ('attachment.created',)
+    batch_size = 20  # Image decoding is slow; keep transactions short
+
+    def handle(self, events):
+        if Image is None:
+            return
+        for event in events:
+            if not event.payload.get('content_type', '').startswith('image/'):
+                continue
+            attachment = Attachment.objects.filter(id=event.payload['attachment_id']).first()
+            if attachment is None or attachment.has_thumbnail:
+                continue
+            try:
+                with Image.open(blob_path(attachment.sha256)) as image:
+                    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                    image.convert('RGB').save(thumbnail_path(attachment.sha256), 'JPEG', quality=80)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                continue  # Not a readable image: no thumbnail
+            Attachment.objects.filter(id=attachment.id).update(has_thumbnail=True)
+
+    def reset(self):
+        Attachment.objects.filter(has_thumbnail=True).update(has_thumbnail=False)
@@ -0,0 +1,36 @@
+# Authentication backend for the chat app
+# Same behaviour as Django's ModelBackend, except password hashing runs on the
+# bounded pool in chat/hashing.py instead of the request thread.
+
+from django.contrib.auth import get_user_model  # The configured user model
+from django.contrib.auth.backends import ModelBackend  # Permissions and get_user() are reused as-is
+from django.core.exceptions import PermissionDenied  # Stops authenticate() from trying later backends
+
+from . import hashing  # Bounded password hashing
+
+
+class BoundedHashingBackend(ModelBackend):
+    """
+    ModelBackend whose password checks go through chat.hashing.
+
+    A failed password check raises PermissionDenied rather than returning
+    None, so django.contrib.auth.authenticate() does not retry the same
+    password with ModelBackend (kept in AUTHENTICATION_BACKENDS only so that
+    sessions created before this backend existed stay valid).
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Hash anyway so response time does not reveal which usernames exist
+            hashing.make_password(password)
+            raise PermissionDenied
+        if hashing.check_password(user, password) and self.user_can_authenticate(user):
+            return user
+        raise PermissionDenied
@@ -0,0 +1,314 @@
+# Room metadata and membership caching for the chat endpoints
+# Polling endpoints (get_room_messages, send_message, join_chat_room) look up the
+# same ChatRoom rows and membership sets every few seconds. This module keeps
+# them in a small in-process LRU backed by Django's shared cache so that the
+# per-poll authorization check does not need a database round trip.
+#
+# Lookup order: in-process LRU -> shared cache -> database.
+# Invalidation happens through signals (see chat/signals.py) whenever members
+# are added/removed or a room is saved/deleted.
+
+import copy  # Per-request copies of cached user objects
+import hashlib  # Compact digests for sidebar cache versions
+import threading  # Protects the in-process LRU from concurrent worker threads
+import time  # Monotonic clock for local entry expiry
+from collections import OrderedDict  # Ordered dict gives us O(1) LRU bookkeeping
+
+from django.conf import settings  # Cache sizing/TTL knobs live in settings.py
+from django.contrib import auth  # Session-based user resolution (cache misses)
+from django.core.cache import cache  # Shared cache layer (per-node or cluster wide)
+from django.db import transaction  # Invalidations repeated after commit
+
+from .models import ChatRoom  # Room metadata we cache
+
+# Sentinel returned by LRUCache.get() when a key is absent or expired
+MISSING = object()
+
+# Tunables (see settings.py for documentation)
+LOCAL_MAXSIZE = getattr(settings, 'CHAT_CACHE_LOCAL_MAXSIZE', 1024)  # Max entries kept per process
+LOCAL_TTL = getattr(settings, 'CHAT_CACHE_LOCAL_TTL', 5)  # Seconds a local entry may be served
+SHARED_TIMEOUT = getattr(settings, 'CHAT_CACHE_TIMEOUT', 300)  # Seconds an entry lives in the shared cache
+AUTH_TTL = getattr(settings, 'CHAT_AUTH_CACHE_TTL', 10)  # Seconds a resolved user may be reused
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU cache with per-entry expiry.
+
+    Entries expire after `ttl` seconds so that invalidations performed by other
+    worker processes (which can only reach the shared cache) become visible
+    within a bounded time.
+    """
+
+    def __init__(self, maxsize=1024, ttl=5):
+        self.maxsize = maxsize  # Maximum number of entries before evicting the oldest
+        self.ttl = ttl  # Lifetime of an entry in seconds
+        self._data = OrderedDict()  # key -> (expires_at, value), most recent last
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for `key`, or MISSING if absent/expired.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                # Expired entries are dropped lazily on access
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)  # Mark as most recently used
+            return value
+
+    def set(self, key, value):
+        """
+        Store `value` under `key`, evicting the least recently used entry if full.
+        """
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove `key` from the cache if present.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Drop every entry (used by tests and on invalidation storms).
+        """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# One LRU per process shared by every request thread
+local_cache = LRUCache(maxsize=LOCAL_MAXSIZE, ttl=LOCAL_TTL)
+
+# Users resolved from sessions on the polling endpoints. Process-local only:
+# user rows carry password hashes, which do not belong in a shared cache.
+user_cache = LRUCache(maxsize=LOCAL_MAXSIZE, ttl=AUTH_TTL)
+
+
+def room_key(room_id):
+    """Cache key for a room's metadata."""
+    return f'chat:room:{room_id}'
+
+
+def membership_key(user_id):
+    """Cache key for the set of room ids a user belongs to."""
+    return f'chat:members:{user_id}'
+
+
+def room_members_key(room_id):
+    """Cache key for the set of user ids belonging to a room."""
+    return f'chat:room-members:{room_id}'
+
+
+def room_version_key(room_id):
+    """Cache key for a room's activity counter (bumped on new messages/edits)."""
+    return f'chat:room-version:{room_id}'
+
+
+def user_key(user_id):
+    """Cache key for a user resolved from a session."""
+    return f'chat:user:{user_id}'
+
+
+def _cached(key, loader):
+    """
+    Two-level read-through lookup.
+
+    Args:
+        key: Cache key shared by both layers
+        loader: Callable returning the fresh value from the database
+
+    Returns:
+        The cached or freshly loaded value
+    """
+    value = local_cache.get(key)
+    if value is not MISSING:
+        return value
+
+    value = cache.get(key, MISSING)
+    if value is MISSING:
+        value = loader()
+        if value is None:
+            # Missing rows are not cached so newly created rooms show up at once
+            return None
+        cache.set(key, value, SHARED_TIMEOUT)
+
+    local_cache.set(key, value)
+    return value
+
+
+def get_room(room_id):
+    """
+    Return the ChatRoom with `room_id` or None if it does not exist.
+
+    The returned instance comes from the cache and should be treated as
+    read-only metadata (name, is_group, created_by_id, ...).
+    """
+    try:
+        room_id = int(room_id)
+    except (TypeError, ValueError):
+        return None
+    return _cached(room_key(room_id), lambda: ChatRoom.objects.filter(id=room_id).first())
+
+
+def get_user_room_ids(user_id):
+    """
+    Return a frozenset with the ids of every room `user_id` is a member of.
+    """
+    return _cached(
+        membership_key(user_id),
+        lambda: frozenset(
+            ChatRoom.members.through.objects.filter(user_id=user_id).values_list('chatroom_id', flat=True)
+        ),
+    )
+
+
+def get_room_member_ids(room_id):
+    """
+    Return a frozenset with the ids of every member of `room_id`.
+    """
+    return _cached(
+        room_members_key(room_id),
+        lambda: frozenset(
+            ChatRoom.members.through.objects.filter(chatroom_id=room_id).values_list('user_id', flat=True)
+        ),
+    )
+
+
+def is_member(user, room_id):
+    """
+    Check whether `user` belongs to the room with `room_id`.
+
+    Args:
+        user: Django user (anonymous users are never members)
+        room_id: Primary key of the chat room
+
+    Returns:
+        True if the user is a member of the room
+    """
+    if not user.is_authenticated:
+        return False
+    return int(room_id) in get_user_room_ids(user.id)
+
+
+def invalidate_room(room_id):
+    """Forget cached metadata for a room in this process and the shared cache."""
+    key = room_key(room_id)
+    local_cache.delete(key)
+    cache.delete(key)
+
+
+def invalidate_room_members(room_ids):
+    """Forget cached member sets for the given rooms."""
+    keys = [room_members_key(room_id) for room_id in room_ids]
+    for key in keys:
+        local_cache.delete(key)
+    if keys:
+        cache.delete_many(keys)
+
+
+def invalidate_after_commit(func, *args, using=None):
+    """
+    Run an invalidation now and once more when the current transaction commits.
+
+    Until the commit, other connections still read the old rows, so a request
+    that misses the cache in that window stores the old state again (for
+    SHARED_TIMEOUT). The run after the commit removes that copy; the immediate
+    run keeps reads inside the transaction itself consistent. Outside a
+    transaction both happen at once.
+
+    Args:
+        func: Invalidation function (invalidate_room, touch_room, ...)
+        *args: Its arguments
+        using: Database alias of the transaction that made the change
+    """
+    func(*args)
+    transaction.on_commit(lambda: func(*args), using=using)
+
+
+def touch_room(room_id):
+    """
+    Bump a room's activity counter so cached sidebars that show it are rebuilt.
+
+    Only the shared cache is used: versions must be consistent across workers.
+    """
+    key = room_version_key(room_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Counter missing or evicted; any new value differs from what was cached
+        cache.set(key, time.time_ns(), None)
+
+
+def sidebar_version(user):
+    """
+    Return a short string that changes whenever the user's sidebar would.
+
+    Combines the user's (cached) room ids with each room's activity counter,
+    fetched in a single get_many() call, so checking whether the sidebar
+    fragment is still valid needs no database query.
+    """
+    if not user.is_authenticated:
+        return 'anonymous'
+    room_ids = sorted(get_user_room_ids(user.id))
+    versions = cache.get_many([room_version_key(room_id) for room_id in room_ids])
+    raw = ','.join(f'{room_id}:{versions.get(room_version_key(room_id), 0)}' for room_id in room_ids)
+    return hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+
+
+def invalidate_memberships(user_ids):
+    """Forget cached membership sets for the given users."""
+    keys = [membership_key(user_id) for user_id in user_ids]
+    for key in keys:
+        local_cache.delete(key)
+    if keys:
+        cache.delete_many(keys)
+
+
+def get_request_user(request):
+    """
+    Resolve the user for `request` like django.contrib.auth.get_user(), reusing
+    a recently loaded User instead of querying auth_user on every poll.
+
+    An entry is only reused for sessions carrying the same backend and session
+    auth hash it was verified against, so a password change (which changes
+    the hash) still signs other sessions out, at the latest after AUTH_TTL.
+
+    Returns:
+        A User (a copy private to this request) or AnonymousUser
+    """
+    session = request.session
+    user_id = session.get(auth.SESSION_KEY)
+    credentials = (session.get(auth.BACKEND_SESSION_KEY), session.get(auth.HASH_SESSION_KEY))
+    if user_id is None or not all(credentials):
+        return auth.get_user(request)
+
+    key = user_key(user_id)
+    entry = user_cache.get(key)
+    if entry is not MISSING and entry[0] == credentials:
+        return copy.copy(entry[1])
+
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        # get_user() may have rotated the hash (SECRET_KEY_FALLBACKS); store the current one
+        credentials = (session.get(auth.BACKEND_SESSION_KEY), session.get(auth.HASH_SESSION_KEY))
+        user_cache.set(key, (credentials, copy.copy(user)))
+    return user
+
+
+def invalidate_user(user_id):
+    """Forget the resolved user for `user_id` in this process."""
+    user_cache.delete(user_key(user_id))
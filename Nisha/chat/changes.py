@@ -0,0 +1,139 @@
+# Message edits, deletions and the per-room change feed
+# Every change of a room message (sending, editing, deleting) stamps it with
+# the next number of its room's change sequence (Message.seq); other saves,
+# such as marking it read, keep the number. Deleted messages keep their row
+# as a tombstone: content emptied, deleted_at set. So the rows
+# with seq > N are exactly the messages that changed since a client last saw
+# sequence number N, each in its latest state, and a client that applies them
+# (insert, replace, or remove tombstones) converges without reloading history.
+#
+# The number is computed by the database inside the INSERT/UPDATE statement
+# itself (MAX(seq) + 1 for the room), so two writers cannot take the same
+# number on SQLite; the unique (chat_room, seq) constraint guards the rest.
+# Writes on a shard happen in that shard's database, so a room's sequence
+# stays in the same transaction as its messages and moves with them.
+#
+# The event log (chat/eventlog.py) is append-only: deleting a message empties
+# the row, but the text stays in its earlier 'message.created' and
+# 'message.edited' events, which staff and consumers can read. Purging text
+# for good means deleting those events as well.
+
+from django.db import transaction  # Changes and their event log entries commit together
+from django.conf import settings  # Page sizes
+from django.db.models import Max, Subquery, Value  # Next sequence number as a SQL expression
+from django.db.models.functions import Coalesce  # Sequence of a room without messages yet
+from django.utils import timezone  # edited_at / deleted_at timestamps
+
+from . import eventlog  # 'message.edited' / 'message.deleted' events
+from . import sharding  # Which database holds a room's messages
+from .models import Message  # Rows carrying the sequence numbers
+
+# Changes returned per request by the change feed
+PAGE_SIZE = 200
+
+# Messages per page of room history (get_room_messages)
+MESSAGE_PAGE_SIZE = getattr(settings, 'CHAT_MESSAGE_PAGE_SIZE', 50)
+
+
+def next_seq(room_id):
+    """
+    SQL expression for the next change sequence number of `room_id`.
+
+    Assign it to Message.seq before saving; the database evaluates it in
+    the same statement that writes the row.
+    """
+    latest = (
+        Message.objects.filter(chat_room_id=room_id)
+        .order_by()
+        .values('chat_room_id')
+        .annotate(last=Max('seq'))
+        .values('last')
+    )
+    return Coalesce(Subquery(latest), Value(0)) + 1
+
+
+def edit_message(message, content):
+    """
+    Replace a message's content and record the change.
+
+    Args:
+        message: Message loaded from the database that stores it
+        content: New message text
+
+    Returns:
+        The updated message (with its new seq)
+    """
+    with transaction.atomic(using=message._state.db):
+        message.content = content
+        message.edited_at = timezone.now()
+        message.save(update_fields=['content', 'edited_at'])
+        eventlog.append(
+            'message.edited',
+            {'message_id': message.id, 'seq': message.seq, 'content': content},
+            room_id=message.chat_room_id,
+            user_id=message.user_id,
+            using=message._state.db,
+        )
+    return message
+
+
+def delete_message(message):
+    """
+    Turn a message into a tombstone and record the change.
+
+    The row is kept (without its content) so clients following the change
+    feed learn about the deletion. The event log keeps the text of earlier
+    events; the 'message.deleted' event carries none.
+
+    Returns:
+        The tombstone (with its new seq)
+    """
+    with transaction.atomic(using=message._state.db):
+        message.content = ''
+        message.deleted_at = timezone.now()
+        message.save(update_fields=['content', 'deleted_at'])
+        eventlog.append(
+            'message.deleted',
+            {'message_id': message.id, 'seq': message.seq},
+            room_id=message.chat_room_id,
+            user_id=message.user_id,
+            using=message._state.db,
+        )
+    return message
+
+
+def changes_since(room_id, since, limit=PAGE_SIZE):
+    """
+    Messages of `room_id` created, edited or deleted after sequence number `since`.
+
+    Returns:
+        (messages ordered by seq, True when more changes remain after them)
+    """
+    rows = list(sharding.room_messages(room_id).filter(seq__gt=since).order_by('seq')[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def current_seq(room_id):
+    """Latest change sequence number of `room_id` (0 for a room without messages)."""
+    return sharding.room_messages(room_id).aggregate(last=Max('seq'))['last'] or 0
+
+
+def message_page(room_id, before=None, after=None, limit=MESSAGE_PAGE_SIZE):
+    """
+    One page of a room's history, oldest first, without deleted messages.
+
+    Without cursors this is the newest page. `before` pages backwards from a
+    message id (loading older history), `after` forwards (catching up).
+
+    Returns:
+        (messages, True when more messages exist beyond the page in the
+        direction of travel)
+    """
+    messages = sharding.room_messages(room_id).filter(deleted_at__isnull=True)
+    if after is not None:
+        rows = list(messages.filter(id__gt=after).order_by('id')[:limit + 1])
+        return rows[:limit], len(rows) > limit
+    if before is not None:
+        messages = messages.filter(id__lt=before)
+    rows = list(messages.order_by('-id')[:limit + 1])
+    return rows[:limit][::-1], len(rows) > limit
@@ -0,0 +1,174 @@
+# Chat event log and consumers
+# Every change other parts of the system may care about (new messages today;
+# edits, uploads, ... later) is appended to the ChatEvent table in the same
+# transaction as the change itself. Downstream projections (unread counters,
+# search, rollups, push) do not hook into the write path: they are consumers
+# that tail the log in batches, each remembering its position in a
+# ConsumerCheckpoint row, and run in `manage.py consume_events`.
+#
+# A consumer's handle() runs in the same transaction that advances its
+# checkpoint, so projections stored in the database see every event exactly
+# once. Rebuilding a projection is reset() followed by a replay from id 0.
+#
+# Ordering note: consumers rely on ids committing in increasing order. SQLite
+# serializes writers, which guarantees it; on databases with concurrent
+# writers a consumer may need to lag slightly behind the newest ids.
+#
+# With message sharding (chat/sharding.py) each shard has its own log, written
+# in the same database transaction as the message. Consumers tail every log
+# with one checkpoint per database ('<name>' for default, '<name>@shardN').
+
+import time  # Poll interval for the consumer loop
+
+from django.conf import settings  # CHAT_EVENT_CONSUMERS lists the enabled consumers
+from django.db import transaction  # Events and checkpoints are written transactionally
+from django.utils.module_loading import import_string  # Loading consumers from settings
+
+from .models import ChatEvent, ConsumerCheckpoint  # Log and consumer positions
+
+# Default number of events a consumer processes per transaction
+BATCH_SIZE = getattr(settings, 'CHAT_EVENT_BATCH_SIZE', 500)
+
+
+def append(kind, payload=None, room_id=None, user_id=None, using='default'):
+    """
+    Append an event to the log.
+
+    Call inside the transaction that performs the change being described so
+    the event exists if and only if the change was committed.
+
+    Args:
+        kind: Dotted event name, e.g. 'message.created'
+        payload: JSON-serializable details
+        room_id: Room the event belongs to, if any
+        user_id: User who caused the event, if any
+        using: Database of the change (the log on that database is used)
+
+    Returns:
+        The created ChatEvent
+    """
+    return ChatEvent.objects.using(using).create(kind=kind, payload=payload or {}, room_id=room_id, user_id=user_id)
+
+
+def log_aliases():
+    """Databases holding an event log: 'default' plus every message shard."""
+    from . import sharding  # Imported lazily: sharding imports the room cache
+
+    return ['default'] + sharding.shard_aliases()
+
+
+def checkpoint_name(consumer, alias):
+    """Checkpoint key of `consumer` for the log on `alias`."""
+    return consumer.name if alias == 'default' else f'{consumer.name}@{alias}'
+
+
+class Consumer:
+    """
+    Base class for event log consumers.
+
+    Subclasses set `name` (the checkpoint key, keep it stable), optionally
+    `kinds` to receive only some events, and implement handle(). Consumers
+    that keep derived state should implement reset() so they can be rebuilt.
+    """
+
+    name = None  # Unique, stable identifier
+    kinds = None  # Iterable of event kinds to receive (None = everything)
+    batch_size = BATCH_SIZE  # Events read per transaction
+
+    def handle(self, events):
+        """
+        Process a batch of events (oldest first).
+
+        Runs inside the transaction that advances the checkpoint: raising
+        rolls the batch back and it is retried on the next run.
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        """
+        Delete everything this consumer derived, before a replay from the start.
+        """
+
+
+def consume(consumer, max_batches=None):
+    """
+    Feed `consumer` the events after its checkpoints until the logs are drained.
+
+    Args:
+        consumer: Consumer instance
+        max_batches: Optional cap on the number of batches processed per log
+
+    Returns:
+        Number of log entries the checkpoints advanced over
+    """
+    return sum(_consume_log(consumer, alias, max_batches) for alias in log_aliases())
+
+
+def _consume_log(consumer, alias, max_batches):
+    """
+    consume() for the log stored on one database.
+
+    Checkpoints (and whatever handle() writes) live in 'default'; only the
+    events are read from `alias`.
+    """
+    processed = 0
+    batches = 0
+    kinds = set(consumer.kinds) if consumer.kinds is not None else None
+    name = checkpoint_name(consumer, alias)
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            checkpoint, _ = ConsumerCheckpoint.objects.select_for_update().get_or_create(name=name)
+            batch = list(
+                ChatEvent.objects.using(alias).filter(id__gt=checkpoint.position).order_by('id')[:consumer.batch_size]
+            )
+            if not batch:
+                break
+            relevant = batch if kinds is None else [event for event in batch if event.kind in kinds]
+            if relevant:
+                consumer.handle(relevant)
+            # Advance past irrelevant events too, so they are not read again
+            checkpoint.position = batch[-1].id
+            checkpoint.save(update_fields=['position', 'updated_at'])
+        processed += len(batch)
+        batches += 1
+        if len(batch) < consumer.batch_size:
+            break
+    return processed
+
+
+def rebuild(consumer):
+    """
+    Reset `consumer`'s projection and replay the whole log into it.
+
+    Returns:
+        Number of log entries replayed
+    """
+    with transaction.atomic():
+        consumer.reset()
+        ConsumerCheckpoint.objects.filter(
+            name__in=[checkpoint_name(consumer, alias) for alias in log_aliases()]
+        ).update(position=0)
+    return consume(consumer)
+
+
+def get_consumers():
+    """
+    Instantiate the consumers listed in settings.CHAT_EVENT_CONSUMERS.
+
+    Returns:
+        Dictionary of consumer name -> Consumer instance
+    """
+    consumers = {}
+    for path in getattr(settings, 'CHAT_EVENT_CONSUMERS', []):
+        consumer = import_string(path)()
+        consumers[consumer.name] = consumer
+    return consumers
+
+
+def run_forever(consumers, interval=1.0):
+    """
+    Tail the log, feeding every consumer, sleeping `interval` seconds when idle.
+    """
+    while True:
+        if not sum(consume(consumer) for consumer in consumers):
+            time.sleep(interval)
@@ -0,0 +1,144 @@
+# Ephemeral room events (typing indicators, "active in room")
+# These signals are short-lived and lossy by design, so they never touch the
+# database: each room's live events are one entry in the shared cache
+# (CACHES, the node-wide SQLite cache by default) that every worker process
+# reads and writes, and they expire after a few seconds. A user typing on one
+# worker is therefore seen by members polling any other worker. Repeated
+# events from the same user are coalesced so a fast typist produces a bounded
+# number of events regardless of keystroke rate.
+#
+# With the per-process 'locmem' cache backend events only reach members
+# served by the same worker.
+
+import time  # Wall-clock expiry, shared by every process on the node
+
+from django.conf import settings  # Event tunables live in settings.py
+from django.core.cache import cache  # Shared by all workers
+
+# Seconds an event stays visible after it was last refreshed
+EVENT_TTL = getattr(settings, 'CHAT_EVENT_TTL', 5)
+
+# Minimum seconds between two broadcast events for the same user/room/kind
+EVENT_MIN_INTERVAL = getattr(settings, 'CHAT_EVENT_MIN_INTERVAL', 0.5)
+
+# Upper bound on buffered events per room (protects large group chats)
+EVENT_ROOM_LIMIT = getattr(settings, 'CHAT_EVENT_ROOM_LIMIT', 50)
+
+# Event kinds clients may publish
+EVENT_KINDS = ('typing', 'active', 'stopped')
+
+
+class EphemeralChannel:
+    """
+    Cache-backed publish/poll channel for short-lived room events.
+
+    publish() is rate limited and coalesced per (room, user, kind): within
+    `min_interval` of the last broadcast the existing event is only refreshed
+    (its expiry extended) instead of adding a new one. A room holds at most
+    one live event per (user, kind), so poll() responses are bounded by the
+    number of active users rather than by how fast they type.
+
+    With chat.sqlite_cache.SQLiteCache each publish updates the room in one
+    atomic step; other backends read and write separately, so a concurrent
+    publish to the same room can occasionally be lost, which is acceptable
+    for typing indicators.
+    """
+
+    prefix = 'chat:events:'
+
+    def __init__(self, ttl=5, min_interval=0.5, room_limit=50, backend=None):
+        self.ttl = ttl  # Seconds an event stays visible
+        self.min_interval = min_interval  # Coalescing window per user/room/kind
+        self.room_limit = room_limit  # Max live events per room
+        self.backend = backend or cache  # Cache shared by the processes that publish and poll
+
+    def publish(self, room_id, user_id, username, kind, now=None):
+        """
+        Publish an event for a room, coalescing bursts.
+
+        Args:
+            room_id: Room the event belongs to
+            user_id: User emitting the event
+            username: Display name sent to other members
+            kind: One of EVENT_KINDS
+            now: Optional wall-clock timestamp, mainly for tests
+
+        Returns:
+            The new event dict, or None if it was coalesced into an existing one
+        """
+        now = time.time() if now is None else now
+        result = []
+
+        def apply(events):
+            # {'<user_id>:<kind>': event} without the expired events
+            events = {name: e for name, e in (events or {}).items() if e['expires_at'] > now}
+            name = f'{user_id}:{kind}'
+            latest = events.get(name)
+            if latest is not None and now - latest['broadcast_at'] < self.min_interval:
+                # Within the window: keep the existing event alive, broadcast nothing new
+                latest['expires_at'] = now + self.ttl
+                return events
+
+            if kind == 'stopped':
+                # A stop cancels the user's typing indicator right away; it is
+                # not broadcast itself because poll() returns a live snapshot
+                events.pop(f'{user_id}:typing', None)
+                return events
+
+            event = {
+                'seq': int(now * 1000000),  # Orders events across processes
+                'kind': kind,
+                'user_id': user_id,
+                'username': username,
+                'broadcast_at': now,
+                'expires_at': now + self.ttl,
+            }
+            events[name] = event
+            if len(events) > self.room_limit:
+                # Drop the oldest events beyond the limit
+                for stale in sorted(events, key=lambda n: events[n]['seq'])[:len(events) - self.room_limit]:
+                    del events[stale]
+            result.append(event)
+            return events
+
+        key = self.prefix + str(room_id)
+        # The whole room expires once its newest event has
+        timeout = int(self.ttl) + 1
+        if hasattr(self.backend, 'update'):
+            self.backend.update(key, apply, timeout)
+        else:
+            self.backend.set(key, apply(self.backend.get(key)), timeout)
+        return result[0] if result else None
+
+    def poll(self, room_id, exclude_user_id=None, now=None):
+        """
+        Return a snapshot of the live events in a room.
+
+        Args:
+            room_id: Room to read
+            exclude_user_id: Skip events emitted by this user (the poller)
+            now: Optional wall-clock timestamp, mainly for tests
+
+        Returns:
+            List of event dicts (without internal fields), oldest first,
+            with at most one event per (user, kind)
+        """
+        now = time.time() if now is None else now
+        events = self.backend.get(self.prefix + str(room_id))
+        if not events:
+            return []
+        live = [
+            e for e in events.values()
+            if e['expires_at'] > now and e['user_id'] != exclude_user_id
+        ]
+        return [
+            {'seq': e['seq'], 'kind': e['kind'], 'user_id': e['user_id'], 'username': e['username']}
+            for e in sorted(live, key=lambda e: e['seq'])
+        ]
+
+    def reset(self):
+        """Rooms expire from the shared cache on their own; nothing to do."""
+
+
+# Process-wide channel used by the chat views
+channel = EphemeralChannel(ttl=EVENT_TTL, min_interval=EVENT_MIN_INTERVAL, room_limit=EVENT_ROOM_LIMIT)
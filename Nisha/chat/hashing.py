@@ -0,0 +1,172 @@
+# Bounded password hashing
+# PBKDF2 is deliberately slow (hundreds of milliseconds of CPU per hash). Run
+# on the request threads, a burst of logins or signups can occupy every web
+# worker and starve chat polling. Here the hashing itself (never database
+# access) runs on a small dedicated thread pool with a bounded queue: once
+# the queue is full new attempts fail fast with HashingBusy, which the views
+# and chat.middleware.HashingBusyMiddleware turn into 503 + Retry-After.
+#
+# hashlib's PBKDF2 releases the GIL, so the pool size is the number of CPU
+# cores hashing may use at once.
+
+import threading  # Queue slot accounting and statistics
+import time  # Wait/run durations for the statistics
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError  # The hashing pool
+
+from django.conf import settings  # Pool sizing lives in settings.py
+from django.contrib.auth import hashers  # Django's password hashers
+
+
+class HashingBusy(Exception):
+    """
+    Raised when the hashing queue is full or a hash did not finish in time.
+
+    Attributes:
+        retry_after: Suggested seconds before retrying
+    """
+
+    def __init__(self, retry_after=1):
+        super().__init__('Password hashing is busy, please retry')
+        self.retry_after = retry_after
+
+
+class HashingExecutor:
+    """
+    Thread pool for password hashing with a hard cap on queued work.
+
+    Args:
+        workers: Threads hashing concurrently
+        queue_limit: Extra jobs allowed to wait for a free thread
+        timeout: Seconds a caller waits for its result before giving up
+    """
+
+    def __init__(self, workers=2, queue_limit=8, timeout=10):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)  # Running + waiting jobs
+        self._pool = None  # Created on first use so importing this module starts no threads
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+        self._completed = 0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hashing')
+            return self._pool
+
+    def run(self, func, *args):
+        """
+        Run `func(*args)` on the pool and return its result.
+
+        Raises:
+            HashingBusy: If every slot is taken or the result is late
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashingBusy(retry_after=1)
+
+        queued_at = time.perf_counter()
+        with self._lock:
+            self._submitted += 1
+            self._in_flight += 1
+            self._peak = max(self._peak, self._in_flight)
+
+        def job():
+            started_at = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                finished_at = time.perf_counter()
+                with self._lock:
+                    self._in_flight -= 1
+                    self._completed += 1
+                    self._wait_total += started_at - queued_at
+                    self._run_total += finished_at - started_at
+                self._slots.release()
+
+        try:
+            future = self._get_pool().submit(job)
+        except RuntimeError:
+            # Pool shut down (interpreter exit); give the slot back
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+            raise HashingBusy(retry_after=1)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The job keeps its slot until it finishes, so backpressure still holds
+            with self._lock:
+                self._timed_out += 1
+            raise HashingBusy(retry_after=self.timeout)
+
+    def stats(self):
+        """
+        Return queue depth and timing counters for monitoring.
+        """
+        with self._lock:
+            completed = self._completed or 1
+            return {
+                'workers': self.workers,
+                'queue_limit': self.queue_limit,
+                'in_flight': self._in_flight,
+                'queued': max(0, self._in_flight - self.workers),
+                'peak_in_flight': self._peak,
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+                'completed': self._completed,
+                'avg_wait_ms': round(self._wait_total / completed * 1000, 2),
+                'avg_hash_ms': round(self._run_total / completed * 1000, 2),
+            }
+
+
+# Process-wide pool used by registration and the authentication backend
+executor = HashingExecutor(
+    workers=getattr(settings, 'CHAT_HASHING_WORKERS', 2),
+    queue_limit=getattr(settings, 'CHAT_HASHING_QUEUE', 8),
+    timeout=getattr(settings, 'CHAT_HASHING_TIMEOUT', 10),
+)
+
+
+def make_password(raw_password):
+    """
+    Hash `raw_password` with the default hasher on the bounded pool.
+    """
+    return executor.run(hashers.make_password, raw_password)
+
+
+def set_password(user, raw_password):
+    """
+    Equivalent of user.set_password() that hashes on the bounded pool.
+    """
+    user.password = make_password(raw_password)
+    user._password = raw_password  # Lets password validators see the change on save(), as Django does
+
+
+def check_password(user, raw_password):
+    """
+    Equivalent of user.check_password() that hashes on the bounded pool.
+
+    Hashes created with outdated parameters are upgraded and saved on the
+    calling thread, keeping all database access off the pool.
+    """
+    encoded = user.password
+    if not executor.run(hashers.check_password, raw_password, encoded):
+        return False
+    preferred = hashers.get_hasher('default')
+    if hashers.identify_hasher(encoded).algorithm != preferred.algorithm or preferred.must_update(encoded):
+        set_password(user, raw_password)
+        user._password = None
+        user.save(update_fields=['password'])
+    return True
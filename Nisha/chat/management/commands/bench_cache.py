@@ -0,0 +1,148 @@
+# Benchmark for the shared cache backends
+# Runs the chat and weather caching workloads against Django's LocMemCache,
+# Django's DatabaseCache (a throwaway table in the default database) and
+# chat.sqlite_cache.SQLiteCache (a throwaway file), first in this process and
+# then from several forked worker processes at once. The counter workload
+# also checks whether increments from concurrent workers are lost.
+#
+# Usage: python manage.py bench_cache [--ops 20000] [--processes 4]
+
+import multiprocessing  # Concurrent worker processes
+import os  # Temporary cache file
+import random  # Workload key selection
+import tempfile  # Temporary cache file
+import time  # High resolution timer
+
+from django.core.cache.backends.db import DatabaseCache  # Django's database cache
+from django.core.cache.backends.locmem import LocMemCache  # Django's per-process cache
+from django.core.management.base import BaseCommand  # Management command base class
+from django.core.management.commands.createcachetable import Command as CreateCacheTable  # DatabaseCache table
+from django.db import connection, connections  # Dropping the table, closing before fork
+
+from chat.sqlite_cache import SQLiteCache  # Backend under test
+
+TABLE = 'chat_bench_cache'
+PARAMS = {'OPTIONS': {'MAX_ENTRIES': 20000}}
+
+
+def make_backend(name, path):
+    """Fresh instance of the backend called `name` (safe to call in a child process)."""
+    if name == 'locmem':
+        return LocMemCache('chat-bench', PARAMS)
+    if name == 'db':
+        return DatabaseCache(TABLE, PARAMS)
+    return SQLiteCache(path, PARAMS)
+
+
+def chat_workload(cache, ops, seed):
+    """
+    Polling traffic: sidebar version lookups (get_many over a user's rooms),
+    room/membership reads, occasional invalidations and activity counter bumps.
+    """
+    rng = random.Random(seed)
+    room = {'name': 'Room', 'is_group': True, 'created_by_id': 1}
+    for _ in range(ops):
+        roll = rng.random()
+        room_id = rng.randrange(500)
+        if roll < 0.50:
+            cache.get(f'chat:room:{room_id}')
+        elif roll < 0.80:
+            cache.get_many([f'chat:room-version:{rng.randrange(500)}' for _ in range(10)])
+        elif roll < 0.95:
+            cache.set(f'chat:room:{room_id}', room, 300)
+        else:
+            try:
+                cache.incr(f'chat:room-version:{room_id}')
+            except ValueError:
+                cache.set(f'chat:room-version:{room_id}', 1, None)
+
+
+def weather_workload(cache, ops, seed):
+    """Read-through cache of ~2 KB weather reports for a few dozen cities."""
+    rng = random.Random(seed)
+    report = {'city': '', 'hourly': [{'temp': 20, 'desc': 'Partly cloudy'}] * 40}
+    for _ in range(ops):
+        key = f'weather:city{rng.randrange(40)}'
+        if cache.get(key) is None:
+            cache.set(key, report, 600)
+
+
+def counter_workload(cache, ops, seed):
+    """Every operation increments one shared counter."""
+    for _ in range(ops):
+        cache.incr('bench:counter')
+
+
+WORKLOADS = {'chat': chat_workload, 'weather': weather_workload, 'counter': counter_workload}
+
+
+def worker(backend, path, workload, ops, seed, results):
+    cache = make_backend(backend, path)
+    start = time.perf_counter()
+    WORKLOADS[workload](cache, ops, seed)
+    results.put(time.perf_counter() - start)
+
+
+class Command(BaseCommand):
+    help = 'Compare LocMem, database and SQLite cache backends on the chat and weather workloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ops', type=int, default=20000, help='Operations per workload and process')
+        parser.add_argument('--processes', type=int, default=4, help='Concurrent worker processes')
+
+    def handle(self, *args, **options):
+        ops, processes = options['ops'], options['processes']
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, 'cache.sqlite3')
+        creator = CreateCacheTable()
+        creator.verbosity = 0
+        creator.create_table('default', TABLE, False)
+        try:
+            self.stdout.write(f'{"backend":8} {"workload":8} {"1 process":>14} {f"{processes} processes":>14}  counter')
+            for backend in ('locmem', 'db', 'sqlite'):
+                for workload in WORKLOADS:
+                    single = self.run_single(backend, path, workload, ops)
+                    multi, total = self.run_multi(backend, path, workload, ops, processes)
+                    note = ''
+                    if workload == 'counter':
+                        note = f'{total}/{ops * processes}' + (' (not shared)' if backend == 'locmem' else '')
+                    self.stdout.write(f'{backend:8} {workload:8} {single:10.0f} op/s {multi:10.0f} op/s  {note}')
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE {connection.ops.quote_name(TABLE)}')
+            directory.cleanup()
+
+    def run_single(self, backend, path, workload, ops):
+        cache = make_backend(backend, path)
+        cache.clear()
+        cache.set('bench:counter', 0, None)
+        start = time.perf_counter()
+        WORKLOADS[workload](cache, ops, seed=0)
+        return ops / (time.perf_counter() - start)
+
+    def run_multi(self, backend, path, workload, ops, processes):
+        """
+        Run the workload in `processes` forked workers at once.
+
+        Returns:
+            (total operations per second, final shared counter value)
+        """
+        cache = make_backend(backend, path)
+        cache.clear()
+        cache.set('bench:counter', 0, None)
+        connections.close_all()  # Children must open their own database connections
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        children = [
+            context.Process(target=worker, args=(backend, path, workload, ops, seed, results))
+            for seed in range(processes)
+        ]
+        start = time.perf_counter()
+        for child in children:
+            child.start()
+        for child in children:
+            child.join()
+        elapsed = time.perf_counter() - start
+        for _ in children:
+            results.get()
+        return ops * processes / elapsed, cache.get('bench:counter')
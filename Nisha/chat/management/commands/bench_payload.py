@@ -0,0 +1,91 @@
+# Response size benchmark for the chat polling endpoints
+# Builds a throwaway user with a few busy rooms (rolled back afterwards), then
+# requests the room message list, the sync poll and the chat page through the
+# full middleware stack and reports the bytes sent for every combination of
+# schema (full / ?compact=1) and content encoding (identity / gzip / br).
+#
+# Usage: python manage.py bench_payload [--rooms 10] [--messages 50]
+
+from django.contrib.auth.models import User  # Throwaway benchmark user
+from django.core.management.base import BaseCommand, CommandError  # Management command base class
+from django.db import transaction  # Everything created here is rolled back
+from django.test import Client  # Requests through the real middleware stack
+
+from chat import ratelimit  # Rules are lifted while measuring
+from chat import sharding  # Messages are created where their room lives
+from chat.middleware import brotli  # None when the optional package is missing
+from chat.models import ChatRoom  # Benchmark rooms
+
+ENCODINGS = ['identity', 'gzip', 'br']
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark data."""
+
+
+class Command(BaseCommand):
+    help = 'Report bytes per poll for the chat endpoints, plain vs compact and per encoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=10, help='Rooms the benchmark user belongs to')
+        parser.add_argument('--messages', type=int, default=50, help='Messages per room')
+
+    def handle(self, *args, **options):
+        if brotli is None:
+            self.stdout.write('brotli is not installed: br rows fall back to identity/gzip')
+        # The benchmark polls far faster than the rate limits allow
+        rules = dict(ratelimit.rules)
+        ratelimit.rules.clear()
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            ratelimit.rules.update(rules)
+
+    def run(self, options):
+        user = User.objects.create_user('bench-payload', password='bench-payload')
+        other = User.objects.create_user('bench-payload-peer')
+        rooms = []
+        for index in range(options['rooms']):
+            room = ChatRoom.objects.create(name=f'Benchmark room {index}', created_by=user)
+            room.members.add(user, other)
+            rooms.append(room)
+            for number in range(options['messages']):
+                sender = user if number % 2 else other
+                sharding.create_message(
+                    user=sender, username=sender.username, chat_room=room,
+                    content=f'Benchmark message {number} in room {index}, roughly sentence sized.',
+                )
+
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+        caught_up = {room.id: sharding.room_messages(room.id).order_by('-id').first().id for room in rooms}
+        cases = [
+            ('room messages', 'get', f'/chat/room/{rooms[0].id}/messages/', None),
+            ('sync, first poll', 'post', '/chat/sync/', {'rooms': {}}),
+            ('sync, idle poll', 'post', '/chat/sync/', {'rooms': caught_up}),
+        ]
+
+        self.stdout.write(f'{"endpoint":18} {"schema":8} ' + ' '.join(f'{name:>9}' for name in ENCODINGS))
+        for label, method, path, body in cases:
+            for schema, suffix in [('full', ''), ('compact', '?compact=1')]:
+                sizes = [self.size(client, method, path + suffix, body, encoding) for encoding in ENCODINGS]
+                self.stdout.write(f'{label:18} {schema:8} ' + ' '.join(f'{size:9}' for size in sizes))
+        sizes = [self.size(client, 'get', '/chat/whatsapp/', None, encoding) for encoding in ENCODINGS]
+        self.stdout.write(f'{"chat page":18} {"html":8} ' + ' '.join(f'{size:9}' for size in sizes))
+
+    def size(self, client, method, path, body, encoding):
+        """Bytes on the wire (body only) for one request."""
+        headers = {'HTTP_ACCEPT_ENCODING': encoding}
+        if method == 'post':
+            response = client.post(path, body, content_type='application/json', **headers)
+        else:
+            response = client.get(path, **headers)
+        if response.status_code != 200:
+            raise CommandError(f'{method.upper()} {path} returned {response.status_code}')
+        if response.streaming:
+            return sum(len(chunk) for chunk in response.streaming_content)
+        return len(response.content)
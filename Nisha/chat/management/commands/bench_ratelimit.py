@@ -0,0 +1,40 @@
+# Benchmark for the token bucket rate limiter
+# Measures the per-request bookkeeping cost of each backend so we can keep
+# the limiter inside its microsecond-scale budget. With --budget-us the
+# command fails when the local backend exceeds it; wall-clock budgets belong
+# here (run on a quiet machine), not in the test suite.
+#
+# Usage: python manage.py bench_ratelimit [--iterations 200000] [--budget-us 20]
+
+import time  # High resolution timer
+
+from django.core.management.base import BaseCommand, CommandError  # Command plumbing
+
+from chat import ratelimit  # Backends and rule parsing under test
+
+
+class Command(BaseCommand):
+    help = 'Measure token bucket overhead per request for each backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200_000, help='consume() calls per backend')
+        parser.add_argument('--keys', type=int, default=1000, help='Distinct clients to spread calls over')
+        parser.add_argument('--budget-us', type=float, help='Fail if the local backend needs more per request')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        keys = [f'bench:u{i}' for i in range(options['keys'])]
+        limit = ratelimit.parse_limit({'rate': '1000/s', 'burst': 1000})
+
+        for name, backend, count in (
+            ('local', ratelimit.LocalBackend(), iterations),
+            # The shared backend pays for cache round trips; sample fewer calls
+            ('cache', ratelimit.CacheBackend(), max(1, iterations // 20)),
+        ):
+            start = time.perf_counter()
+            for i in range(count):
+                backend.consume(keys[i % len(keys)], limit)
+            per_call_us = (time.perf_counter() - start) / count * 1e6
+            self.stdout.write(f'{name:>6}: {per_call_us:8.3f} us/request over {count} calls')
+            if name == 'local' and options['budget_us'] is not None and per_call_us > options['budget_us']:
+                raise CommandError(f'Local backend over budget: {per_call_us:.3f} us > {options["budget_us"]} us')
@@ -0,0 +1,80 @@
+# Benchmark for message sharding
+# Measures message write throughput with concurrent writers spread over 1, 2,
+# 4, ... shards. Each write is a full send path insert: one transaction with
+# the message and its event log entry, committed to disk.
+#
+# Usage (shards must exist: CHAT_SHARD_COUNT=4 python manage.py shards migrate):
+#   CHAT_SHARD_COUNT=4 python manage.py bench_shards [--writers 8] [--seconds 5]
+
+import itertools  # Round-robin over the benchmark rooms
+import threading  # Concurrent writers
+import time  # Timing
+
+from django.contrib.auth.models import User  # Sender of the benchmark messages
+from django.core.management.base import BaseCommand, CommandError  # Management command base class
+from django.db import connections  # Per-thread connections are closed after each run
+
+from chat import sharding  # Shard-aware message creation
+from chat.models import ChatRoom  # Benchmark rooms
+
+
+class Command(BaseCommand):
+    help = 'Measure message write throughput as the number of shards grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Concurrent writer threads')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run')
+        parser.add_argument('--rooms-per-shard', type=int, default=4)
+
+    def handle(self, *args, **options):
+        if not sharding.SHARD_COUNT:
+            raise CommandError('Sharding is disabled; set CHAT_SHARD_COUNT (and run `manage.py shards migrate`)')
+
+        counts = [1]
+        while counts[-1] * 2 <= sharding.SHARD_COUNT:
+            counts.append(counts[-1] * 2)
+
+        user, _ = User.objects.get_or_create(username='bench-shards')
+        try:
+            baseline = None
+            for shard_count in counts:
+                rate = self.run(user, shard_count, options)
+                baseline = baseline or rate
+                self.stdout.write(
+                    f'{shard_count} shard(s): {rate:8.0f} messages/s  ({rate / baseline:.2f}x)'
+                )
+        finally:
+            # Room deletion also removes their messages from the shards
+            ChatRoom.objects.filter(created_by=user).delete()
+            user.delete()
+
+    def run(self, user, shard_count, options):
+        rooms = [
+            ChatRoom.objects.create(name=f'bench {shard} {i}', created_by=user, shard=shard)
+            for shard in range(shard_count)
+            for i in range(options['rooms_per_shard'])
+        ]
+        room_cycle = itertools.cycle(rooms)
+        cycle_lock = threading.Lock()
+        written = []
+        deadline = time.monotonic() + options['seconds']
+
+        def writer():
+            count = 0
+            try:
+                while time.monotonic() < deadline:
+                    with cycle_lock:
+                        room = next(room_cycle)
+                    sharding.create_message(user=user, username=user.username, content='benchmark', chat_room=room)
+                    count += 1
+            finally:
+                written.append(count)
+                connections.close_all()
+
+        threads = [threading.Thread(target=writer) for _ in range(options['writers'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(written) / (time.monotonic() - started)
@@ -0,0 +1,78 @@
+# Cold-start budget check for the serverless entry point
+# Imports api/index.py in a fresh interpreter with `-X importtime` and resolves
+# the landing page like the first request would, then reports
+# the slowest imports and fails when the cumulative import time exceeds
+# settings.COLD_START_BUDGET_MS. Run it in CI to catch startup regressions.
+#
+# Usage: python manage.py check_cold_start [--budget-ms 600] [--runs 3] [--top 15]
+
+import os  # Environment for the child interpreter
+import subprocess  # Runs the measurement in a clean process
+import sys  # Path to the current interpreter
+
+from django.conf import settings  # Budget and project paths
+from django.core.management.base import BaseCommand, CommandError  # Command plumbing
+
+# Imported at startup by api/index.py only if someone makes them eager again
+DEFERRED_MODULES = ('requests',)
+
+
+def measure(entry_point, env):
+    """
+    Import `entry_point` in a new interpreter and parse its -X importtime output.
+
+    Returns:
+        (total_us, rows) where rows is a list of (cumulative_us, self_us, module)
+    """
+    # Import the entry point, then resolve the landing page the way the first
+    # request does (this imports the URLconf and every view module it names)
+    code = (
+        f'import runpy; runpy.run_path({str(entry_point)!r}); '
+        'from django.urls import resolve; resolve("/home/")'
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise CommandError(f'Importing {entry_point} failed:\n{result.stderr[-2000:]}')
+
+    rows, total = [], 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+        if not name.startswith('  '):
+            # Top-level imports: their cumulative times add up to the total
+            total += int(cumulative_us)
+    return total, rows
+
+
+class Command(BaseCommand):
+    help = 'Measure import time of api/index.py and fail if it exceeds the cold-start budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', type=int, default=settings.COLD_START_BUDGET_MS)
+        parser.add_argument('--runs', type=int, default=3, help='Best of N runs is compared with the budget')
+        parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to list')
+
+    def handle(self, *args, **options):
+        entry_point = settings.BASE_DIR / 'api' / 'index.py'
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='Nisha.settings', PYTHONDONTWRITEBYTECODE='')
+
+        # Best-of-N filters out scheduler noise on shared CI machines
+        total, rows = min((measure(entry_point, env) for _ in range(options['runs'])), key=lambda r: r[0])
+
+        self.stdout.write(f'Slowest imports for {entry_point.name}:')
+        for cumulative_us, self_us, name in sorted(rows, reverse=True)[:options['top']]:
+            self.stdout.write(f'  {cumulative_us / 1000:8.1f} ms  {name.strip()}')
+
+        eager = [name for name in DEFERRED_MODULES if any(row[2].strip() == name for row in rows)]
+        if eager:
+            raise CommandError(f'Deferred modules imported at startup: {", ".join(eager)}')
+
+        total_ms = total / 1000
+        self.stdout.write(f'Total import time: {total_ms:.1f} ms (budget {options["budget_ms"]} ms)')
+        if total_ms > options['budget_ms']:
+            raise CommandError(f'Cold start regressed: {total_ms:.1f} ms > {options["budget_ms"]} ms')
@@ -0,0 +1,64 @@
+# Event log consumer runner
+# Feeds the chat event log (chat/eventlog.py) to the consumers listed in
+# settings.CHAT_EVENT_CONSUMERS. Run it as a separate worker process next to
+# the web server, or periodically from cron with --once.
+#
+# Usage:
+#   python manage.py consume_events                      # Tail the log forever
+#   python manage.py consume_events --once               # Drain the backlog and exit
+#   python manage.py consume_events --rebuild NAME       # Reset a projection and replay the log
+#   python manage.py consume_events --status             # Show checkpoints and lag
+
+from django.core.management.base import BaseCommand, CommandError  # Management command base class
+from django.db.models import Max  # Newest event id for lag reporting
+
+from chat import eventlog  # Consumer framework
+from chat.models import ChatEvent, ConsumerCheckpoint  # Log and checkpoints
+
+
+class Command(BaseCommand):
+    help = 'Process the chat event log with the configured consumers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', action='append', help='Only run this consumer (repeatable)')
+        parser.add_argument('--once', action='store_true', help='Drain the backlog and exit')
+        parser.add_argument('--rebuild', metavar='NAME', help='Reset a consumer and replay the whole log')
+        parser.add_argument('--status', action='store_true', help='Print checkpoints and lag, then exit')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when idle')
+
+    def handle(self, *args, **options):
+        consumers = eventlog.get_consumers()
+
+        if options['status']:
+            positions = dict(ConsumerCheckpoint.objects.values_list('name', 'position'))
+            for alias in eventlog.log_aliases():
+                head = ChatEvent.objects.using(alias).aggregate(head=Max('id'))['head'] or 0
+                self.stdout.write(f'{alias} log head: {head}')
+                for consumer in consumers.values():
+                    position = positions.get(eventlog.checkpoint_name(consumer, alias), 0)
+                    self.stdout.write(f'  {consumer.name:30} position {position:10}  lag {head - position}')
+            return
+
+        if options['rebuild']:
+            consumer = consumers.get(options['rebuild'])
+            if consumer is None:
+                raise CommandError(f"Unknown consumer {options['rebuild']!r}")
+            replayed = eventlog.rebuild(consumer)
+            self.stdout.write(f'{consumer.name}: replayed {replayed} events')
+            return
+
+        if options['consumer']:
+            unknown = set(options['consumer']) - set(consumers)
+            if unknown:
+                raise CommandError(f'Unknown consumer(s): {", ".join(sorted(unknown))}')
+            consumers = {name: consumers[name] for name in options['consumer']}
+
+        if options['once']:
+            for consumer in consumers.values():
+                self.stdout.write(f'{consumer.name}: processed {eventlog.consume(consumer)} events')
+            return
+
+        if not consumers:
+            raise CommandError('No consumers configured (settings.CHAT_EVENT_CONSUMERS)')
+        self.stdout.write(f'Consuming events for: {", ".join(consumers)}')
+        eventlog.run_forever(list(consumers.values()), interval=options['interval'])
@@ -0,0 +1,17 @@
+# Cleanup of abandoned uploads
+# Removes unfinished uploads (and their partial files) that have not received
+# a chunk for CHAT_UPLOAD_EXPIRY_HOURS. Run it periodically, e.g. hourly from cron.
+#
+# Usage: python manage.py expire_uploads
+
+from django.core.management.base import BaseCommand  # Management command base class
+
+from chat import attachments  # Upload storage
+
+
+class Command(BaseCommand):
+    help = 'Delete unfinished file uploads older than CHAT_UPLOAD_EXPIRY_HOURS'
+
+    def handle(self, *args, **options):
+        removed = attachments.expire_uploads()
+        self.stdout.write(f'Removed {removed} abandoned upload(s)')
@@ -0,0 +1,150 @@
+# Simple HTTP load generator for comparing server configurations
+# Drives a running server with N concurrent keep-alive clients for a fixed
+# duration and reports throughput and latency percentiles.
+#
+# Workloads:
+#   homepage  GET /home/ (weather lookup, I/O bound)
+#   static    GET /home/about/ (cached page, CPU bound)
+#   polling   GET /chat/room/<id>/messages/ as a signed-in member
+#
+# Usage:
+#   python manage.py loadtest --setup                  # create loadtest user/room in the local DB
+#   python manage.py loadtest --workload polling --room 1 --concurrency 32 --duration 20
+#
+# Rate limits must be disabled on the target (CHAT_RATE_LIMITS_ENABLED=False),
+# otherwise the polling workload mostly measures 429 responses.
+
+import http.client  # Keep-alive HTTP connections (one per simulated client)
+import re  # Extracting the CSRF token from the login page
+import statistics  # Latency percentiles
+import threading  # Concurrent clients
+import time  # Timing
+from urllib.parse import urlencode, urlsplit  # Building requests
+
+from django.contrib.auth.models import User  # --setup creates a user
+from django.core.management.base import BaseCommand, CommandError  # Command plumbing
+
+from chat.models import ChatRoom, Message  # --setup creates a room with history
+
+LOADTEST_USER = 'loadtest'
+LOADTEST_PASSWORD = 'loadtest-password-123'
+
+
+class Client:
+    """
+    One simulated browser: a persistent connection plus its cookies.
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=30)
+        self.cookies = {}
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Server closed the keep-alive connection; reconnect once
+            self.connection.close()
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        data = response.read()
+        for header, value in response.getheaders():
+            if header.lower() == 'set-cookie':
+                name, _, rest = value.partition('=')
+                self.cookies[name] = rest.split(';', 1)[0]
+        return response.status, data
+
+    def login(self, username, password):
+        status, page = self.request('GET', '/login/')
+        match = re.search(rb'name="csrfmiddlewaretoken" value="([^"]+)"', page)
+        if status != 200 or not match:
+            raise CommandError('Could not load the login form')
+        body = urlencode({
+            'username': username, 'password': password, 'csrfmiddlewaretoken': match.group(1).decode(),
+        })
+        status, _ = self.request('POST', '/login/', body, {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Referer': '/login/',
+        })
+        if status != 302:
+            raise CommandError(f'Login failed with status {status}')
+
+
+class Command(BaseCommand):
+    help = 'Run a concurrent HTTP load test against a running Nisha server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--workload', choices=('homepage', 'static', 'polling'), default='polling')
+        parser.add_argument('--room', type=int, help='Room id for the polling workload')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+        parser.add_argument('--setup', action='store_true', help='Create the loadtest user and room, then exit')
+
+    def handle(self, *args, **options):
+        if options['setup']:
+            return self.setup()
+
+        path = {
+            'homepage': '/home/',
+            'static': '/home/about/',
+            'polling': f"/chat/room/{options['room']}/messages/",
+        }[options['workload']]
+        if options['workload'] == 'polling' and not options['room']:
+            raise CommandError('--room is required for the polling workload (see --setup)')
+
+        latencies, statuses = [], {}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def worker():
+            client = Client(options['base_url'])
+            if options['workload'] == 'polling':
+                client.login(LOADTEST_USER, LOADTEST_PASSWORD)
+            local_latencies, local_statuses = [], {}
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                status, _ = client.request('GET', path)
+                local_latencies.append(time.perf_counter() - start)
+                local_statuses[status] = local_statuses.get(status, 0) + 1
+            with lock:
+                latencies.extend(local_latencies)
+                for status, count in local_statuses.items():
+                    statuses[status] = statuses.get(status, 0) + count
+
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        if not latencies:
+            raise CommandError('No requests completed')
+        quantiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f"{options['workload']}: {len(latencies) / elapsed:8.1f} req/s  "
+            f"p50 {quantiles[49] * 1000:6.1f} ms  p95 {quantiles[94] * 1000:6.1f} ms  "
+            f"p99 {quantiles[98] * 1000:6.1f} ms  statuses {dict(sorted(statuses.items()))}"
+        )
+
+    def setup(self):
+        user, created = User.objects.get_or_create(username=LOADTEST_USER)
+        if created:
+            user.set_password(LOADTEST_PASSWORD)
+            user.save()
+        room, _ = ChatRoom.objects.get_or_create(name='Load test', created_by=user, defaults={'is_group': True})
+        room.members.add(user)
+        if not room.messages.exists():
+            Message.objects.bulk_create(
+                Message(user=user, username=user.username, content=f'Load test message {i}', chat_room=room)
+                for i in range(50)
+            )
+        self.stdout.write(f'Load test user "{LOADTEST_USER}" and room id {room.id} are ready')
@@ -0,0 +1,70 @@
+# Background re-rendering of stored message HTML
+# After a change to chat/rendering.py (and a RENDER_VERSION bump), messages
+# rendered by the older version keep being served as stored until this
+# command has re-rendered them. It works through the default database and
+# every message shard in id order, BATCH rows per transaction, optionally
+# pausing between batches to leave the write lock to the site.
+#
+# A message edited while its batch is being rendered keeps its new content:
+# rows are only updated if their content is still the one that was rendered.
+# The rooms of re-rendered rows are touched after each batch so cached
+# sidebars pick up the new previews.
+#
+# Usage: python manage.py rerender_messages [--batch-size 500] [--pause 0.1] [--all]
+
+import time  # Pauses between batches
+
+from django.core.management.base import BaseCommand  # Management command base class
+from django.db import transaction  # One transaction per batch
+
+from chat import cache as chat_cache  # Sidebar versions of re-rendered rooms
+from chat import rendering, sharding  # Renderer and message databases
+from chat.models import Message  # Stored messages
+
+
+def rerender(alias, batch_size=500, pause=0.0, force=False):
+    """
+    Re-render messages on `alias` produced by an older renderer (or all of them).
+
+    Returns:
+        Number of rows updated
+    """
+    stale = Message.objects.using(alias).order_by('id')
+    if not force:
+        stale = stale.filter(render_version__lt=rendering.RENDER_VERSION)
+    updated, last_id = 0, 0
+    while True:
+        batch = list(stale.filter(id__gt=last_id).only('id', 'chat_room_id', 'content')[:batch_size])
+        if not batch:
+            return updated
+        room_ids = set()
+        with transaction.atomic(using=alias):
+            for message in batch:
+                rendering.render(message)
+                if Message.objects.using(alias).filter(pk=message.pk, content=message.content).update(
+                    content_html=message.content_html,
+                    preview=message.preview,
+                    render_version=message.render_version,
+                ):
+                    updated += 1
+                    room_ids.add(message.chat_room_id)
+        room_ids.discard(None)  # Legacy messages outside rooms are in no sidebar
+        for room_id in room_ids:
+            chat_cache.touch_room(room_id)
+        last_id = batch[-1].id
+        if pause:
+            time.sleep(pause)
+
+
+class Command(BaseCommand):
+    help = 'Re-render stored message HTML and previews made by an older renderer version'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Messages per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to wait between batches')
+        parser.add_argument('--all', action='store_true', help='Re-render every message, not only stale ones')
+
+    def handle(self, *args, **options):
+        for alias in ['default'] + sharding.shard_aliases():
+            updated = rerender(alias, options['batch_size'], options['pause'], options['all'])
+            self.stdout.write(f'{alias}: re-rendered {updated} message(s) (renderer version {rendering.RENDER_VERSION})')
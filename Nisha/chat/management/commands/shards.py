@@ -0,0 +1,55 @@
+# Message shard administration (see chat/sharding.py)
+#
+# Usage:
+#   python manage.py shards status                 # Rooms and messages per database
+#   python manage.py shards migrate                # Create/upgrade the chat_message table on every shard
+#   python manage.py shards move ROOM_ID SHARD     # Move a room online (SHARD may be 'default')
+#   python manage.py shards move 12 3 --drain-seconds 30
+
+from django.core.management import call_command  # Running migrate per shard
+from django.core.management.base import BaseCommand, CommandError  # Management command base class
+
+from chat import sharding  # Shard mapping and room moves
+
+
+class Command(BaseCommand):
+    help = 'Inspect, migrate and rebalance the chat message shards'
+
+    def add_arguments(self, parser):
+        subcommands = parser.add_subparsers(dest='action', required=True)
+        subcommands.add_parser('status', help='Rooms and messages stored per database')
+        subcommands.add_parser('migrate', help='Apply migrations to every shard database')
+        move = subcommands.add_parser('move', help='Move a room to another shard while it stays online')
+        move.add_argument('room_id', type=int)
+        move.add_argument('shard', help="Target shard number, or 'default'")
+        move.add_argument('--batch-size', type=int, default=1000, help='Messages copied per batch')
+        move.add_argument(
+            '--drain-seconds', type=float, default=None,
+            help='Keep copying late writes for this long after the switch (default: cache lifetime)',
+        )
+
+    def handle(self, *args, **options):
+        if not sharding.SHARD_COUNT:
+            raise CommandError('Sharding is disabled; set CHAT_SHARD_COUNT')
+        getattr(self, f"handle_{options['action']}")(options)
+
+    def handle_status(self, options):
+        for alias, rooms, messages in sharding.status():
+            self.stdout.write(f'{alias:10} rooms {rooms:8}  messages {messages:10}')
+
+    def handle_migrate(self, options):
+        for alias in sharding.shard_aliases():
+            self.stdout.write(f'Migrating {alias}')
+            call_command('migrate', database=alias, verbosity=0)
+
+    def handle_move(self, options):
+        shard = None if options['shard'] == 'default' else int(options['shard'])
+        if shard is not None and not 0 <= shard < sharding.SHARD_COUNT:
+            raise CommandError(f'Shard must be between 0 and {sharding.SHARD_COUNT - 1} or "default"')
+        moved = sharding.move_room(
+            options['room_id'], shard,
+            batch_size=options['batch_size'],
+            drain_seconds=options['drain_seconds'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(f"Moved {moved} messages of room {options['room_id']}")
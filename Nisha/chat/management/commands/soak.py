@@ -0,0 +1,217 @@
+# Soak test for long-running servers
+# Drives a running server with the chat UI's traffic for hours (history
+# pages, change feed polls, sync requests and the occasional new message) at
+# a steady, browser-like pace, and reports every --interval seconds:
+#   requests, errors, latency percentiles and the RSS of the server processes
+#   (--pid, with their child processes, e.g. the gunicorn master).
+# At the end it compares the first and last windows (latency drift) and fits a
+# line through the RSS samples (growth in MB/hour). With --max-growth set the
+# command fails when memory grows faster, so it can gate a release.
+#
+# Run the server with CHAT_MEMORY_MONITOR=True to attribute any growth
+# (/chat/stats/memory/diff/), and with CHAT_RATE_LIMITS_ENABLED=False.
+#
+# Usage:
+#   python manage.py loadtest --setup                     # loadtest user and room
+#   python manage.py soak --room 1 --duration 4h --pid $(cat gunicorn.pid)
+
+import json  # Sync request bodies and responses
+import os  # Process table scan
+import random  # Request mix
+import statistics  # Percentiles and RSS trend
+import threading  # Concurrent clients
+import time  # Pacing and timing
+from urllib.parse import urlencode  # Form bodies
+
+from django.core.management.base import BaseCommand, CommandError  # Command plumbing
+
+from chat.memory import MB, rss_bytes  # RSS from /proc
+from .loadtest import LOADTEST_PASSWORD, LOADTEST_USER, Client  # Keep-alive client with cookies and login
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value):
+    """Seconds from '90', '90s', '30m' or '4h'."""
+    value = value.strip().lower()
+    unit = DURATION_UNITS.get(value[-1:])
+    try:
+        return float(value[:-1]) * unit if unit else float(value)
+    except ValueError:
+        raise CommandError(f'Invalid duration: {value}')
+
+
+def process_tree_rss(pids):
+    """Total RSS in bytes of `pids` and all their descendants (Linux)."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # The command name may contain spaces; fields after ')' are fixed
+                parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    total, pending, seen = 0, list(pids), set()
+    while pending:
+        pid = pending.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        total += rss_bytes(pid) or 0
+        pending.extend(children.get(pid, ()))
+    return total
+
+
+def percentile(values, fraction):
+    """Percentile of a non-empty list (nearest rank)."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Window:
+    """
+    Requests completed during one reporting interval.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self.lock:
+            self.latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+
+
+class Command(BaseCommand):
+    help = 'Drive the chat endpoints for hours and report RSS and latency drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--room', type=int, required=True, help='Room of the loadtest user (see loadtest --setup)')
+        parser.add_argument('--concurrency', type=int, default=8, help='Simulated browsers')
+        parser.add_argument('--duration', default='1h', help="Total run time ('90s', '30m', '4h')")
+        parser.add_argument('--interval', default='60s', help='Reporting window')
+        parser.add_argument('--think', type=float, default=1.0, help='Seconds each browser waits between requests')
+        parser.add_argument('--send-ratio', type=float, default=0.05, help='Share of requests that send a message')
+        parser.add_argument('--pid', type=int, action='append', default=[], help='Server process to measure (repeatable)')
+        parser.add_argument('--max-growth', type=float, help='Fail if RSS grows faster than this many MB/hour')
+
+    def handle(self, *args, **options):
+        duration = parse_duration(options['duration'])
+        interval = parse_duration(options['interval'])
+        if duration <= 0 or interval <= 0:
+            raise CommandError('--duration and --interval must be positive')
+        self.options = options
+        self.window = Window()
+        self.window_started = time.monotonic()
+        self.stop = threading.Event()
+
+        threads = [
+            threading.Thread(target=self.browser, args=(seed,), daemon=True)
+            for seed in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+
+        started = time.monotonic()
+        reports = []
+        self.stdout.write(f'{"elapsed":>8} {"req/s":>7} {"p50 ms":>7} {"p95 ms":>7} {"p99 ms":>7} {"errors":>6} {"RSS MB":>8}')
+        try:
+            while not self.stop.wait(min(interval, max(0.0, started + duration - time.monotonic()))):
+                reports.append(self.report(time.monotonic() - started))
+                if time.monotonic() - started >= duration:
+                    break
+        except KeyboardInterrupt:
+            self.stdout.write('Interrupted; summarizing the windows so far')
+        self.stop.set()
+        for thread in threads:
+            thread.join(timeout=35)
+        self.summarize([report for report in reports if report is not None])
+
+    def browser(self, seed):
+        """One simulated chat tab: poll, sync and occasionally send."""
+        options = self.options
+        rng = random.Random(seed)
+        room = options['room']
+        client = Client(options['base_url'])
+        try:
+            client.login(LOADTEST_USER, LOADTEST_PASSWORD)
+        except CommandError as error:
+            self.stderr.write(str(error))
+            self.stop.set()
+            return
+        seq = 0
+        while not self.stop.is_set():
+            headers = {'X-CSRFToken': client.cookies.get('csrftoken', ''), 'Referer': options['base_url'] + '/'}
+            roll = rng.random()
+            start = time.perf_counter()
+            try:
+                if roll < options['send_ratio']:
+                    status, _ = client.request('POST', '/chat/send/', urlencode({
+                        'message': f'Soak message {rng.randrange(10 ** 6)}', 'chat_room_id': room,
+                    }), dict(headers, **{'Content-Type': 'application/x-www-form-urlencoded'}))
+                elif roll < options['send_ratio'] + 0.15:
+                    status, _ = client.request('POST', '/chat/sync/', json.dumps({'rooms': {str(room): 0}}),
+                                               dict(headers, **{'Content-Type': 'application/json'}))
+                elif roll < options['send_ratio'] + 0.25 or not seq:
+                    status, body = client.request('GET', f'/chat/room/{room}/messages/')
+                    if status == 200:
+                        seq = json.loads(body).get('seq', seq)
+                else:
+                    status, body = client.request('GET', f'/chat/room/{room}/changes/?since={seq}')
+                    if status == 200:
+                        seq = json.loads(body).get('seq', seq)
+                ok = status < 400
+            except (OSError, ValueError):
+                ok = False
+            self.window.record(time.perf_counter() - start, ok)
+            self.stop.wait(options['think'] * rng.uniform(0.5, 1.5))
+
+    def report(self, elapsed):
+        """Print and return the statistics of the window that just ended."""
+        window, self.window = self.window, Window()
+        now = time.monotonic()
+        seconds, self.window_started = now - self.window_started, now
+        rss = process_tree_rss(self.options['pid']) / MB if self.options['pid'] else None
+        if not window.latencies:
+            self.stdout.write(f'{elapsed:7.0f}s       - (no requests completed)')
+            return None
+        report = {
+            'elapsed': elapsed,
+            'rate': len(window.latencies) / seconds,
+            'p50': percentile(window.latencies, 0.50) * 1000,
+            'p95': percentile(window.latencies, 0.95) * 1000,
+            'p99': percentile(window.latencies, 0.99) * 1000,
+            'errors': window.errors,
+            'rss': rss,
+        }
+        self.stdout.write(
+            f"{elapsed:7.0f}s {report['rate']:7.1f} {report['p50']:7.1f} {report['p95']:7.1f} "
+            f"{report['p99']:7.1f} {report['errors']:6d} {rss if rss is not None else float('nan'):8.1f}"
+        )
+        return report
+
+    def summarize(self, reports):
+        if len(reports) < 2:
+            self.stdout.write('Not enough windows for a drift summary (run longer than two intervals)')
+            return
+        first, last = reports[0], reports[-1]
+        self.stdout.write(
+            f"Latency drift: p50 {first['p50']:.1f} -> {last['p50']:.1f} ms, "
+            f"p95 {first['p95']:.1f} -> {last['p95']:.1f} ms; "
+            f"errors {sum(report['errors'] for report in reports)}"
+        )
+        samples = [(report['elapsed'] / 3600, report['rss']) for report in reports if report['rss'] is not None]
+        if len(samples) < 2:
+            return
+        hours, rss = zip(*samples)
+        slope = statistics.linear_regression(hours, rss).slope
+        self.stdout.write(f'RSS: {rss[0]:.1f} -> {rss[-1]:.1f} MB, trend {slope:+.1f} MB/hour')
+        if self.options['max_growth'] is not None and slope > self.options['max_growth']:
+            raise CommandError(f"RSS grows {slope:.1f} MB/hour (limit {self.options['max_growth']} MB/hour)")
@@ -0,0 +1,227 @@
+# Memory watchdog for long-lived workers
+# Worker RSS that creeps up over days is hard to attribute after the fact. With
+# CHAT_MEMORY_MONITOR=True every worker process traces its allocations with
+# tracemalloc and a daemon thread samples them every CHAT_MEMORY_INTERVAL
+# seconds, keeping:
+#   - a short history of summaries (RSS, traced memory, top allocation sites),
+#   - the first snapshot taken after startup (the baseline) and the latest one,
+#     so staff can diff "now vs. startup" or "now vs. last sample".
+# Both are served at /chat/stats/memory/ (per worker, like request profiles).
+#
+# With CHAT_MEMORY_RECYCLE_MB set, a worker whose RSS exceeds it sends itself
+# SIGTERM: gunicorn treats that as a graceful shutdown (in-flight requests
+# finish) and the master starts a fresh worker. This complements
+# GUNICORN_MAX_REQUESTS, which recycles by request count regardless of memory.
+#
+# tracemalloc costs CPU on every allocation and memory for its traces (more
+# with a deeper CHAT_MEMORY_FRAMES), so the monitor is off by default and
+# meant to be switched on for an investigation or a soak test
+# (`manage.py soak`). The RSS check alone is cheap: with
+# CHAT_MEMORY_MONITOR=False but CHAT_MEMORY_RECYCLE_MB set, only RSS is
+# sampled.
+
+import collections  # History of samples
+import itertools  # Sample ids
+import logging  # Recycling is logged
+import os  # Process id, RSS on Linux
+import resource  # Peak RSS where /proc is not available
+import signal  # Graceful recycling
+import sys  # ru_maxrss units differ on macOS
+import threading  # Sampler thread
+import time  # Sample timestamps
+import tracemalloc  # Allocation tracing
+
+from django.conf import settings  # Monitor tunables live in settings.py
+
+logger = logging.getLogger(__name__)
+
+# Trace allocations and keep snapshots (costly; opt-in)
+ENABLED = getattr(settings, 'CHAT_MEMORY_MONITOR', False)
+
+# Seconds between two samples
+INTERVAL = getattr(settings, 'CHAT_MEMORY_INTERVAL', 60)
+
+# Stack frames recorded per allocation (1 = allocation line only)
+FRAMES = getattr(settings, 'CHAT_MEMORY_FRAMES', 10)
+
+# Allocation sites reported per sample and per diff
+TOP = getattr(settings, 'CHAT_MEMORY_TOP', 25)
+
+# Sample summaries kept per worker
+KEEP = getattr(settings, 'CHAT_MEMORY_KEEP', 60)
+
+# Recycle the worker once its RSS exceeds this many MB (0 = never)
+RECYCLE_MB = getattr(settings, 'CHAT_MEMORY_RECYCLE_MB', 0)
+
+# Allocations by the tracing machinery itself are not reported
+IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+MB = 1024 * 1024
+
+
+def rss_bytes(pid='self'):
+    """
+    Resident set size of a process in bytes.
+
+    Reads /proc on Linux. Elsewhere (own process only) the peak RSS is
+    returned, which never decreases but still shows growth.
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        if pid != 'self':
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def site_label(traceback):
+    """'path:line' of the innermost frame (paths shortened like profiler frames)."""
+    frame = traceback[0]
+    path = frame.filename
+    if 'site-packages' + os.sep in path:
+        path = path.split('site-packages' + os.sep, 1)[1]
+    elif path.startswith(str(settings.BASE_DIR)):
+        path = os.path.relpath(path, settings.BASE_DIR)
+    return f'{path}:{frame.lineno}'
+
+
+def stat_entry(stat):
+    """JSON form of a tracemalloc Statistic or StatisticDiff."""
+    entry = {
+        'site': site_label(stat.traceback),
+        'size': stat.size,
+        'count': stat.count,
+    }
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        entry['size_diff'] = stat.size_diff
+        entry['count_diff'] = stat.count_diff
+    if len(stat.traceback) > 1:
+        entry['traceback'] = [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback]
+    return entry
+
+
+class Monitor:
+    """
+    Per-process allocation sampler and RSS watchdog.
+
+    The sampling thread is started on first use in each process (workers
+    forked from a preloaded master start their own).
+    """
+
+    def __init__(self, trace=False, interval=60, frames=10, top=25, keep=60, recycle_mb=0):
+        self.trace = trace
+        self.interval = interval
+        self.frames = frames
+        self.top = top
+        self.recycle_bytes = recycle_mb * MB
+        self.samples = collections.deque(maxlen=keep)  # Summaries, oldest first
+        self.baseline = None  # First snapshot of this process
+        self.previous = None  # Snapshot before the latest one
+        self.latest = None  # Most recent snapshot
+        self.recycling = False
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @property
+    def active(self):
+        return self.trace or bool(self.recycle_bytes)
+
+    def ensure_started(self):
+        """Start tracing and the sampling thread in this process if not running yet."""
+        if self._pid == os.getpid() or not self.active:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # State inherited from the parent describes another process
+            self.samples.clear()
+            self.baseline = self.previous = self.latest = None
+            self.recycling = False
+            if self.trace and not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='chat-memory', daemon=True).start()
+
+    def sample(self):
+        """
+        Take one sample now: RSS, and with tracing a snapshot of the top sites.
+
+        Returns:
+            The summary added to the history
+        """
+        summary = {
+            'id': next(self._ids),
+            'pid': os.getpid(),
+            'taken_at': time.time(),
+            'rss': rss_bytes(),
+        }
+        if self.trace and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED)
+            current, peak = tracemalloc.get_traced_memory()
+            summary['traced'] = current
+            summary['traced_peak'] = peak
+            summary['top'] = [stat_entry(stat) for stat in snapshot.statistics('lineno')[:self.top]]
+            with self._lock:
+                if self.baseline is None:
+                    self.baseline = snapshot
+                self.previous, self.latest = self.latest, snapshot
+        with self._lock:
+            self.samples.append(summary)
+        self.check_recycle(summary['rss'])
+        return summary
+
+    def diff(self, against='baseline', group='lineno', limit=None):
+        """
+        Largest changes between the latest snapshot and the baseline (or the
+        snapshot before it when `against` is 'previous').
+
+        Args:
+            against: 'baseline' (first snapshot of the process) or 'previous'
+            group: 'lineno' (allocation line) or 'traceback' (whole stack)
+            limit: Sites returned (default TOP)
+
+        Returns:
+            List of sites sorted by absolute size change, or None before two
+            snapshots exist
+        """
+        with self._lock:
+            reference = self.baseline if against == 'baseline' else self.previous
+            latest = self.latest
+        if reference is None or latest is None or reference is latest:
+            return None
+        stats = latest.compare_to(reference, group)
+        return [stat_entry(stat) for stat in stats[:limit or self.top]]
+
+    def history(self):
+        """Sample summaries, newest first."""
+        with self._lock:
+            return list(reversed(self.samples))
+
+    def check_recycle(self, rss):
+        """Ask the process to exit gracefully once RSS exceeds the threshold."""
+        if not self.recycle_bytes or rss is None or rss <= self.recycle_bytes or self.recycling:
+            return False
+        self.recycling = True
+        logger.warning(
+            'Worker %s RSS %.1f MB exceeds CHAT_MEMORY_RECYCLE_MB (%d MB); recycling',
+            os.getpid(), rss / MB, self.recycle_bytes // MB,
+        )
+        os.kill(os.getpid(), signal.SIGTERM)
+        return True
+
+    def _run(self):
+        while True:
+            self.sample()  # The first sample becomes the baseline
+            time.sleep(self.interval)
+
+
+# Process-wide monitor
+monitor = Monitor(trace=ENABLED, interval=INTERVAL, frames=FRAMES, top=TOP, keep=KEEP, recycle_mb=RECYCLE_MB)
@@ -0,0 +1,249 @@
+# Middleware for the chat app
+# Cross-cutting request handling that applies to several chat endpoints.
+
+import contextlib  # Query wrappers on every database connection
+import os  # Random bytes for brotli padding
+import re  # Accept-Encoding negotiation
+
+from django.conf import settings  # Paths served with cached authentication
+from django.middleware.gzip import GZipMiddleware  # gzip path (with BREACH padding) and streaming support
+from django.utils.cache import patch_vary_headers  # Responses differ by Accept-Encoding
+from django.contrib.auth.middleware import AuthenticationMiddleware  # Standard request.user handling
+from django.http import HttpResponse, JsonResponse  # 503 responses when hashing is saturated
+from django.utils.functional import SimpleLazyObject  # Resolve the user only when a view asks
+from django.core.exceptions import MiddlewareNotUsed  # Profiler switched off entirely
+from django.db import connections  # SQL recorded for profiled requests
+
+from . import cache as chat_cache  # Process-local resolved user cache
+from . import hashing  # HashingBusy raised by the bounded hashing pool
+from . import memory  # Allocation sampling and RSS watchdog
+from . import profiling  # Sampling profiler for slow or flagged requests
+from . import ratelimit  # Token bucket rules and backends
+
+try:
+    import brotli  # Optional: `pip install brotli` enables br responses
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+
+class RateLimitMiddleware:
+    """
+    Enforce settings.CHAT_RATE_LIMITS for the matching URL names.
+
+    Runs in process_view so the resolved URL name and view kwargs (room_id)
+    are available. Requests to endpoints without a rule pass straight through
+    after a single dictionary lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if match is None:
+            return None
+        # Rules may use the namespaced name ('chat:send_message') or the bare one
+        name = match.view_name
+        limits = ratelimit.rules.get(name) or ratelimit.rules.get(match.url_name)
+        if not limits:
+            return None
+        return ratelimit.check(request, name, limits, view_kwargs)
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    Drop-in replacement for AuthenticationMiddleware.
+
+    Requests under settings.CHAT_CACHED_AUTH_PATHS (the endpoints the chat UI
+    polls every few seconds) resolve request.user through
+    chat.cache.get_request_user(), which skips the auth_user query while the
+    user is cached. Every other path behaves exactly like Django's middleware.
+    """
+
+    cached_paths = tuple(getattr(settings, 'CHAT_CACHED_AUTH_PATHS', ()))
+
+    def process_request(self, request):
+        super().process_request(request)
+        if self.cached_paths and request.path_info.startswith(self.cached_paths):
+            request.user = SimpleLazyObject(lambda: chat_cache.get_request_user(request))
+
+
+class ProfilingMiddleware:
+    """
+    Hook requests into the sampling profiler (chat/profiling.py).
+
+    Staff users get a profile of any request by sending X-Chat-Profile: 1;
+    its id comes back in the X-Chat-Profile-Id response header. With
+    settings.CHAT_PROFILER_SLOW_MS set, every request is watched and the
+    ones exceeding it are kept. Otherwise requests pass straight through.
+    """
+
+    header = 'X-Chat-Profile'
+
+    def __init__(self, get_response):
+        if not profiling.ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        forced = request.headers.get(self.header) == '1' and request.user.is_staff
+        if not forced and not profiling.SLOW_MS:
+            return self.get_response(request)
+
+        profile = profiling.Profile(request, forced)
+        profiling.sampler.begin(profile)
+        status = 500
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.record_query))
+                response = self.get_response(request)
+            status = response.status_code
+        finally:
+            kept = profiling.sampler.end(profile, status)
+        if kept is not None:
+            profile.user_id = request.user.id
+            if forced:
+                response[f'{self.header}-Id'] = str(kept.id)
+        return response
+
+
+class MemoryMonitorMiddleware:
+    """
+    Start the memory monitor (chat/memory.py) in each worker process.
+
+    Workers forked from a preloaded master do not inherit its threads, so the
+    monitor is started on the first request a process serves. Removed from
+    the stack when neither CHAT_MEMORY_MONITOR nor CHAT_MEMORY_RECYCLE_MB is set.
+    """
+
+    def __init__(self, get_response):
+        if not memory.monitor.active:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        memory.monitor.ensure_started()
+        return self.get_response(request)
+
+
+def hashing_busy(request, busy):
+    """
+    Build the 503 response for a saturated hashing pool.
+
+    AJAX callers get JSON like the other chat endpoints, form posts plain text.
+    """
+    message = 'The server is busy signing people in, please try again in a moment'
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest' or request.content_type == 'application/json':
+        response = JsonResponse({'success': False, 'error': message}, status=503)
+    else:
+        response = HttpResponse(message, status=503, content_type='text/plain')
+    response['Retry-After'] = str(busy.retry_after)
+    return response
+
+
+class HashingBusyMiddleware:
+    """
+    Turn chat.hashing.HashingBusy raised anywhere (e.g. inside LoginView's
+    authenticate() call) into a 503 with Retry-After instead of a 500.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, hashing.HashingBusy):
+            return hashing_busy(request, exception)
+        return None
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Negotiated response compression for dynamic pages and JSON.
+
+    - Bodies shorter than settings.CHAT_COMPRESS_MIN_SIZE are sent as-is
+      (compression would cost more than it saves).
+    - Only text-like content types are compressed; files, images and
+      responses that support byte ranges (Accept-Ranges, e.g. attachment
+      downloads) are left alone, since ranges address the raw bytes.
+    - Brotli is used when the `brotli` package is installed, the client
+      accepts it and the content type is listed in CHAT_BROTLI_CONTENT_TYPES.
+      Those JSON responses can still carry private data (other users'
+      messages) next to text an attacker can inject, so like Django's gzip
+      path (used for everything else, including HTML with the CSRF token)
+      they get random padding against BREACH-style length attacks: a random
+      run of whitespace, which JSON ignores, is appended before compressing.
+    - Streaming responses are compressed chunk by chunk.
+
+    Static files never reach this middleware: WhiteNoise answers them earlier
+    with precompressed copies.
+    """
+
+    re_accepts_br = re.compile(r'\bbr\b')
+    compressible_types = (
+        'text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+    )
+    min_size = getattr(settings, 'CHAT_COMPRESS_MIN_SIZE', 512)
+    brotli_types = tuple(getattr(settings, 'CHAT_BROTLI_CONTENT_TYPES', ('application/json',)))
+    brotli_quality = getattr(settings, 'CHAT_BROTLI_QUALITY', 5)
+    # Random whitespace compresses to about 2 bits per character, so up to 400
+    # characters vary the compressed size by up to ~100 bytes, like the
+    # 0-100 random bytes Django's gzip path puts in the gzip header
+    brotli_max_padding = 400
+    padding_table = bytes(b' \t\n\r'[i & 3] for i in range(256))
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+        if response.has_header('Content-Encoding') or response.has_header('Accept-Ranges') or response.status_code == 206:
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if not content_type.startswith(self.compressible_types):
+            return response
+        if (
+            brotli is not None
+            and content_type.startswith(self.brotli_types)
+            and not getattr(response, 'is_async', False)
+            and self.re_accepts_br.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        ):
+            return self.brotli_response(response)
+        return super().process_response(request, response)
+
+    def brotli_padding(self):
+        """A random-length run of random whitespace (BREACH mitigation)."""
+        length = int.from_bytes(os.urandom(2), 'big') % (self.brotli_max_padding + 1)
+        return os.urandom(length).translate(self.padding_table)
+
+    def brotli_response(self, response):
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.streaming:
+            original = response.streaming_content
+
+            def compressed():
+                compressor = brotli.Compressor(quality=self.brotli_quality)
+                for chunk in original:
+                    data = compressor.process(chunk)
+                    if data:
+                        yield data
+                yield compressor.process(self.brotli_padding())
+                yield compressor.finish()
+
+            response.streaming_content = compressed()
+            del response.headers['Content-Length']
+        else:
+            content = brotli.compress(response.content + self.brotli_padding(), quality=self.brotli_quality)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response.headers['Content-Length'] = str(len(content))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
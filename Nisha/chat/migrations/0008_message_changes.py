@@ -0,0 +1,57 @@
+# Generated by Django 5.1.5 on 2026-10-19 18:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def number_existing_messages(apps, schema_editor):
+    """
+    Give existing room messages sequence numbers 1, 2, 3, ... per room in id
+    order, streaming the rows and writing them back in batches.
+    """
+    Message = apps.get_model('chat', 'Message')
+    messages = Message.objects.using(schema_editor.connection.alias)
+    rows = messages.filter(chat_room__isnull=False).order_by('chat_room_id', 'id').values_list('id', 'chat_room_id')
+    batch, room_id, seq = [], None, 0
+    for message_id, message_room_id in rows.iterator(chunk_size=2000):
+        if message_room_id != room_id:
+            room_id, seq = message_room_id, 0
+        seq += 1
+        batch.append(Message(id=message_id, seq=seq))
+        if len(batch) >= 2000:
+            messages.bulk_update(batch, ['seq'])
+            batch = []
+    if batch:
+        messages.bulk_update(batch, ['seq'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='edited_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        # Runs on every database holding messages (default and shards)
+        migrations.RunPython(number_existing_messages, migrations.RunPython.noop, hints={'model_name': 'message'}),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('chat_room', 'seq'), name='chat_message_room_seq_uniq'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.5 on 2026-10-19 18:28
+
+from django.db import migrations, models
+
+
+def key_existing_direct_rooms(apps, schema_editor):
+    """
+    Give existing one-to-one rooms (not groups, exactly two members) their
+    dm_key. When a pair already has several such rooms only the oldest
+    becomes canonical; the duplicates keep their history and stay as they are.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Membership = ChatRoom.members.through
+    members = {}
+    for room_id, user_id in Membership.objects.filter(chatroom__is_group=False).values_list('chatroom_id', 'user_id'):
+        members.setdefault(room_id, set()).add(user_id)
+    taken = set()
+    for room_id in sorted(members):
+        if len(members[room_id]) != 2:
+            continue
+        low, high = sorted(members[room_id])
+        key = f'{low}:{high}'
+        if key not in taken:
+            taken.add(key)
+            ChatRoom.objects.filter(id=room_id).update(dm_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_message_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='dm_key',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(key_existing_direct_rooms, migrations.RunPython.noop),
+    ]
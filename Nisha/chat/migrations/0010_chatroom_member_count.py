@@ -0,0 +1,35 @@
+# Generated by Django 5.1.5 on 2026-10-19 18:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_existing_members(apps, schema_editor):
+    """Fill member_count for existing rooms with one UPDATE."""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Membership = ChatRoom.members.through
+    counts = (
+        Membership.objects.filter(chatroom_id=OuterRef('pk'))
+        .order_by()
+        .values('chatroom_id')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    ChatRoom.objects.update(member_count=Coalesce(Subquery(counts), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_chatroom_dm_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing_members, migrations.RunPython.noop),
+    ]
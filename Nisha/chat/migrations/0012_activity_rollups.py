@@ -0,0 +1,43 @@
+# Generated by Django 5.1.5 on 2026-10-19 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_attachments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('characters', models.PositiveBigIntegerField(default=0)),
+                ('room_id', models.BigIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket'], name='chat_roomactivity_time_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'room_id', 'bucket'), name='chat_roomactivity_bucket_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('characters', models.PositiveBigIntegerField(default=0)),
+                ('user_id', models.BigIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket'], name='chat_useractivity_time_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'user_id', 'bucket'), name='chat_useractivity_bucket_uniq')],
+            },
+        ),
+    ]
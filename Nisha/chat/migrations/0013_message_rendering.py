@@ -0,0 +1,31 @@
+# Generated by Django 5.1.5 on 2026-10-19 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='preview',
+            field=models.CharField(blank=True, editable=False, max_length=120),
+        ),
+        # Existing rows get render_version 0: they are rendered on read until
+        # `manage.py rerender_messages` stores their HTML. The migration does not
+        # import chat.rendering, whose output changes with RENDER_VERSION.
+        migrations.AddField(
+            model_name='message',
+            name='render_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
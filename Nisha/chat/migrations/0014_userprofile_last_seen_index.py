@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-19 19:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_message_rendering'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['last_seen'], name='chat_profile_last_seen_idx'),
+        ),
+    ]
@@ -1,6 +1,9 @@
 # Import necessary Django modules for database models
 from django.db import models  # For creating database models and fields
 from django.contrib.auth.models import User  # Built-in Django User model for authentication
+from django.db.models.functions import Collate  # Case-insensitive index for username search
+import uuid  # Unguessable upload ids
+from . import rendering  # Stored HTML and preview of message content
 
 class ChatRoom(models.Model):
     """
@@ -25,10 +28,26 @@ class ChatRoom(models.Model):
         User, 
         related_name='chat_rooms'  # Access user's rooms via user.chat_rooms.all()
     )
+    member_count = models.PositiveIntegerField(default=0, editable=False)  # Kept in sync by chat/signals.py
     
     # Room metadata
     created_at = models.DateTimeField(auto_now_add=True)  # Automatically set creation timestamp
     is_group = models.BooleanField(default=False)  # True for group chats, False for individual conversations
+    
+    # Message storage (see chat/sharding.py); None keeps the room's messages in the default database
+    shard = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    # Canonical direct-message rooms: "<lower user id>:<higher user id>", None for other rooms.
+    # The unique index makes "the DM between A and B" one indexed lookup (see chat/rooms.py).
+    dm_key = models.CharField(max_length=41, null=True, blank=True, unique=True, editable=False)
+
+    @staticmethod
+    def dm_key_for(user_id, other_user_id):
+        """
+        Key of the direct-message room between two users (order does not matter).
+        """
+        low, high = sorted((int(user_id), int(other_user_id)))
+        return f'{low}:{high}'
 
     def __str__(self):
         """
@@ -47,7 +66,23 @@ class ChatRoom(models.Model):
         Returns:
             Message object: The most recent message, or None if no messages exist
         """
-        return self.messages.order_by('-timestamp').first()
+        return self.messages.filter(deleted_at__isnull=True).order_by('-timestamp').first()
+
+class MessageQuerySet(models.QuerySet):
+    """
+    QuerySet for Message that sends new room messages to the room's shard.
+    """
+
+    def create(self, **kwargs):
+        """
+        Like QuerySet.create(), but unless a database was chosen with using(),
+        messages for sharded rooms are stored through chat.sharding.
+        """
+        from . import sharding  # Imported lazily: sharding imports these models
+
+        if self._db is None and sharding.SHARD_COUNT:
+            return sharding.create_message(**kwargs)
+        return super().create(**kwargs)
 
 class Message(models.Model):
     """
@@ -55,19 +90,30 @@ class Message(models.Model):
     Stores message content, sender information, and timestamps.
     
     Supports both legacy (non-room) messages and modern room-based messages.
+    
+    With sharding enabled (chat/sharding.py) the rows of a room live in that
+    room's shard database, so the foreign keys are not enforced by the database
+    (db_constraint=False); Django still applies on_delete itself.
     """
     
+    objects = MessageQuerySet.as_manager()  # Routes created room messages to their shard
+    
     # Sender information (supports both authenticated and anonymous users)
     user = models.ForeignKey(
         User, 
         on_delete=models.CASCADE,  # Delete messages if user is deleted
-        null=True, blank=True  # Allow null for anonymous users or legacy messages
+        null=True, blank=True,  # Allow null for anonymous users or legacy messages
+        db_constraint=False  # The user row may live in another database
     )
     
     username = models.CharField(max_length=100)  # Store username for display (backward compatibility)
     
     # Message content and metadata
     content = models.TextField()  # The actual message text content
+    # Rendered once on save (chat/rendering.py); reads copy these instead of escaping per request
+    content_html = models.TextField(blank=True, editable=False)  # Sanitized HTML of the content
+    preview = models.CharField(max_length=120, blank=True, editable=False)  # Plain one-line preview (sidebar)
+    render_version = models.PositiveSmallIntegerField(default=0, editable=False)  # Renderer that produced them (0 = never)
     timestamp = models.DateTimeField(auto_now_add=True)  # Automatically set when message is created
     
     # Room association (optional for backward compatibility)
@@ -75,12 +121,84 @@ class Message(models.Model):
         ChatRoom, 
         on_delete=models.CASCADE,  # Delete messages if room is deleted
         related_name='messages',  # Access room messages via chat_room.messages.all()
-        null=True, blank=True  # Allow null for legacy messages not associated with rooms
+        null=True, blank=True,  # Allow null for legacy messages not associated with rooms
+        db_constraint=False  # The room row may live in another database
     )
     
     # Message status
     is_read = models.BooleanField(default=False)  # Track if message has been read (for future features)
 
+    # Optional file attachment (see chat/attachments.py); the blob lives in 'default'
+    attachment = models.ForeignKey(
+        'Attachment',
+        on_delete=models.SET_NULL,  # Keep the message text if a blob is ever purged
+        null=True, blank=True,
+        related_name='+',  # Blobs are shared between messages; no reverse accessor needed
+        db_constraint=False  # The message may live on a shard
+    )
+    attachment_name = models.CharField(max_length=255, blank=True)  # File name as uploaded by this sender
+
+    # Change tracking (see chat/changes.py)
+    seq = models.PositiveBigIntegerField(null=True, blank=True, editable=False)  # Room change sequence of the latest save
+    edited_at = models.DateTimeField(null=True, blank=True)  # Set when the author edits the content
+    deleted_at = models.DateTimeField(null=True, blank=True)  # Set when deleted; the row stays as a tombstone
+
+    # Fields whose change is a new entry in the room's change feed
+    CHANGE_FIELDS = ('content', 'edited_at', 'deleted_at')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the change-feed fields as loaded, so save() can tell whether they changed."""
+        instance = super().from_db(db, field_names, values)
+        instance._saved_change = instance._change_values()
+        return instance
+
+    def _change_values(self):
+        # Deferred fields are absent from __dict__ on both sides of the comparison
+        return tuple(self.__dict__.get(name) for name in self.CHANGE_FIELDS)
+
+    def save(self, *args, **kwargs):
+        """
+        Save the message, giving room messages the next change sequence
+        number of their room when it is created, edited or deleted.
+        
+        Saves that change none of CHANGE_FIELDS (e.g. marking it read) keep
+        the number, so clients following the change feed are not sent the
+        message again. Whenever the content is written, its HTML and preview
+        are rendered again (chat/rendering.py).
+        """
+        from . import changes  # Imported lazily: changes imports these models
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            rendering.render(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'content_html', 'preview', 'render_version'}
+
+        changed = False
+        if self.chat_room_id:
+            if self._state.adding or kwargs.get('force_insert'):
+                changed = True
+            elif update_fields is not None:
+                changed = not set(update_fields).isdisjoint(self.CHANGE_FIELDS)
+            else:
+                changed = self._change_values() != getattr(self, '_saved_change', None)
+                if not changed:
+                    # Leave the stored number alone (this instance's copy may be stale)
+                    kwargs['update_fields'] = [
+                        field.attname for field in self._meta.concrete_fields
+                        if not field.primary_key and field.attname != 'seq'
+                    ]
+        if changed:
+            self.seq = changes.next_seq(self.chat_room_id)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'seq'}
+        super().save(*args, **kwargs)
+        self._saved_change = self._change_values()
+        if changed:
+            # The number was computed by the database inside the INSERT/UPDATE
+            self.seq = type(self).objects.using(self._state.db).filter(pk=self.pk).values_list('seq', flat=True).get()
+
     def __str__(self):
         """
         String representation of the message for admin interface and debugging.
@@ -96,6 +214,18 @@ class Message(models.Model):
         Defines default ordering and other model-level options.
         """
         ordering = ['timestamp']  # Order messages chronologically (oldest first)
+        indexes = [
+            # Room history and "after id X" polling, and the admin's room filter + keyset paging
+            models.Index(fields=['chat_room', 'id'], name='chat_message_room_id_idx'),
+            # Date filters in the admin
+            models.Index(fields=['timestamp'], name='chat_message_timestamp_idx'),
+            # Case-insensitive username prefix search (SQLite's LIKE optimization needs NOCASE)
+            models.Index(Collate('username', 'NOCASE'), name='chat_message_username_idx'),
+        ]
+        constraints = [
+            # One change per sequence number and room; also serves "changes after seq N"
+            models.UniqueConstraint(fields=['chat_room', 'seq'], name='chat_message_room_seq_uniq'),
+        ]
 
 class UserProfile(models.Model):
     """
@@ -126,6 +256,12 @@ class UserProfile(models.Model):
     is_online = models.BooleanField(default=False)  # Track if user is currently online
     last_seen = models.DateTimeField(auto_now=True)  # Automatically update when user is active
 
+    class Meta:
+        indexes = [
+            # The admin's last seen filter and the presence flush (last_seen older than a cutoff)
+            models.Index(fields=['last_seen'], name='chat_profile_last_seen_idx'),
+        ]
+
     def __str__(self):
         """
         String representation of the user profile for admin interface.
@@ -133,4 +269,180 @@ class UserProfile(models.Model):
         Returns:
             Formatted string showing username and "Profile"
         """
-        return f'{self.user.username} Profile'
\ No newline at end of file
+        return f'{self.user.username} Profile'
+
+class ChatEvent(models.Model):
+    """
+    Append-only log of things that happened in the chat (e.g. a message was sent).
+
+    Rows are written in the same transaction as the change they describe and
+    are never updated. Ids increase monotonically, so consumers (see
+    chat/eventlog.py) can tail the log by remembering the last id they saw,
+    and any projection can be rebuilt by replaying it from the start.
+
+    Room and user ids are plain integers rather than foreign keys so the
+    history survives deletions. Likewise the text in 'message.created' and
+    'message.edited' payloads is kept when the message is deleted later
+    (see chat/changes.py).
+    """
+    
+    kind = models.CharField(max_length=50)  # What happened, e.g. 'message.created'
+    room_id = models.BigIntegerField(null=True, blank=True)  # Room the event belongs to, if any
+    user_id = models.BigIntegerField(null=True, blank=True)  # User who caused the event, if any
+    payload = models.JSONField(default=dict)  # Event details (enough to rebuild projections)
+    created_at = models.DateTimeField(auto_now_add=True)  # When the event was recorded
+
+    def __str__(self):
+        """
+        String representation of the event for admin interface and debugging.
+        
+        Returns:
+            Formatted string showing the sequence number and kind
+        """
+        return f'#{self.id} {self.kind}'
+
+    class Meta:
+        ordering = ['id']  # Log order
+
+class ConsumerCheckpoint(models.Model):
+    """
+    Position of one event log consumer: the id of the last ChatEvent it processed.
+    """
+    
+    name = models.CharField(max_length=100, unique=True)  # Consumer name (see eventlog.Consumer.name)
+    position = models.BigIntegerField(default=0)  # Last processed ChatEvent id (0 = nothing yet)
+    updated_at = models.DateTimeField(auto_now=True)  # Last time the consumer advanced
+
+    def __str__(self):
+        """
+        String representation of the checkpoint for admin interface.
+        
+        Returns:
+            Formatted string showing consumer name and position
+        """
+        return f'{self.name} @ {self.position}'
+
+class Attachment(models.Model):
+    """
+    A stored file, addressed by the SHA-256 of its content.
+
+    Identical files uploaded by different people (or twice) are stored once;
+    messages point at the blob and keep their own file name. The file lives
+    under settings.CHAT_ATTACHMENT_ROOT at a path derived from the hash.
+    """
+    
+    sha256 = models.CharField(max_length=64, unique=True)  # Content hash (also the HTTP ETag)
+    size = models.PositiveBigIntegerField()  # Bytes
+    content_type = models.CharField(max_length=100)  # MIME type declared by the first uploader
+    has_thumbnail = models.BooleanField(default=False)  # Set by the thumbnail consumer (images only)
+    created_at = models.DateTimeField(auto_now_add=True)  # First upload
+
+    def __str__(self):
+        """
+        String representation of the attachment for admin interface.
+        
+        Returns:
+            Short hash, type and size
+        """
+        return f'{self.sha256[:12]} ({self.content_type}, {self.size} bytes)'
+
+class Upload(models.Model):
+    """
+    A resumable, chunked upload in progress (or finished).
+
+    Chunks are appended to a temporary file at the current `received`
+    offset; once `received` reaches `size` the file is hashed and becomes
+    (or is deduplicated into) an Attachment. Finished uploads are kept as
+    the record that their user may send that attachment.
+    """
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # Upload token
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')  # Uploader
+    filename = models.CharField(max_length=255)  # Original file name
+    content_type = models.CharField(max_length=100)  # Declared MIME type
+    size = models.PositiveBigIntegerField()  # Total bytes announced by the client
+    received = models.PositiveBigIntegerField(default=0)  # Bytes stored so far (the resume offset)
+    attachment = models.ForeignKey(
+        Attachment,
+        on_delete=models.CASCADE,
+        null=True, blank=True,  # Set when the upload is complete
+        related_name='uploads'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)  # Upload started
+    updated_at = models.DateTimeField(auto_now=True)  # Last chunk received
+
+    def __str__(self):
+        """
+        String representation of the upload for admin interface.
+        
+        Returns:
+            File name and progress
+        """
+        return f'{self.filename} ({self.received}/{self.size})'
+
+class ActivityRollup(models.Model):
+    """
+    Common fields of the activity rollups: message counts per time bucket.
+
+    Rows are maintained by chat.rollups.ActivityRollupConsumer from the
+    event log, never written by request handlers, so analytics read a
+    handful of rows per bucket instead of scanning chat_message.
+    """
+
+    PERIODS = [('hour', 'Hour'), ('day', 'Day')]
+
+    period = models.CharField(max_length=4, choices=PERIODS)  # Bucket length
+    bucket = models.DateTimeField()  # Start of the hour/day (UTC)
+    messages = models.PositiveIntegerField(default=0)  # Messages sent in the bucket
+    characters = models.PositiveBigIntegerField(default=0)  # Total length of their text
+
+    class Meta:
+        abstract = True
+
+class RoomActivity(ActivityRollup):
+    """
+    Messages sent in one room per hour and per day.
+    """
+    
+    room_id = models.BigIntegerField()  # Plain id: rollups outlive deleted rooms, like the event log
+
+    def __str__(self):
+        """
+        String representation of the rollup row for admin interface.
+        
+        Returns:
+            Room, bucket and count
+        """
+        return f'room {self.room_id} {self.period} {self.bucket:%Y-%m-%d %H:00}: {self.messages}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'room_id', 'bucket'], name='chat_roomactivity_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'bucket'], name='chat_roomactivity_time_idx'),  # All rooms in a time range
+        ]
+
+class UserActivity(ActivityRollup):
+    """
+    Messages sent by one user per hour and per day.
+    """
+    
+    user_id = models.BigIntegerField()  # Plain id: rollups outlive deleted users
+
+    def __str__(self):
+        """
+        String representation of the rollup row for admin interface.
+        
+        Returns:
+            User, bucket and count
+        """
+        return f'user {self.user_id} {self.period} {self.bucket:%Y-%m-%d %H:00}: {self.messages}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'user_id', 'bucket'], name='chat_useractivity_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'bucket'], name='chat_useractivity_time_idx'),  # All users in a time range
+        ]
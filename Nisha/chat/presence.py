@@ -0,0 +1,193 @@
+# Presence tracking for chat users
+# Every authenticated chat request counts as a heartbeat. Heartbeats are kept
+# in memory (one timestamp per user) so marking a user as active is just a
+# dictionary write. The aggregated `last_seen`/`is_online` values are written
+# to UserProfile in periodic bulk updates instead of one UPDATE per poll.
+#
+# Heartbeats of one user may reach any worker, so no worker decides from its
+# own memory that a user went offline. Offline status is derived from the
+# shared `last_seen` instead: a profile not refreshed by any worker within
+# TTL + FLUSH_INTERVAL is stale (is_online_profile) and the next flush on any
+# worker clears its is_online flag.
+
+import threading  # Guards the heartbeat maps against concurrent request threads
+import time  # Wall-clock timestamps for heartbeats, monotonic clock for flush scheduling
+from datetime import datetime, timezone as dt_timezone  # Converting heartbeats to DB values
+
+from django.conf import settings  # Presence tunables live in settings.py
+
+from .models import UserProfile  # Where last_seen/is_online are persisted
+
+# A user is online if we received a heartbeat within this many seconds
+ONLINE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL', 30)
+
+# Minimum number of seconds between bulk writes to UserProfile
+FLUSH_INTERVAL = getattr(settings, 'CHAT_PRESENCE_FLUSH_INTERVAL', 60)
+
+
+class PresenceTracker:
+    """
+    In-memory presence registry with TTL expiry and batched persistence.
+
+    Each worker process keeps its own tracker. Other workers learn about a
+    user's presence through the flushed UserProfile rows (see is_online_profile).
+    """
+
+    def __init__(self, ttl=30, flush_interval=60):
+        self.ttl = ttl  # Seconds a heartbeat keeps a user online
+        self.flush_interval = flush_interval  # Seconds between bulk writes
+        self._last_seen = {}  # user_id -> timestamp of the latest heartbeat
+        self._pending = {}  # user_id -> timestamp not yet written to the database
+        self._next_flush = time.monotonic() + flush_interval
+        self._lock = threading.Lock()
+
+    def heartbeat(self, user_id, now=None):
+        """
+        Record that `user_id` is active. Triggers a flush if one is due.
+
+        Args:
+            user_id: Primary key of the active user
+            now: Optional timestamp (seconds since epoch), mainly for tests
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._last_seen[user_id] = now
+            self._pending[user_id] = now
+            due = time.monotonic() >= self._next_flush
+        if due:
+            self.flush(now)
+
+    def is_online(self, user_id, now=None):
+        """
+        Check whether `user_id` sent a heartbeat within the TTL.
+        """
+        now = time.time() if now is None else now
+        last_seen = self._last_seen.get(user_id)
+        return last_seen is not None and now - last_seen < self.ttl
+
+    def last_seen(self, user_id):
+        """
+        Return the last heartbeat of `user_id` as an aware datetime, or None.
+        """
+        last_seen = self._last_seen.get(user_id)
+        if last_seen is None:
+            return None
+        return datetime.fromtimestamp(last_seen, tz=dt_timezone.utc)
+
+    def online_user_ids(self, now=None):
+        """
+        Return the set of users currently online, pruning expired entries.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [uid for uid, ts in self._last_seen.items() if now - ts >= self.ttl]
+            for uid in expired:
+                # Pending heartbeats are tracked separately and still get persisted
+                del self._last_seen[uid]
+            return {uid for uid, ts in self._last_seen.items() if now - ts < self.ttl}
+
+    def stale_before(self, now=None):
+        """
+        Persisted last_seen values older than this belong to offline users.
+
+        Other workers flush a user's heartbeats up to one flush interval late,
+        so the TTL is extended by that much.
+        """
+        now = time.time() if now is None else now
+        return datetime.fromtimestamp(now - self.ttl - self.flush_interval, tz=dt_timezone.utc)
+
+    def flush(self, now=None):
+        """
+        Persist pending heartbeats and offline transitions in bulk.
+
+        Issues at most four queries regardless of how many heartbeats were
+        received: fetch profiles, create missing ones, bulk update last_seen,
+        and mark every profile whose last_seen went stale offline (whichever
+        worker received its heartbeats).
+        """
+        now = time.time() if now is None else now
+        self.online_user_ids(now)  # Prune expired heartbeats
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._next_flush = time.monotonic() + self.flush_interval
+
+        if pending:
+            profiles = list(UserProfile.objects.filter(user_id__in=pending))
+            missing = set(pending) - {profile.user_id for profile in profiles}
+            if missing:
+                # Profiles are normally created at signup; backfill older accounts
+                UserProfile.objects.bulk_create(
+                    [UserProfile(user_id=uid) for uid in missing], ignore_conflicts=True
+                )
+                profiles = list(UserProfile.objects.filter(user_id__in=pending))
+            for profile in profiles:
+                profile.last_seen = datetime.fromtimestamp(pending[profile.user_id], tz=dt_timezone.utc)
+                profile.is_online = True
+            UserProfile.objects.bulk_update(profiles, ['last_seen', 'is_online'])
+
+        UserProfile.objects.filter(is_online=True, last_seen__lt=self.stale_before(now)).update(is_online=False)
+
+    def reset(self):
+        """
+        Forget all in-memory state (used by tests).
+        """
+        with self._lock:
+            self._last_seen.clear()
+            self._pending.clear()
+            self._next_flush = time.monotonic() + self.flush_interval
+
+
+# Process-wide tracker used by the chat views
+tracker = PresenceTracker(ttl=ONLINE_TTL, flush_interval=FLUSH_INTERVAL)
+
+
+def record(request):
+    """
+    Register a heartbeat for the requesting user if they are authenticated.
+    """
+    if request.user.is_authenticated:
+        tracker.heartbeat(request.user.id)
+
+
+def is_online_profile(user_id, profile):
+    """
+    Resolve a user's online status, preferring this worker's memory.
+
+    Falls back to the last flushed UserProfile values so that heartbeats
+    received by other workers are still honoured (with up to one flush
+    interval of delay).
+
+    Args:
+        user_id: Primary key of the user
+        profile: The user's UserProfile or None
+
+    Returns:
+        True if the user is considered online
+    """
+    if tracker.is_online(user_id):
+        return True
+    if profile is None or not profile.is_online:
+        return False
+    return profile.last_seen >= tracker.stale_before()
+
+
+def online_user_ids(user_ids=None):
+    """
+    Return the users online on any worker.
+
+    Combines this worker's memory with the profiles other workers flushed
+    as online whose last_seen is not stale yet (one indexed query).
+
+    Args:
+        user_ids: Optional iterable restricting the result to these users
+
+    Returns:
+        Set of user ids
+    """
+    online = tracker.online_user_ids()
+    profiles = UserProfile.objects.filter(is_online=True, last_seen__gte=tracker.stale_before())
+    if user_ids is not None:
+        user_ids = set(user_ids)
+        online &= user_ids
+        profiles = profiles.filter(user_id__in=user_ids - online)
+    return online | set(profiles.values_list('user_id', flat=True))
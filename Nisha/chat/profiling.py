@@ -0,0 +1,208 @@
+# Sampling profiler for slow requests
+# ProfilingMiddleware registers each request with a process-wide sampler. One
+# daemon thread wakes every CHAT_PROFILER_INTERVAL_MS, and for the requests
+# that should be profiled it records the current Python stack of the thread
+# serving them (sys._current_frames(), no tracing hooks). A request is
+# profiled when:
+#   - a staff user sends the X-Chat-Profile: 1 header (sampled from the start), or
+#   - it has been running longer than CHAT_PROFILER_SLOW_MS (sampled from then
+#     on, so the stacks show where the slow part is spending its time).
+# The SQL run by the request is recorded alongside. Finished profiles are kept
+# in a small per-process ring buffer (memory only, like presence and events)
+# and served to staff as JSON or as folded stacks for flamegraph.pl/speedscope.
+#
+# Cost for requests that are not profiled: one dictionary insert/delete and
+# one query wrapper call per SQL statement; nothing at all with
+# CHAT_PROFILER_ENABLED=False.
+
+import collections  # Stack sample counts and the ring buffer of finished profiles
+import itertools  # Profile ids
+import os  # Shortening file names in stack frames
+import sys  # Frames of other threads
+import threading  # Sampler thread and registry lock
+import time  # Request timings
+
+from django.conf import settings  # Profiler tunables live in settings.py
+
+# Master switch (False removes the middleware from the stack)
+ENABLED = getattr(settings, 'CHAT_PROFILER_ENABLED', True)
+
+# Requests running longer than this are sampled automatically (0 = only on request)
+SLOW_MS = getattr(settings, 'CHAT_PROFILER_SLOW_MS', 0)
+
+# Milliseconds between two stack samples
+INTERVAL_MS = getattr(settings, 'CHAT_PROFILER_INTERVAL_MS', 5)
+
+# Finished profiles kept per process
+KEEP = getattr(settings, 'CHAT_PROFILER_KEEP', 50)
+
+# SQL statements recorded per profile (the count and total time include the rest)
+MAX_QUERIES = getattr(settings, 'CHAT_PROFILER_MAX_QUERIES', 200)
+
+# Deepest stack recorded per sample
+MAX_DEPTH = 100
+
+
+def frame_label(code):
+    """
+    Flame graph label of a code object: 'qualname (path:first line)'.
+
+    Paths are shortened to the project or to the installed package.
+    """
+    path = code.co_filename
+    if 'site-packages' + os.sep in path:
+        path = path.split('site-packages' + os.sep, 1)[1]
+    elif path.startswith(str(settings.BASE_DIR)):
+        path = os.path.relpath(path, settings.BASE_DIR)
+    return f'{code.co_qualname} ({path}:{code.co_firstlineno})'
+
+
+class Profile:
+    """
+    Samples and SQL recorded for one request.
+    """
+
+    def __init__(self, request, forced):
+        self.id = None  # Assigned when the profile is kept
+        self.method = request.method
+        self.path = request.get_full_path()
+        self.user_id = None
+        self.forced = forced  # Requested by header (sampled from the start)
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.status = None
+        self.samples = collections.Counter()  # Folded stack -> sample count
+        self.queries = []  # (sql, milliseconds) for the first MAX_QUERIES statements
+        self.query_count = 0
+        self.query_ms = 0.0
+
+    def add_sample(self, frame):
+        """Record the stack ending at `frame` (root first, like folded stacks)."""
+        labels = []
+        while frame is not None and len(labels) < MAX_DEPTH:
+            labels.append(frame_label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        self.samples[';'.join(labels)] += 1
+
+    def record_query(self, execute, sql, params, many, context):
+        """connection.execute_wrapper() hook timing every statement."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.query_count += 1
+            self.query_ms += elapsed
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append((sql, round(elapsed, 3)))
+
+    def folded(self):
+        """Samples in the folded format read by flamegraph.pl and speedscope."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+    def summary(self):
+        """Listing entry without stacks or SQL."""
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'user_id': self.user_id,
+            'forced': self.forced,
+            'started_at': self.started_at,
+            'duration_ms': self.duration_ms,
+            'samples': sum(self.samples.values()),
+            'query_count': self.query_count,
+            'query_ms': round(self.query_ms, 3),
+        }
+
+    def as_dict(self):
+        """Full profile, with stacks as [folded stack, count] pairs."""
+        data = self.summary()
+        data['interval_ms'] = INTERVAL_MS
+        data['stacks'] = [[stack, count] for stack, count in self.samples.most_common()]
+        data['queries'] = [{'sql': sql, 'ms': ms} for sql, ms in self.queries]
+        return data
+
+
+class Sampler:
+    """
+    Process-wide stack sampler and store of finished profiles.
+
+    The sampling thread is started on first use and only looks at the
+    threads of requests registered with begin().
+    """
+
+    def __init__(self, interval_ms=5, slow_ms=0, keep=50):
+        self.interval = interval_ms / 1000
+        self.slow = slow_ms / 1000 if slow_ms else None
+        self.active = {}  # thread id -> Profile of the request it is serving
+        self.profiles = collections.deque(maxlen=keep)  # Finished profiles, oldest first
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self, profile):
+        """Start watching the calling thread for `profile`'s request."""
+        if self._thread is None:
+            self._start_thread()
+        self.active[threading.get_ident()] = profile
+
+    def end(self, profile, status):
+        """
+        Stop watching the calling thread and keep the profile if it was
+        requested or turned out slow.
+
+        Returns:
+            The kept Profile, or None
+        """
+        self.active.pop(threading.get_ident(), None)
+        profile.duration_ms = round((time.perf_counter() - profile.started) * 1000, 3)
+        profile.status = status
+        slow = self.slow is not None and profile.duration_ms >= self.slow * 1000
+        if not (profile.forced or slow):
+            return None
+        with self._lock:
+            profile.id = next(self._ids)
+            self.profiles.append(profile)
+        return profile
+
+    def get(self, profile_id):
+        """Kept profile with the given id, or None."""
+        with self._lock:
+            return next((profile for profile in self.profiles if profile.id == profile_id), None)
+
+    def recent(self):
+        """Kept profiles, newest first."""
+        with self._lock:
+            return list(reversed(self.profiles))
+
+    def sample(self):
+        """Take one sample of every registered request that qualifies."""
+        if not self.active:
+            return
+        frames = sys._current_frames()
+        now = time.perf_counter()
+        for ident, profile in list(self.active.items()):
+            if not profile.forced and (self.slow is None or now - profile.started < self.slow):
+                continue
+            frame = frames.get(ident)
+            if frame is not None:
+                profile.add_sample(frame)
+
+    def _start_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-profiler', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+
+
+# Process-wide sampler
+sampler = Sampler(interval_ms=INTERVAL_MS, slow_ms=SLOW_MS, keep=KEEP)
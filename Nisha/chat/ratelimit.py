@@ -0,0 +1,298 @@
+# Token bucket rate limiting for chat endpoints
+# A misbehaving client (or a forgotten tab polling every 2 seconds) should not
+# be able to saturate the SQLite writer or the web workers. Each limited
+# endpoint gets a bucket per user (or per client IP / per room) that refills
+# at a steady rate and allows short bursts up to its capacity.
+#
+# Two storage backends are provided:
+#   - LocalBackend: per-process dictionary, sub-microsecond bookkeeping
+#   - CacheBackend: Django's shared cache, so limits hold across workers
+#
+# Limits are configured per URL name in settings.CHAT_RATE_LIMITS and enforced
+# by chat.middleware.RateLimitMiddleware, or per view with @ratelimit.
+
+import math  # Rounding Retry-After up to whole seconds
+import threading  # Guards the local bucket table
+import time  # Monotonic clock (local) and wall clock (shared cache)
+from collections import OrderedDict  # Bounded LRU of buckets
+from functools import wraps  # Preserves view metadata in the decorator
+
+from django.conf import settings  # Rate limit configuration
+from django.core.cache import cache  # Shared storage for CacheBackend
+from django.http import JsonResponse  # 429 responses for the AJAX endpoints
+
+# Proxies in front of the app that append to X-Forwarded-For (0 = trust REMOTE_ADDR only)
+TRUSTED_PROXIES = getattr(settings, 'CHAT_RATE_LIMIT_TRUSTED_PROXIES', 0)
+
+# Seconds per period suffix accepted in rate strings such as '5/s' or '30/m'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class Limit:
+    """
+    A parsed rate limit rule.
+
+    Attributes:
+        rate: Tokens added per second
+        capacity: Maximum tokens in the bucket (burst size)
+        scope: What the bucket is keyed on: 'user' or 'room'
+    """
+
+    __slots__ = ('rate', 'capacity', 'scope')
+
+    def __init__(self, rate, capacity, scope='user'):
+        self.rate = rate
+        self.capacity = capacity
+        self.scope = scope
+
+
+def parse_rate(rate):
+    """
+    Parse a rate string like '5/s', '30/m' or '100/h' into tokens per second.
+
+    Raises:
+        ValueError: If the string is malformed
+    """
+    count, _, period = rate.partition('/')
+    if period not in PERIODS:
+        raise ValueError(f'Invalid rate {rate!r}; expected e.g. "5/s" or "30/m"')
+    return int(count) / PERIODS[period]
+
+
+def parse_limit(rule):
+    """
+    Build a Limit from a settings entry.
+
+    Accepts either a rate string ('5/s') or a dict with 'rate' and optional
+    'burst' (defaults to the per-period count) and 'scope' keys.
+    """
+    if isinstance(rule, str):
+        rule = {'rate': rule}
+    rate = parse_rate(rule['rate'])
+    burst = rule.get('burst') or int(rule['rate'].partition('/')[0])
+    return Limit(rate, float(burst), rule.get('scope', 'user'))
+
+
+class LocalBackend:
+    """
+    In-process token buckets. Fast, but each worker enforces its own limit.
+    """
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize  # Oldest idle buckets are evicted past this size
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def consume(self, key, limit, cost=1.0, now=None):
+        """
+        Try to take `cost` tokens from the bucket identified by `key`.
+
+        Returns:
+            (allowed, retry_after) where retry_after is the number of seconds
+            until enough tokens are available (0 when allowed)
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = limit.capacity
+            else:
+                tokens = min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate)
+                self._buckets.move_to_end(key)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (cost - tokens) / limit.rate
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def refund(self, key, limit, cost=1.0, now=None):
+        """
+        Give back `cost` tokens taken by consume() for a request that was not served.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                self._buckets[key] = (min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate + cost), now)
+
+    def reset(self):
+        """Forget every bucket (used by tests)."""
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBackend:
+    """
+    Token buckets stored in Django's cache so every worker shares them.
+
+    With chat.sqlite_cache.SQLiteCache each bucket is updated in one atomic
+    step. Other cache backends read and write separately; under heavy
+    concurrency a few extra requests can slip through, which is acceptable
+    for abuse protection.
+    """
+
+    prefix = 'chat:ratelimit:'
+
+    def consume(self, key, limit, cost=1.0, now=None):
+        """
+        Same contract as LocalBackend.consume(), using wall-clock time.
+        """
+        now = time.time() if now is None else now
+        cache_key = self.prefix + key
+        result = []
+
+        def refill(bucket):
+            if bucket is None:
+                tokens = limit.capacity
+            else:
+                tokens = min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate)
+            if tokens >= cost:
+                tokens -= cost
+                result[:] = [True, 0.0]
+            else:
+                result[:] = [False, (cost - tokens) / limit.rate]
+            return (tokens, now)
+
+        # Keep the entry only as long as it takes to refill completely
+        timeout = math.ceil(limit.capacity / limit.rate) + 1
+        if hasattr(cache, 'update'):
+            cache.update(cache_key, refill, timeout)
+        else:
+            cache.set(cache_key, refill(cache.get(cache_key)), timeout)
+        return tuple(result)
+
+    def refund(self, key, limit, cost=1.0, now=None):
+        """
+        Same contract as LocalBackend.refund(), using wall-clock time.
+        """
+        now = time.time() if now is None else now
+        cache_key = self.prefix + key
+
+        def give_back(bucket):
+            if bucket is None:
+                return None  # Expired: the bucket is full again anyway
+            return (min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate + cost), now)
+
+        timeout = math.ceil(limit.capacity / limit.rate) + 1
+        if hasattr(cache, 'update'):
+            cache.update(cache_key, give_back, timeout)
+        else:
+            bucket = give_back(cache.get(cache_key))
+            if bucket is not None:
+                cache.set(cache_key, bucket, timeout)
+
+    def reset(self):
+        """Shared buckets expire on their own; nothing to do."""
+
+
+def get_backend():
+    """
+    Return the backend selected by settings.CHAT_RATE_LIMIT_BACKEND.
+    """
+    if getattr(settings, 'CHAT_RATE_LIMIT_BACKEND', 'local') == 'cache':
+        return CacheBackend()
+    return LocalBackend()
+
+
+# Process-wide backend and parsed rules (settings are read once at import)
+backend = get_backend()
+rules = {
+    name: [parse_limit(rule) for rule in (config if isinstance(config, list) else [config])]
+    for name, config in getattr(settings, 'CHAT_RATE_LIMITS', {}).items()
+} if getattr(settings, 'CHAT_RATE_LIMITS_ENABLED', True) else {}
+
+
+def client_key(request):
+    """
+    Identify the caller: user id when signed in, otherwise the client IP.
+
+    X-Forwarded-For is only read when CHAT_RATE_LIMIT_TRUSTED_PROXIES says
+    how many proxies (Render, Vercel) sit in front of the app: each appends
+    the address it saw, so the entry that many places from the end is the
+    one the client could not spoof. Without trusted proxies the header is
+    client-controlled and REMOTE_ADDR is used.
+    """
+    if request.user.is_authenticated:
+        return f'u{request.user.id}'
+    if TRUSTED_PROXIES:
+        forwarded = [entry.strip() for entry in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+        if len(forwarded) >= TRUSTED_PROXIES and forwarded[-TRUSTED_PROXIES]:
+            return 'ip' + forwarded[-TRUSTED_PROXIES]
+    return 'ip' + request.META.get('REMOTE_ADDR', '')
+
+
+def room_key(request, view_kwargs):
+    """
+    Identify the room a request targets (URL kwarg or posted chat_room_id).
+    """
+    room_id = view_kwargs.get('room_id')
+    if room_id is None and request.method == 'POST':
+        room_id = request.POST.get('chat_room_id')
+    return f'r{room_id}' if room_id else None
+
+
+def check(request, name, limits, view_kwargs=None):
+    """
+    Apply `limits` for the endpoint `name` to `request`.
+
+    A refused request is not served, so the tokens it already took from the
+    limits checked before the one refusing it are given back.
+
+    Returns:
+        None if the request may proceed, otherwise a 429 JsonResponse
+    """
+    taken = []
+    for index, limit in enumerate(limits):
+        if limit.scope == 'room':
+            subject = room_key(request, view_kwargs or {})
+            if subject is None:
+                continue
+        else:
+            subject = client_key(request)
+        key = f'{name}:{index}:{subject}'
+        allowed, retry_after = backend.consume(key, limit)
+        if not allowed:
+            for taken_key, taken_limit in taken:
+                backend.refund(taken_key, taken_limit)
+            return too_many_requests(retry_after)
+        taken.append((key, limit))
+    return None
+
+
+def too_many_requests(retry_after):
+    """
+    Build the 429 response with a Retry-After header (whole seconds).
+    """
+    response = JsonResponse(
+        {'success': False, 'error': 'Too many requests, please slow down'},
+        status=429,
+    )
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def ratelimit(rate, burst=None, scope='user'):
+    """
+    Decorator limiting a single view, independent of CHAT_RATE_LIMITS.
+
+    Usage:
+        @ratelimit('5/s', burst=10)
+        def my_view(request): ...
+    """
+    limits = [parse_limit({'rate': rate, 'burst': burst, 'scope': scope})]
+
+    def decorator(view_func):
+        name = f'{view_func.__module__}.{view_func.__name__}'
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            limited = check(request, name, limits, kwargs)
+            if limited is not None:
+                return limited
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
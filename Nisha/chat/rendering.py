@@ -0,0 +1,99 @@
+# Message rendering: stored safe HTML and plain-text previews
+# Message text is user input. Clients must never insert it as HTML, and
+# escaping, linkifying and formatting it on every poll would repeat the same
+# work for every reader. Instead each message is rendered once when it is
+# written (Message.save() calls render()) and the results are stored next to
+# the text:
+#   content_html    escaped text with links, **bold**, _italic_, `code` and line breaks
+#   preview         plain text, whitespace collapsed, cut to PREVIEW_LENGTH (sidebar)
+#   render_version  RENDER_VERSION of the renderer that produced them
+# Reads copy the stored values. When the renderer changes, bump RENDER_VERSION
+# and run `manage.py rerender_messages`, which re-renders older rows in
+# batches while the site keeps serving the previous (still safe) output.
+# Rows that were never rendered (version 0, e.g. from bulk_create) are
+# rendered on read until the command catches up.
+
+import re  # Tokenizing links and inline formatting
+
+from django.utils.html import escape  # Everything user-supplied is escaped first
+
+# Bump whenever render() output changes; stored rows with a lower version are re-rendered
+RENDER_VERSION = 1
+
+# Characters kept in previews (an ellipsis is added when cut)
+PREVIEW_LENGTH = 100
+
+# Inline code spans are copied verbatim (escaped, no formatting inside)
+CODE_RE = re.compile(r'`([^`\n]+)`')
+
+# Links: http(s) URLs up to whitespace; trailing punctuation stays outside the link
+URL_RE = re.compile(r'https?://[^\s<>"]+[^\s<>".,;:!?)\]\'"]')
+
+# Emphasis on escaped text (markers must hug the text, like Markdown)
+BOLD_RE = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*')
+ITALIC_RE = re.compile(r'(?<![\w*])[_*](?=\S)(.+?)(?<=\S)[_*](?![\w*])')
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _format_text(text):
+    """Escape plain text (no code, no links) and apply emphasis."""
+    html = escape(text)
+    html = BOLD_RE.sub(r'<strong>\1</strong>', html)
+    return ITALIC_RE.sub(r'<em>\1</em>', html)
+
+
+def _format_links(text):
+    """Escape text outside code spans, turning URLs into links."""
+    parts, position = [], 0
+    for match in URL_RE.finditer(text):
+        parts.append(_format_text(text[position:match.start()]))
+        url = escape(match.group())
+        parts.append(f'<a href="{url}" target="_blank" rel="noopener noreferrer nofollow">{url}</a>')
+        position = match.end()
+    parts.append(_format_text(text[position:]))
+    return ''.join(parts)
+
+
+def render_html(content):
+    """
+    Safe HTML for message text.
+
+    Every character of `content` is escaped; the only tags in the output are
+    the ones added here (a, strong, em, code, br).
+    """
+    parts, position = [], 0
+    for match in CODE_RE.finditer(content):
+        parts.append(_format_links(content[position:match.start()]))
+        parts.append(f'<code>{escape(match.group(1))}</code>')
+        position = match.end()
+    parts.append(_format_links(content[position:]))
+    return ''.join(parts).replace('\r\n', '\n').replace('\n', '<br>')
+
+
+def render_preview(content):
+    """Plain-text preview: single line, at most PREVIEW_LENGTH characters plus an ellipsis."""
+    text = WHITESPACE_RE.sub(' ', content).strip()
+    if len(text) > PREVIEW_LENGTH:
+        text = text[:PREVIEW_LENGTH].rstrip() + '…'
+    return text
+
+
+def render(message):
+    """Fill in the stored representations of `message` from its content (does not save)."""
+    message.content_html = render_html(message.content)
+    message.preview = render_preview(message.content)
+    message.render_version = RENDER_VERSION
+    return message
+
+
+def stored(message):
+    """
+    (content_html, preview) of a message for serialization.
+
+    Rows that were never rendered are rendered now (not saved); everything
+    else is served as stored, including output of older renderer versions.
+    """
+    if not message.render_version:
+        render(message)
+    return message.content_html, message.preview
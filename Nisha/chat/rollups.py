@@ -0,0 +1,178 @@
+# Precomputed chat activity (messages per room and per user, per hour and day)
+# Questions like "messages per room per hour" or "most active users this week"
+# would otherwise aggregate the whole chat_message table (on every shard).
+# Instead ActivityRollupConsumer tails the event log ('message.created') and
+# adds each batch to small rollup tables (RoomActivity, UserActivity) with a
+# few bulk queries. The staff report (activity_report(), /chat/stats/activity/)
+# reads only those tables, so its cost depends on the number of buckets in the
+# window, not on the number of messages.
+#
+# Buckets are UTC hours and days keyed by the message timestamp. Rollups count
+# messages as sent: later edits and deletions do not change them. The numbers
+# lag the chat by however far `manage.py consume_events` is behind (the
+# report includes that lag). Rebuild from the log with
+# `manage.py consume_events --rebuild activity-rollups`.
+
+from collections import defaultdict  # Per-batch deltas
+from datetime import timedelta, timezone as dt_timezone  # Bucket arithmetic
+
+from django.contrib.auth.models import User  # Names in the report
+from django.db.models import Max, Sum  # Report aggregation over rollup rows
+from django.utils import timezone  # Current time for report windows
+from django.utils.dateparse import parse_datetime  # Event payload timestamps
+
+from . import eventlog  # Consumer base class and log locations
+from .models import ChatEvent, ChatRoom, ConsumerCheckpoint, RoomActivity, UserActivity  # Rollups and report context
+
+# Bucket lengths, and the default report window of each
+PERIODS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+DEFAULT_DAYS = {'hour': 2, 'day': 7}
+MAX_DAYS = 366
+
+# Rows written per bulk query
+BATCH_SIZE = 500
+
+
+def bucket_start(moment, period):
+    """Start of the UTC hour or day containing `moment`."""
+    moment = moment.astimezone(dt_timezone.utc)
+    if period == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def apply_deltas(model, field, deltas):
+    """
+    Add per-bucket counts to a rollup table: one read, then bulk updates and inserts.
+
+    Args:
+        model: RoomActivity or UserActivity
+        field: Their key field ('room_id' / 'user_id')
+        deltas: {(period, key id, bucket): [messages, characters]}
+    """
+    if not deltas:
+        return
+    rows = model.objects.filter(**{
+        'period__in': {period for period, _, _ in deltas},
+        f'{field}__in': {key for _, key, _ in deltas},
+        'bucket__in': {bucket for _, _, bucket in deltas},
+    })
+    changed = []
+    for row in rows:
+        delta = deltas.pop((row.period, getattr(row, field), row.bucket), None)
+        if delta is not None:
+            row.messages += delta[0]
+            row.characters += delta[1]
+            changed.append(row)
+    model.objects.bulk_update(changed, ['messages', 'characters'], batch_size=BATCH_SIZE)
+    model.objects.bulk_create([
+        model(period=period, bucket=bucket, messages=messages, characters=characters, **{field: key})
+        for (period, key, bucket), (messages, characters) in deltas.items()
+    ], batch_size=BATCH_SIZE)
+
+
+class ActivityRollupConsumer(eventlog.Consumer):
+    """
+    Event log consumer maintaining RoomActivity and UserActivity.
+    """
+
+    name = 'activity-rollups'
+    kinds = ('message.created',)
+
+    def handle(self, events):
+        rooms = defaultdict(lambda: [0, 0])
+        users = defaultdict(lambda: [0, 0])
+        for event in events:
+            sent_at = parse_datetime(event.payload.get('timestamp') or '') or event.created_at
+            length = len(event.payload.get('content') or '')
+            for period in PERIODS:
+                bucket = bucket_start(sent_at, period)
+                for totals, key in ((rooms, event.room_id), (users, event.user_id)):
+                    if key is not None:
+                        totals[(period, key, bucket)][0] += 1
+                        totals[(period, key, bucket)][1] += length
+        apply_deltas(RoomActivity, 'room_id', rooms)
+        apply_deltas(UserActivity, 'user_id', users)
+
+    def reset(self):
+        RoomActivity.objects.all().delete()
+        UserActivity.objects.all().delete()
+
+
+def pending_events():
+    """Logged events the rollups have not processed yet (all logs)."""
+    positions = dict(ConsumerCheckpoint.objects.values_list('name', 'position'))
+    pending = 0
+    for alias in eventlog.log_aliases():
+        head = ChatEvent.objects.using(alias).aggregate(head=Max('id'))['head'] or 0
+        pending += head - positions.get(eventlog.checkpoint_name(ActivityRollupConsumer, alias), 0)
+    return pending
+
+
+def activity_report(period='day', days=None, room_id=None, user_id=None, limit=10, now=None):
+    """
+    Activity over the last `days` days, read from the rollup tables only.
+
+    Args:
+        period: 'hour' or 'day' buckets
+        days: Window length (default 2 for hours, 7 for days)
+        room_id: Restrict the series to one room (top rooms and users always cover all rooms)
+        user_id: Restrict the series to one user
+        limit: Length of the top room/user lists
+
+    Returns:
+        Dictionary with the bucket series, top rooms, top users and the
+        consumer lag ('pending_events')
+    """
+    days = min(days or DEFAULT_DAYS[period], MAX_DAYS)
+    until = bucket_start(now or timezone.now(), period) + PERIODS[period]
+    since = until - timedelta(days=days)
+    window = {'period': period, 'bucket__gte': since, 'bucket__lt': until}
+
+    if user_id is not None:
+        series_rows = UserActivity.objects.filter(user_id=user_id, **window)
+    else:
+        series_rows = RoomActivity.objects.filter(**window)
+        if room_id is not None:
+            series_rows = series_rows.filter(room_id=room_id)
+    series = series_rows.values('bucket').annotate(
+        total_messages=Sum('messages'), total_characters=Sum('characters'),
+    ).order_by('bucket')
+
+    top_rooms = list(
+        RoomActivity.objects.filter(**window).values('room_id')
+        .annotate(total=Sum('messages')).order_by('-total', 'room_id')[:limit]
+    )
+    room_names = ChatRoom.objects.in_bulk([row['room_id'] for row in top_rooms])
+    top_users = list(
+        UserActivity.objects.filter(**window).values('user_id')
+        .annotate(total=Sum('messages')).order_by('-total', 'user_id')[:limit]
+    )
+    usernames = User.objects.in_bulk([row['user_id'] for row in top_users])
+
+    return {
+        'period': period,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'series': [
+            {'bucket': row['bucket'].isoformat(), 'messages': row['total_messages'], 'characters': row['total_characters']}
+            for row in series
+        ],
+        'top_rooms': [
+            {
+                'room_id': row['room_id'],
+                'name': room_names[row['room_id']].name if row['room_id'] in room_names else None,
+                'messages': row['total'],
+            }
+            for row in top_rooms
+        ],
+        'top_users': [
+            {
+                'user_id': row['user_id'],
+                'username': usernames[row['user_id']].username if row['user_id'] in usernames else None,
+                'messages': row['total'],
+            }
+            for row in top_users
+        ],
+        'pending_events': pending_events(),
+    }
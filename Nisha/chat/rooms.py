@@ -0,0 +1,157 @@
+# Room creation and membership helpers
+# Direct messages between two users live in one canonical room, identified by
+# ChatRoom.dm_key (the ordered pair of user ids, unique in the database).
+# Looking the room up is a single indexed query and creating it is safe under
+# concurrent requests: the loser of a creation race hits the unique index,
+# rolls back its half-created room and returns the winner's. Nobody else can
+# join or be added to it.
+#
+# Large groups: membership changes go through ChatRoom.members in batches (one
+# existence check and one multi-row INSERT or DELETE per batch), the member
+# count is a column maintained by signals instead of a COUNT over the join
+# table, and member lists are read a page at a time by user id.
+
+from django.contrib.auth.models import User  # Members
+from django.db import IntegrityError, transaction  # Race-safe creation, atomic bulk changes
+from django.db.models import Count, OuterRef, Subquery, Value  # Member recounts
+from django.db.models.functions import Coalesce  # Rooms without members count 0
+
+from .models import ChatRoom  # Rooms (and their dm_key / member_count)
+
+# Users added or removed per statement by add_members()/remove_members()
+MEMBER_BATCH_SIZE = 500
+
+# Members returned per page by member_page()
+MEMBER_PAGE_SIZE = 50
+
+
+def get_direct_room(user_id, other_user_id):
+    """
+    Return the direct-message room between two users, or None.
+    """
+    return ChatRoom.objects.filter(dm_key=ChatRoom.dm_key_for(user_id, other_user_id)).first()
+
+
+def may_join(room, user_id):
+    """
+    Whether `user_id` may be a member of `room`: anyone for ordinary rooms,
+    only the two participants for a direct-message room.
+    """
+    if room.dm_key is None:
+        return True
+    return str(user_id) in room.dm_key.split(':')
+
+
+def get_or_create_direct_room(user, other, name=None, description=''):
+    """
+    Return the direct-message room between `user` and `other`, creating it
+    (with both as members) when it does not exist yet.
+
+    Args:
+        user: User asking for the room (becomes created_by if it is new)
+        other: The other participant (may be `user` for a notes-to-self room)
+        name: Display name for a new room (default: both usernames)
+        description: Optional description for a new room
+
+    Returns:
+        (room, created)
+    """
+    key = ChatRoom.dm_key_for(user.id, other.id)
+    room = ChatRoom.objects.filter(dm_key=key).first()
+    if room is not None:
+        return room, False
+    try:
+        with transaction.atomic():
+            room = ChatRoom.objects.create(
+                name=name or ' & '.join(sorted({user.username, other.username})),
+                description=description,
+                created_by=user,
+                is_group=False,
+                dm_key=key,
+            )
+            room.members.add(*{user, other})
+        return room, True
+    except IntegrityError:
+        # Someone created the same DM between our lookup and our insert
+        return ChatRoom.objects.get(dm_key=key), False
+
+
+def recount_members(room_ids):
+    """
+    Recompute ChatRoom.member_count for `room_ids` with one UPDATE.
+    """
+    Membership = ChatRoom.members.through
+    counts = (
+        Membership.objects.filter(chatroom_id=OuterRef('pk'))
+        .order_by()
+        .values('chatroom_id')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    ChatRoom.objects.filter(pk__in=room_ids).update(member_count=Coalesce(Subquery(counts), Value(0)))
+
+
+def _batches(user_ids, batch_size):
+    user_ids = sorted({int(user_id) for user_id in user_ids})
+    for start in range(0, len(user_ids), batch_size):
+        yield user_ids[start:start + batch_size]
+
+
+def _member_count(room):
+    return ChatRoom.objects.filter(pk=room.pk).values_list('member_count', flat=True).get()
+
+
+def add_members(room, user_ids, batch_size=MEMBER_BATCH_SIZE):
+    """
+    Add many users to a room, `batch_size` at a time, in one transaction.
+
+    Each batch is one user lookup (unknown ids are skipped) plus the
+    existence check and multi-row INSERT done by members.add(), which
+    also skips existing members and fires the cache/count signals.
+
+    Returns:
+        Number of members actually added
+    """
+    with transaction.atomic():
+        before = _member_count(room)
+        for batch in _batches(user_ids, batch_size):
+            known = list(User.objects.filter(id__in=batch).values_list('id', flat=True))
+            if known:
+                room.members.add(*known)
+        return _member_count(room) - before
+
+
+def remove_members(room, user_ids, batch_size=MEMBER_BATCH_SIZE):
+    """
+    Remove many users from a room, `batch_size` at a time, in one transaction.
+
+    Returns:
+        Number of members actually removed
+    """
+    with transaction.atomic():
+        before = _member_count(room)
+        for batch in _batches(user_ids, batch_size):
+            room.members.remove(*batch)
+        return before - _member_count(room)
+
+
+def member_page(room_id, query='', after=0, limit=MEMBER_PAGE_SIZE):
+    """
+    One page of a room's members ordered by user id, optionally filtered by
+    username prefix (case-insensitive).
+
+    Args:
+        room_id: Room to list
+        query: Username prefix to search for
+        after: Return members with a user id greater than this (the previous
+            page's 'next' value)
+        limit: Page size
+
+    Returns:
+        (list of (user id, username), next `after` value or None on the last page)
+    """
+    members = User.objects.filter(chat_rooms=room_id, id__gt=after)
+    if query:
+        members = members.filter(username__istartswith=query)
+    rows = list(members.order_by('id').values_list('id', 'username')[:limit + 1])
+    return rows[:limit], rows[limit - 1][0] if len(rows) > limit else None
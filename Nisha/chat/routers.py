@@ -0,0 +1,44 @@
+# Database router for message sharding (see chat/sharding.py)
+# Only installed when CHAT_SHARD_COUNT > 0. Every model except Message (and the
+# per-shard event log, always accessed with using()) lives in 'default';
+# Message rows are routed to their room's shard whenever Django
+# gives us a hint (a message or room instance), e.g. room.messages.all() or
+# message.save(). Plain Message.objects queries carry no hint, so the views use
+# chat.sharding.room_messages() / group_rooms() / all_messages() and the
+# message admin its database filter to pick the database. Messages outside
+# rooms (the legacy global chat) are always stored in 'default'.
+
+from . import sharding  # Room -> database alias mapping
+from .models import ChatRoom, Message  # Models with shard-aware routing
+
+
+class ShardRouter:
+    """
+    Route Message reads/writes to shards and keep shards message-only.
+    """
+
+    def _route(self, model, hints):
+        if model is not Message:
+            return 'default'
+        instance = hints.get('instance')
+        if isinstance(instance, ChatRoom):
+            return sharding.alias_for_shard(instance.shard)
+        if isinstance(instance, Message) and instance.chat_room_id:
+            return sharding.alias_for_room(instance.chat_room_id)
+        return None  # No hint: Django falls back to 'default'
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Messages on a shard reference users and rooms in 'default' by id
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default':
+            return None
+        # Shards only hold messages and their event log
+        return app_label == 'chat' and model_name in ('message', 'chatevent')
@@ -0,0 +1,327 @@
+# Optional sharding of chat messages across databases
+# With one SQLite file every room's messages share one table and one write
+# lock, so a busy group chat slows down all the others. Setting
+# CHAT_SHARD_COUNT=N adds N database aliases ('shard0' ... 'shardN-1', separate
+# SQLite files by default) that hold chat_message rows and their event log
+# (chat/eventlog.py). Users, rooms and memberships stay in 'default'.
+#
+# Each ChatRoom records its shard (ChatRoom.shard). New rooms are spread over
+# the shards; rooms created before sharding keep shard=None and stay in
+# 'default' until moved. The room -> shard lookup goes through the room cache
+# (chat/cache.py), so routing a request costs no query.
+#
+# Message ids on shards are generated here instead of by AUTOINCREMENT:
+#   id = (max(now_ms << 10, previous id on the shard >> 6 + 1) << 6) | shard + 1
+# They are unique across shards (the low bits name the shard that assigned
+# them), keep increasing within a shard, and stay larger than every id already
+# present after a room is moved in, so the "messages after id X" cursors used
+# by the chat UI keep working across moves. Shards use BEGIN IMMEDIATE
+# transactions so reading the previous id and inserting are serialized.
+#
+# Moving a room (move_room, `manage.py shards move`) is online: messages are
+# copied in batches while the room stays writable, the room is switched to its
+# new shard, changes (new messages, edits, deletions) made by workers that
+# still had the old mapping cached are copied for a drain period, and only
+# then the old rows are deleted. Changes are found by the room's change
+# sequence (Message.seq, chat/changes.py) and upserted by id; after the switch
+# they are renumbered on the target, whose numbers may already be taken.
+
+import heapq  # Merging messages read from several databases
+import time  # Millisecond clock for ids, drain period for moves
+
+from django.conf import settings  # CHAT_SHARD_COUNT
+from django.core.exceptions import ImproperlyConfigured  # Rooms pointing at unconfigured shards
+from django.db import transaction  # Serialized id assignment, atomic cutover
+from django.db.models import Count, Max  # Id generation and status reports
+
+from . import cache as chat_cache  # Cached room metadata (holds the shard number)
+from . import rendering  # Stored message previews for the sidebar
+from .models import ChatRoom, Message  # Rooms in 'default', messages on shards
+
+# Number of message shards (0 disables sharding entirely)
+SHARD_COUNT = getattr(settings, 'CHAT_SHARD_COUNT', 0)
+
+# Bits reserved below the timestamp for ids assigned within the same millisecond
+SEQUENCE_BITS = 10
+
+# Bits reserved for the shard that assigned the id (up to 63 shards)
+SHARD_BITS = 6
+
+# Columns overwritten when a moved message is copied again
+COPIED_FIELDS = [field.attname for field in Message._meta.concrete_fields if not field.primary_key]
+
+
+def shard_aliases():
+    """Database aliases of every configured shard, in shard order."""
+    return [f'shard{index}' for index in range(SHARD_COUNT)]
+
+
+def alias_for_shard(shard):
+    """
+    Database alias storing the messages of rooms with ChatRoom.shard == `shard`.
+    """
+    if shard is None:
+        return 'default'
+    if not 0 <= shard < SHARD_COUNT:
+        raise ImproperlyConfigured(f'Room points at shard {shard} but CHAT_SHARD_COUNT is {SHARD_COUNT}')
+    return f'shard{shard}'
+
+
+def alias_for_room(room_id):
+    """
+    Database alias storing the messages of `room_id` (from the room cache).
+    """
+    if not SHARD_COUNT or room_id is None:
+        return 'default'
+    room = chat_cache.get_room(room_id)
+    return alias_for_shard(room.shard if room is not None else None)
+
+
+def pick_shard(room_id):
+    """
+    Shard for a newly created room: room ids are spread round-robin.
+    """
+    return room_id % SHARD_COUNT if SHARD_COUNT else None
+
+
+def room_messages(room_id):
+    """
+    QuerySet of the messages of `room_id`, on the database that stores them.
+    """
+    return Message.objects.using(alias_for_room(room_id)).filter(chat_room_id=room_id)
+
+
+def message_aliases():
+    """Every database holding messages: 'default', then the shards."""
+    return ['default'] + shard_aliases()
+
+
+def all_messages():
+    """
+    Every message on every database, oldest first (legacy chat view).
+
+    Rows of a room being moved exist on two databases until the move
+    finishes; each id is listed once.
+    """
+    messages, seen = [], set()
+    for message in heapq.merge(
+        *(Message.objects.using(alias).order_by('timestamp') for alias in message_aliases()),
+        key=lambda message: message.timestamp,
+    ):
+        if message.id not in seen:
+            seen.add(message.id)
+            messages.append(message)
+    return messages
+
+
+def group_rooms(room_ids):
+    """
+    Group room ids by the database alias storing their messages.
+
+    Returns:
+        Dictionary of alias -> list of room ids
+    """
+    groups = {}
+    for room_id in room_ids:
+        groups.setdefault(alias_for_room(room_id), []).append(room_id)
+    return groups
+
+
+def next_id(alias):
+    """
+    Next message id for shard `alias` (call inside its write transaction).
+    """
+    index = int(alias[len('shard'):]) + 1  # 0 is left for ids assigned in 'default'
+    previous = Message.objects.using(alias).aggregate(last=Max('id'))['last'] or 0
+    stamp = max(int(time.time() * 1000) << SEQUENCE_BITS, (previous >> SHARD_BITS) + 1)
+    return (stamp << SHARD_BITS) | index
+
+
+def create_message(**fields):
+    """
+    Create a Message on the database its room lives on.
+
+    Accepts the same keyword arguments as Message.objects.create().
+    """
+    room = fields.get('chat_room')
+    room_id = room.id if room is not None else fields.get('chat_room_id')
+    alias = alias_for_room(room_id)
+    if alias == 'default':
+        return Message.objects.using('default').create(**fields)
+    with transaction.atomic(using=alias):
+        message = Message(**fields)
+        message.id = next_id(alias)
+        message.save(force_insert=True, using=alias)
+    return message
+
+
+def last_messages(room_ids):
+    """
+    Return the newest (not deleted) message of each room, querying each database once or twice.
+
+    Returns:
+        Dictionary of room id -> Message
+    """
+    latest = {}
+    for alias, ids in group_rooms(room_ids).items():
+        messages = Message.objects.using(alias).filter(deleted_at__isnull=True)
+        last_ids = messages.filter(chat_room_id__in=ids).values('chat_room_id').annotate(last=Max('id'))
+        latest.update((msg.chat_room_id, msg) for msg in messages.filter(id__in=[row['last'] for row in last_ids]))
+    return latest
+
+
+def with_last_messages(rooms):
+    """
+    Evaluate `rooms` and attach last_message_preview/at/id to each room, the
+    attributes the sidebar template reads (cross-database version of the
+    Subquery annotation used without sharding).
+    """
+    rooms = list(rooms)
+    latest = last_messages([room.id for room in rooms])
+    for room in rooms:
+        message = latest.get(room.id)
+        room.last_message_preview = rendering.stored(message)[1] if message else None
+        room.last_message_at = message.timestamp if message else None
+        room.last_message_id = message.id if message else None
+    return rooms
+
+
+def _copy_batch(room_id, source, target, after, batch_size):
+    """
+    Copy up to `batch_size` messages of `room_id` with id > `after`.
+
+    Rows already on the target are overwritten (upsert by id), which makes
+    re-running an interrupted move safe.
+
+    Returns:
+        (copied, last id copied or `after`)
+    """
+    batch = list(Message.objects.using(source).filter(chat_room_id=room_id, id__gt=after).order_by('id')[:batch_size])
+    if batch:
+        Message.objects.using(target).bulk_create(
+            batch, update_conflicts=True, unique_fields=['id'], update_fields=COPIED_FIELDS,
+        )
+        after = batch[-1].id
+    return len(batch), after
+
+
+def _copy_changes(room_id, source, target, after, batch_size, renumber=False):
+    """
+    Copy up to `batch_size` messages of `room_id` changed on the source after
+    its change sequence number `after`: sent, edited or deleted there since
+    they were last copied. Each replaces its copy on the target (by id).
+
+    Until the switch the target mirrors the source and rows keep their
+    numbers. After it the target numbers its own changes, and a worker with a
+    stale mapping may have used the same number on the source; with
+    `renumber` each late change takes the target's next number instead, as
+    if it had been written there.
+
+    Returns:
+        (copied, last source sequence number copied or `after`)
+    """
+    from . import changes  # Imported lazily: changes imports this module
+
+    batch = list(
+        Message.objects.using(source).filter(chat_room_id=room_id, seq__gt=after).order_by('seq')[:batch_size]
+    )
+    if not batch:
+        return 0, after
+    after = batch[-1].seq
+    with transaction.atomic(using=target):
+        if not renumber:
+            Message.objects.using(target).bulk_create(
+                batch, update_conflicts=True, unique_fields=['id'], update_fields=COPIED_FIELDS,
+            )
+        else:
+            for message in batch:
+                # One row per statement: the number is evaluated in the statement
+                message.seq = changes.next_seq(room_id)
+                Message.objects.using(target).bulk_create(
+                    [message], update_conflicts=True, unique_fields=['id'], update_fields=COPIED_FIELDS,
+                )
+    return len(batch), after
+
+
+def move_room(room_id, shard, batch_size=1000, drain_seconds=None, log=None):
+    """
+    Move a room's messages to another shard while the room stays in use.
+
+    Messages are copied by id first. Everything sent, edited or deleted on
+    the source after that is then found by its change sequence number and
+    copied again, so no change made through the old mapping is lost.
+
+    Args:
+        room_id: Room to move
+        shard: Target shard number
+        batch_size: Messages copied per batch
+        drain_seconds: How long to keep copying messages written through a
+            stale cached mapping after the switch (default: until every
+            cache layer has expired the old room entry)
+        log: Optional callable receiving progress lines
+
+    Returns:
+        Number of messages copied (rows copied again after a change included)
+    """
+    log = log or (lambda line: None)
+    room = ChatRoom.objects.get(id=room_id)
+    source, target = alias_for_shard(room.shard), alias_for_shard(shard)
+    if source == target:
+        log(f'room {room_id} already on {target}')
+        return 0
+    if drain_seconds is None:
+        drain_seconds = chat_cache.LOCAL_TTL + chat_cache.SHARED_TIMEOUT
+
+    # 1. Bulk copy while the room keeps receiving messages on the source;
+    # changes made meanwhile have a sequence number above `seq`
+    seq = Message.objects.using(source).filter(chat_room_id=room_id).aggregate(last=Max('seq'))['last'] or 0
+    copied, cursor = 0, 0
+    while True:
+        count, cursor = _copy_batch(room_id, source, target, cursor, batch_size)
+        copied += count
+        if count < batch_size:
+            break
+    log(f'room {room_id}: copied {copied} messages {source} -> {target}')
+
+    # 2. Switch: catch up under the source's write lock, then repoint the room
+    with transaction.atomic(using=source):
+        while True:
+            count, seq = _copy_changes(room_id, source, target, seq, batch_size)
+            copied += count
+            if count < batch_size:
+                break
+        ChatRoom.objects.filter(id=room_id).update(shard=shard)
+    chat_cache.invalidate_room(room_id)
+    log(f'room {room_id}: now served from {target}')
+
+    # 3. Drain: workers may use their cached mapping for a while longer
+    deadline = time.monotonic() + drain_seconds
+    while True:
+        count, seq = _copy_changes(room_id, source, target, seq, batch_size, renumber=True)
+        copied += count
+        if count:
+            log(f'room {room_id}: copied {count} late changes')
+        if count == batch_size:
+            continue
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+
+    # 4. Remove the source copy
+    Message.objects.using(source).filter(chat_room_id=room_id).delete()
+    return copied
+
+
+def status():
+    """
+    Rooms and messages stored per database alias.
+
+    Returns:
+        List of (alias, rooms, messages)
+    """
+    rooms = {row['shard']: row['count'] for row in ChatRoom.objects.values('shard').annotate(count=Count('id'))}
+    rows = []
+    for alias, shard in [('default', None)] + [(alias, i) for i, alias in enumerate(shard_aliases())]:
+        filters = {'chat_room__isnull': False} if alias == 'default' else {}
+        rows.append((alias, rooms.get(shard, 0), Message.objects.using(alias).filter(**filters).count()))
+    return rows
@@ -0,0 +1,195 @@
+# Signal handlers for the chat app
+# Keeps derived/cached state in sync with the database. Connected from
+# ChatConfig.ready() so they are registered exactly once per process.
+
+from django.contrib.auth.models import User  # Membership cache is keyed by user id
+from django.db.models import F  # Atomic member counter increments
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete  # Model lifecycle hooks
+from django.dispatch import receiver  # Decorator for connecting handlers
+
+from . import cache as chat_cache  # Room/membership cache helpers
+from . import eventlog  # Append-only chat event log
+from . import rooms  # Member count recounts
+from . import sharding  # Message shard placement
+from .models import ChatRoom, Message  # Models whose changes invalidate caches
+
+
+@receiver(m2m_changed, sender=ChatRoom.members.through)
+def invalidate_membership_on_change(sender, instance, action, reverse, pk_set, using='default', **kwargs):
+    """
+    Invalidate membership caches when ChatRoom.members changes.
+
+    Handles both directions of the relation:
+    room.members.add(user) (forward) and user.chat_rooms.add(room) (reverse).
+    The caches are dropped again after the transaction commits, so a poll
+    that read the old membership before the commit cannot keep it cached.
+    """
+    if action == 'pre_clear':
+        # clear() does not report which rows it removes, so remember them now
+        if reverse:
+            instance._chat_cleared_ids = list(instance.chat_rooms.values_list('id', flat=True))
+        else:
+            instance._chat_cleared_ids = list(instance.members.values_list('id', flat=True))
+        return
+
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_chat_cleared_ids', [])
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            # instance is the user, pk_set holds room ids
+            user_ids, room_ids = [instance.pk], pk_set or []
+        else:
+            # instance is the room, pk_set holds user ids
+            user_ids, room_ids = pk_set or [], [instance.pk]
+        user_ids, room_ids = list(user_ids), list(room_ids)
+        chat_cache.invalidate_after_commit(chat_cache.invalidate_memberships, user_ids, using=using)
+        chat_cache.invalidate_after_commit(chat_cache.invalidate_room_members, room_ids, using=using)
+
+
+@receiver(m2m_changed, sender=ChatRoom.members.through)
+def update_member_count(sender, instance, action, reverse, pk_set, using='default', **kwargs):
+    """
+    Keep ChatRoom.member_count in step with ChatRoom.members.
+
+    Additions increment the counter (Django reports only the rows add()
+    actually inserted). Removals and clears recount the affected rooms,
+    because remove() reports every id it was given, member or not. Cached
+    rooms are dropped again after the transaction commits (rooms.add_members()
+    and remove_members() run in one).
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        room_ids = [instance.pk]
+    elif action == 'post_clear':
+        room_ids = getattr(instance, '_chat_cleared_ids', [])
+    else:
+        room_ids = list(pk_set or [])
+    if not room_ids:
+        return
+
+    if action == 'post_add':
+        # Forward: one room gained len(pk_set) members; reverse: each room gained one
+        added = 1 if reverse else len(pk_set or [])
+        if added:
+            ChatRoom.objects.filter(pk__in=room_ids).update(member_count=F('member_count') + added)
+    else:
+        rooms.recount_members(room_ids)
+    for room_id in room_ids:
+        chat_cache.invalidate_after_commit(chat_cache.invalidate_room, room_id, using=using)
+
+
+@receiver(post_save, sender=ChatRoom)
+def assign_room_shard(sender, instance, created, raw=False, **kwargs):
+    """
+    Place a new room's messages on a shard (no-op unless CHAT_SHARD_COUNT is set).
+
+    Connected before invalidate_room_on_save so the cached room includes it.
+    """
+    if created and not raw and sharding.SHARD_COUNT and instance.shard is None:
+        instance.shard = sharding.pick_shard(instance.pk)
+        ChatRoom.objects.filter(pk=instance.pk).update(shard=instance.shard)
+
+
+@receiver(post_save, sender=ChatRoom)
+def invalidate_room_on_save(sender, instance, using='default', **kwargs):
+    """Drop cached room metadata whenever a room is created or edited (again after commit)."""
+    chat_cache.invalidate_after_commit(chat_cache.invalidate_room, instance.pk, using=using)
+    chat_cache.invalidate_after_commit(chat_cache.invalidate_room_members, [instance.pk], using=using)
+    chat_cache.invalidate_after_commit(chat_cache.touch_room, instance.pk, using=using)
+
+
+@receiver(post_save, sender=Message)
+def touch_room_on_message(sender, instance, using='default', **kwargs):
+    """Mark the message's room as changed so cached sidebars are rebuilt (again after commit)."""
+    if instance.chat_room_id:
+        chat_cache.invalidate_after_commit(chat_cache.touch_room, instance.chat_room_id, using=using)
+
+
+@receiver(post_save, sender=Message)
+def log_message_created(sender, instance, created, raw=False, using='default', **kwargs):
+    """
+    Append 'message.created' to the event log of the message's database.
+
+    post_save runs inside the caller's transaction, so when the message is
+    saved in transaction.atomic() (as send_message and sharded inserts do)
+    the event commits or rolls back together with it.
+    """
+    if created and not raw:
+        eventlog.append(
+            'message.created',
+            {
+                'message_id': instance.id,
+                'username': instance.username,
+                'content': instance.content,
+                'timestamp': instance.timestamp.isoformat(),
+            },
+            room_id=instance.chat_room_id,
+            user_id=instance.user_id,
+            using=using,
+        )
+
+
+@receiver(pre_delete, sender=ChatRoom)
+def remember_room_members(sender, instance, **kwargs):
+    """Capture the members of a room about to be deleted (the M2M rows cascade silently)."""
+    instance._chat_deleted_member_ids = list(instance.members.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=ChatRoom)
+def delete_sharded_room_messages(sender, instance, **kwargs):
+    """
+    Delete a room's messages stored on a shard.
+
+    The on_delete cascade only looks in the room's own database ('default').
+    """
+    if instance.shard is not None:
+        Message.objects.using(sharding.alias_for_shard(instance.shard)).filter(chat_room_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=ChatRoom)
+def invalidate_room_on_delete(sender, instance, using='default', **kwargs):
+    """Drop cached metadata and the membership sets that referenced a deleted room (again after commit)."""
+    chat_cache.invalidate_after_commit(chat_cache.invalidate_room, instance.pk, using=using)
+    chat_cache.invalidate_after_commit(chat_cache.invalidate_room_members, [instance.pk], using=using)
+    chat_cache.invalidate_after_commit(
+        chat_cache.invalidate_memberships, getattr(instance, '_chat_deleted_member_ids', []), using=using,
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_new_user_memberships(sender, instance, created, **kwargs):
+    """
+    Forget any membership set cached under a newly created user's id.
+
+    Database ids can be reused (e.g. SQLite after a rollback), so a new user
+    must never inherit a stale cached set.
+    """
+    if created:
+        chat_cache.invalidate_memberships([instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_user_messages(sender, instance, **kwargs):
+    """Delete a user's messages on every shard (the cascade only covers 'default')."""
+    for alias in sharding.shard_aliases():
+        Message.objects.using(alias).filter(user_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user_memberships(sender, instance, **kwargs):
+    """Forget the membership set of a deleted user."""
+    chat_cache.invalidate_memberships([instance.pk])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Forget the resolved user cached for the polling endpoints.
+
+    Only this process is notified; other workers pick up the change when
+    their entry expires (CHAT_AUTH_CACHE_TTL).
+    """
+    chat_cache.invalidate_user(instance.pk)
@@ -0,0 +1,342 @@
+# Node-wide cache backend on a SQLite file
+# Django's default LocMemCache lives inside one process, so each gunicorn
+# worker keeps its own copy of every cached room, membership set and page,
+# and an invalidation in one worker is never seen by the others. There is no
+# Redis or Memcached where we deploy, but every worker on a node can open the
+# same SQLite file, so this backend keeps the shared cache there.
+#
+#   CACHES = {'default': {
+#       'BACKEND': 'chat.sqlite_cache.SQLiteCache',
+#       'LOCATION': '/var/lib/nisha/cache/cache.sqlite3',  # private directory
+#       'OPTIONS': {'MAX_ENTRIES': 20000},
+#   }}
+#
+# The file is in WAL mode: readers never wait for the writer, and writers
+# commit without an fsync (synchronous=NORMAL; a cache may lose its last
+# writes on power loss). Every thread gets its own connection, reopened
+# after a fork.
+#
+# Eviction: expired entries are never returned and are deleted in batches.
+# Once the table holds more than MAX_ENTRIES, the least recently used entries
+# are deleted until 1/CULL_FREQUENCY of the space is free again. Reads record
+# their access time at most once per ACCESS_RESOLUTION seconds per entry, so
+# hot keys do not turn every read into a write. The size is checked every
+# CULL_EVERY writes per process, so the table can briefly exceed MAX_ENTRIES
+# by that many entries per worker.
+#
+# Values are pickled, so whoever can write the file can run code in every
+# worker that reads it: the file must live in a directory only this user can
+# write (created with mode 0700), and a directory or file owned by another
+# user is refused with ImproperlyConfigured.
+#
+# Integers are stored as SQLite integers (everything else is pickled), so
+# incr()/decr() is a single UPDATE and atomic across processes. update()
+# performs any other read-modify-write (rate limit buckets) inside one write
+# transaction.
+
+import contextlib  # Write transactions
+import itertools  # Write counter for periodic culling
+import os  # Fork detection, cache directory
+import pickle  # Non-integer values
+import sqlite3  # Storage
+import threading  # Per-thread connections
+import time  # Expiry and access times
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache  # Django cache API
+from django.core.exceptions import ImproperlyConfigured  # Cache file writable by someone else
+
+# Seconds between two access time updates of the same entry (LRU precision)
+ACCESS_RESOLUTION = 1.0
+
+# Largest and smallest integers SQLite stores natively
+INT_RANGE = range(-2 ** 63, 2 ** 63)
+
+# Keys per statement in get_many()/delete_many()
+BATCH_SIZE = 500
+
+# Marker for "keep the entry's current expiry" in _update()
+KEEP = object()
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed);
+'''
+
+UPSERT = '''
+INSERT INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires, accessed = excluded.accessed
+'''
+
+
+def encode(value):
+    """Column value for `value`: plain integers stay integers, the rest is pickled."""
+    if type(value) is int and value in INT_RANGE:
+        return value
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def decode(data):
+    """Inverse of encode()."""
+    if isinstance(data, int):
+        return data
+    return pickle.loads(data)
+
+
+def check_private(path):
+    """
+    Refuse a cache file that other users could have written.
+
+    The directory is created with mode 0700 if missing. An existing directory
+    must belong to this user and not be writable by group or others; an
+    existing file must belong to this user. (Skipped where the platform has
+    no user ids.)
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not hasattr(os, 'getuid'):
+        return
+    uid = os.getuid()
+    info = os.stat(directory)
+    if info.st_uid != uid or info.st_mode & 0o022:
+        raise ImproperlyConfigured(
+            f'Cache directory {directory} must be owned by uid {uid} and not writable by others'
+        )
+    for name in (path, path + '-wal', path + '-shm'):
+        try:
+            owner = os.stat(name).st_uid
+        except FileNotFoundError:
+            continue
+        if owner != uid:
+            raise ImproperlyConfigured(f'Cache file {name} is owned by uid {owner}, not {uid}')
+
+
+def is_live(expires, now):
+    """True if an entry with expiry `expires` (None = never) is still valid at `now`."""
+    return expires is None or expires > now
+
+
+class SQLiteCache(BaseCache):
+    """
+    Django cache backend sharing one SQLite file between processes.
+
+    LOCATION is the file path. OPTIONS: MAX_ENTRIES, CULL_FREQUENCY (as for
+    Django's other backends), CULL_EVERY (writes between size checks) and
+    BUSY_TIMEOUT (seconds to wait for another writer).
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = location
+        self.cull_every = int(options.get('CULL_EVERY', 100))
+        self.busy_timeout = float(options.get('BUSY_TIMEOUT', 5))
+        self._local = threading.local()
+        self._writes = itertools.count(1)
+
+    # Connections
+
+    def _connection(self):
+        """This thread's connection, opened (and the schema created) on first use."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # Never reuse a connection inherited from the parent process
+            check_private(self.path)
+            connection = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False,
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            local.connection, local.pid = connection, os.getpid()
+        return local.connection
+
+    @contextlib.contextmanager
+    def _transaction(self, connection):
+        """Write transaction that takes the lock up front (no upgrade deadlocks)."""
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    # Reads
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            'SELECT value, expires, accessed FROM cache_entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or not is_live(row[1], now):
+            return default
+        if now - row[2] > ACCESS_RESOLUTION:
+            connection.execute('UPDATE cache_entries SET accessed = ? WHERE key = ?', (now, key))
+        return decode(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_and_validate_key(key, version=version): key for key in keys}
+        connection = self._connection()
+        now = time.time()
+        found, stale = {}, []
+        names = list(keys)
+        for start in range(0, len(names), BATCH_SIZE):
+            batch = names[start:start + BATCH_SIZE]
+            rows = connection.execute(
+                f'SELECT key, value, expires, accessed FROM cache_entries WHERE key IN ({",".join("?" * len(batch))})',
+                batch,
+            )
+            for name, value, expires, accessed in rows:
+                if is_live(expires, now):
+                    found[keys[name]] = decode(value)
+                    if now - accessed > ACCESS_RESOLUTION:
+                        stale.append(name)
+        if stale:
+            connection.executemany('UPDATE cache_entries SET accessed = ? WHERE key = ?', [(now, name) for name in stale])
+        return found
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute('SELECT expires FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        return row is not None and is_live(row[0], time.time())
+
+    # Writes
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        now = time.time()
+        connection.execute(UPSERT, (key, encode(value), self.get_backend_timeout(timeout), now))
+        self._maybe_cull(connection, now)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        connection = self._connection()
+        now = time.time()
+        expires = self.get_backend_timeout(timeout)
+        rows = [(self.make_and_validate_key(key, version=version), encode(value), expires, now) for key, value in data.items()]
+        with self._transaction(connection):
+            connection.executemany(UPSERT, rows)
+        self._maybe_cull(connection, now)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        now = time.time()
+        # Insert, or overwrite only an expired entry; rowcount is 0 when the key is live
+        cursor = connection.execute(
+            UPSERT + ' WHERE cache_entries.expires IS NOT NULL AND cache_entries.expires <= excluded.accessed',
+            (key, encode(value), self.get_backend_timeout(timeout), now),
+        )
+        self._maybe_cull(connection, now)
+        return cursor.rowcount > 0
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        cursor = self._connection().execute(
+            'UPDATE cache_entries SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, now),
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        names = [(self.make_and_validate_key(key, version=version),) for key in keys]
+        if names:
+            self._connection().executemany('DELETE FROM cache_entries WHERE key = ?', names)
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache_entries')
+
+    def incr(self, key, delta=1, version=None):
+        """
+        Atomically add `delta` to an integer entry (one UPDATE statement).
+
+        Raises:
+            ValueError: if the key is missing or expired (like Django's backends)
+        """
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        row = self._connection().execute(
+            "UPDATE cache_entries SET value = value + ?, accessed = ? "
+            "WHERE key = ? AND typeof(value) = 'integer' AND (expires IS NULL OR expires > ?) RETURNING value",
+            (delta, now, key, now),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        def add(current):
+            if current is None:
+                raise ValueError(f"Key '{key}' not found.")
+            return current + delta
+
+        # Pickled numbers (floats, huge integers) take the transactional path
+        return self._update(key, add)
+
+    def update(self, key, func, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Atomically replace the value of `key` with func(current value).
+
+        `func` receives None when the key is missing or expired. Other
+        processes cannot write the cache until it returns, so keep it short.
+
+        Returns:
+            The value stored
+        """
+        key = self.make_and_validate_key(key, version=version)
+        return self._update(key, func, self.get_backend_timeout(timeout))
+
+    def _update(self, key, func, expires=KEEP):
+        connection = self._connection()
+        now = time.time()
+        with self._transaction(connection):
+            row = connection.execute('SELECT value, expires FROM cache_entries WHERE key = ?', (key,)).fetchone()
+            live = row is not None and is_live(row[1], now)
+            value = func(decode(row[0]) if live else None)
+            if expires is KEEP:
+                expires = row[1] if live else self.get_backend_timeout()
+            connection.execute(UPSERT, (key, encode(value), expires, now))
+        self._maybe_cull(connection, now)
+        return value
+
+    # Eviction
+
+    def _maybe_cull(self, connection, now):
+        if next(self._writes) % self.cull_every == 0:
+            self.cull(connection, now)
+
+    def cull(self, connection=None, now=None):
+        """
+        Delete expired entries, then least recently used ones while over MAX_ENTRIES.
+
+        Returns:
+            Number of entries deleted
+        """
+        connection = connection or self._connection()
+        now = time.time() if now is None else now
+        with self._transaction(connection):
+            deleted = connection.execute('DELETE FROM cache_entries WHERE expires <= ?', (now,)).rowcount
+            count = connection.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+            if count > self._max_entries:
+                if self._cull_frequency == 0:
+                    excess = count
+                else:
+                    excess = count - self._max_entries + self._max_entries // self._cull_frequency
+                deleted += connection.execute(
+                    'DELETE FROM cache_entries WHERE key IN '
+                    '(SELECT key FROM cache_entries ORDER BY accessed LIMIT ?)',
+                    (excess,),
+                ).rowcount
+        return deleted
@@ -0,0 +1,716 @@
+// Client logic for the WhatsApp-style chat interface (chat/whatsapp.html)
+// Served as a hashed static asset so browsers can cache it long term.
+
+let currentChatId = null;
+
+// Page configuration rendered by the template as data attributes on <body>
+const currentUser = document.body.dataset.currentUser;
+const csrfToken = document.body.dataset.csrfToken;
+
+// Show/Hide Modals
+function showNewChatModal() {
+    document.getElementById('newChatModal').style.display = 'flex';
+}
+
+function hideNewChatModal() {
+    document.getElementById('newChatModal').style.display = 'none';
+    document.getElementById('newChatForm').reset();
+}
+
+// Login Modal Functions
+function showLoginModal() {
+    document.getElementById('loginModal').style.display = 'flex';
+    document.getElementById('loginError').style.display = 'none';
+}
+
+function hideLoginModal() {
+    document.getElementById('loginModal').style.display = 'none';
+    document.getElementById('loginForm').reset();
+}
+
+// Signup Modal Functions
+function showSignupModal() {
+    document.getElementById('signupModal').style.display = 'flex';
+    document.getElementById('signupError').style.display = 'none';
+    document.getElementById('signupSuccess').style.display = 'none';
+}
+
+function hideSignupModal() {
+    document.getElementById('signupModal').style.display = 'none';
+    document.getElementById('signupForm').reset();
+}
+
+// Select Chat
+function selectChat(chatId, chatName, lastMessage) {
+    currentChatId = chatId;
+
+    // Update active chat in sidebar
+    document.querySelectorAll('.chat-item').forEach(item => {
+        item.classList.remove('active');
+    });
+    event.currentTarget.classList.add('active');
+
+    // Show chat area
+    document.getElementById('welcomeScreen').style.display = 'none';
+    document.getElementById('chatArea').style.display = 'flex';
+
+    // Update header
+    document.getElementById('currentChatName').textContent = chatName;
+    document.getElementById('currentChatStatus').textContent = 'Online';
+
+    // Load messages
+    loadMessages();
+}
+
+// Select Chat by Element (new method using data attributes)
+function selectChatById(element) {
+    const chatId = element.getAttribute('data-room-id');
+    const chatName = element.getAttribute('data-room-name');
+    const lastMessage = element.getAttribute('data-last-message');
+
+    currentChatId = chatId;
+
+    // Update active chat in sidebar
+    document.querySelectorAll('.chat-item').forEach(item => {
+        item.classList.remove('active');
+    });
+    element.classList.add('active');
+
+    // Show chat area
+    document.getElementById('welcomeScreen').style.display = 'none';
+    document.getElementById('chatArea').style.display = 'flex';
+
+    // Update header
+    document.getElementById('currentChatName').textContent = chatName;
+    document.getElementById('currentChatStatus').textContent = 'Online';
+
+    // Load messages
+    loadMessages();
+}
+
+// Compact message schema
+// Message endpoints are requested with ?compact=1: short keys, epoch-ms
+// timestamps and no null fields. Expand back to the full shape here.
+function expandMessage(m) {
+    return {id: m.i, username: m.u, content: m.c, html: m.h, timestamp: m.t, user_id: m.s ?? null, attachment: m.a ?? null};
+}
+
+// Change feed entries (room/<id>/changes/) add q=seq, e=edited, d=deleted
+function expandChange(m) {
+    return {...expandMessage(m), seq: m.q, edited: Boolean(m.e), deleted: Boolean(m.d)};
+}
+
+// Message Window
+// The open room keeps at most MAX_RENDERED message nodes in the DOM. History
+// is fetched a page at a time: older pages when scrolling up, newer ones when
+// scrolling back down (nodes at the far end are dropped and refetched when
+// needed). While the newest message is in the window, the room is kept current
+// with the change feed: new messages are appended and edits/deletions patch
+// their nodes, so a poll never re-renders what is already on screen.
+const MESSAGE_PAGE_SIZE = 50;
+const MAX_RENDERED = 200;
+const ROOM_POLL_MS = 3000;
+const SCROLL_MARGIN_PX = 200;
+
+let roomView = null;  // {id, seq, hasOlder, hasNewer, loading, nodes: Map of message id -> element}
+
+function fetchMessagePage(view, params) {
+    const query = new URLSearchParams({compact: 1, limit: MESSAGE_PAGE_SIZE, ...params});
+    return fetch(`/chat/room/${view.id}/messages/?${query}`).then(response => response.json());
+}
+
+function renderedIds(view) {
+    return [...view.nodes.keys()];
+}
+
+function isScrolledToEnd(container) {
+    return container.scrollHeight - container.scrollTop - container.clientHeight < SCROLL_MARGIN_PX;
+}
+
+// Load Messages (newest page of the selected room)
+function loadMessages() {
+    if (!currentChatId) return;
+
+    const view = roomView = {id: currentChatId, seq: 0, hasOlder: false, hasNewer: false, loading: true, nodes: new Map()};
+    fetchMessagePage(view, {})
+        .then(data => {
+            if (roomView !== view) return;  // Another room was opened meanwhile
+            const container = document.getElementById('messagesContainer');
+            container.replaceChildren();
+
+            const messages = data.messages.map(expandMessage);
+            messages.forEach(msg => addMessageToUI(msg));
+
+            container.scrollTop = container.scrollHeight;
+            view.seq = data.seq;
+            view.hasOlder = data.more;
+            if (messages.length) {
+                markRoomSeen(view.id, messages[messages.length - 1].id);
+            }
+            showRoomEvents(data.events || []);
+        })
+        .catch(error => console.error('Error loading messages:', error))
+        .finally(() => { view.loading = false; });
+}
+
+// Older history, prepended without moving what the user is looking at
+function loadOlderMessages() {
+    const view = roomView;
+    if (!view || view.loading || !view.hasOlder || !view.nodes.size) return;
+
+    view.loading = true;
+    fetchMessagePage(view, {before: renderedIds(view)[0]})
+        .then(data => {
+            if (roomView !== view) return;
+            const container = document.getElementById('messagesContainer');
+            const previousHeight = container.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            const older = new Map();
+            data.messages.map(expandMessage).forEach(msg => {
+                const node = renderMessage(msg);
+                older.set(msg.id, node);
+                fragment.appendChild(node);
+            });
+            container.prepend(fragment);
+            view.nodes = new Map([...older, ...view.nodes]);
+            container.scrollTop += container.scrollHeight - previousHeight;
+            view.hasOlder = data.more;
+            trimMessages(view, 'end');
+        })
+        .catch(error => console.error('Error loading older messages:', error))
+        .finally(() => { view.loading = false; });
+}
+
+// Newer history after scrolling back down past dropped nodes
+function loadNewerMessages() {
+    const view = roomView;
+    if (!view || view.loading || !view.hasNewer || !view.nodes.size) return;
+
+    view.loading = true;
+    fetchMessagePage(view, {after: renderedIds(view).pop()})
+        .then(data => {
+            if (roomView !== view) return;
+            data.messages.map(expandMessage).forEach(msg => addMessageToUI(msg));
+            view.hasNewer = data.more;
+            trimMessages(view, 'start');
+        })
+        .catch(error => console.error('Error loading newer messages:', error))
+        .finally(() => { view.loading = false; });
+}
+
+// Drop nodes beyond MAX_RENDERED from one end of the window
+function trimMessages(view, end) {
+    const container = document.getElementById('messagesContainer');
+    const ids = renderedIds(view);
+    const excess = ids.length - MAX_RENDERED;
+    if (excess <= 0) return;
+
+    const dropped = end === 'start' ? ids.slice(0, excess) : ids.slice(-excess);
+    const previousHeight = container.scrollHeight;
+    dropped.forEach(id => {
+        view.nodes.get(id).remove();
+        view.nodes.delete(id);
+    });
+    if (end === 'start') {
+        container.scrollTop -= previousHeight - container.scrollHeight;
+        view.hasOlder = true;
+    } else {
+        view.hasNewer = true;
+    }
+}
+
+// Poll the change feed of the open room and patch the window
+function pollRoom(scrollToEnd = false) {
+    const view = roomView;
+    if (!view || view.loading) return;
+
+    view.loading = true;
+    fetch(`/chat/room/${view.id}/changes/?compact=1&since=${view.seq}`)
+        .then(response => response.json())
+        .then(data => {
+            if (roomView !== view) return;
+            const container = document.getElementById('messagesContainer');
+            const follow = scrollToEnd || isScrolledToEnd(container);
+            const newestId = renderedIds(view).pop() || 0;
+            let appended = 0;
+
+            data.changes.map(expandChange).forEach(change => {
+                const node = view.nodes.get(change.id);
+                if (change.deleted) {
+                    if (node) node.remove();
+                    view.nodes.delete(change.id);
+                } else if (node) {
+                    const edited = renderMessage(change);
+                    node.replaceWith(edited);
+                    view.nodes.set(change.id, edited);
+                } else if (!view.hasNewer && change.id > newestId) {
+                    addMessageToUI(change);
+                    appended = change.id;
+                }
+            });
+
+            view.seq = data.seq;
+            if (follow) {
+                trimMessages(view, 'start');
+                container.scrollTop = container.scrollHeight;
+            }
+            if (appended) {
+                markRoomSeen(view.id, appended);
+            }
+            showRoomEvents(data.events || []);
+            if (data.more) {
+                setTimeout(() => pollRoom(follow), 0);
+            }
+        })
+        .catch(error => console.error('Error polling room:', error))
+        .finally(() => { view.loading = false; });
+}
+
+document.getElementById('messagesContainer').addEventListener('scroll', event => {
+    const container = event.currentTarget;
+    if (container.scrollTop < SCROLL_MARGIN_PX) {
+        loadOlderMessages();
+    } else if (isScrolledToEnd(container)) {
+        loadNewerMessages();
+    }
+});
+
+// Build the element for one message
+// Names and text are user input: the sender goes in as text, and the content
+// as the HTML the server escaped and formatted when the message was saved
+// (message.html). Nothing else is ever parsed as HTML.
+function renderMessage(message) {
+    const messageDiv = document.createElement('div');
+    const isOwn = message.username === currentUser;
+
+    messageDiv.className = `message ${isOwn ? 'own' : ''}`;
+    messageDiv.dataset.messageId = message.id;
+
+    const bubble = document.createElement('div');
+    bubble.className = 'message-bubble';
+    if (!isOwn) {
+        const sender = document.createElement('div');
+        sender.className = 'message-sender';
+        sender.textContent = message.username;
+        bubble.appendChild(sender);
+    }
+    const content = document.createElement('div');
+    content.className = 'message-content';
+    if (message.html != null) {
+        content.innerHTML = message.html;
+    } else {
+        content.textContent = message.content || '';
+    }
+    const time = document.createElement('div');
+    time.className = 'message-time';
+    time.textContent = new Date(message.timestamp).toLocaleTimeString([], {hour: '2-digit', minute: '2-digit'});
+    bubble.append(content, time);
+    messageDiv.appendChild(bubble);
+
+    if (message.attachment) {
+        // Built with DOM APIs: file names are user input
+        const link = document.createElement('a');
+        link.className = 'message-attachment';
+        link.href = message.attachment.url;
+        link.target = '_blank';
+        link.rel = 'noopener';
+        if (message.attachment.thumbnail_url) {
+            const image = document.createElement('img');
+            image.src = message.attachment.thumbnail_url;
+            image.alt = message.attachment.name;
+            image.loading = 'lazy';
+            link.appendChild(image);
+        } else {
+            link.textContent = `📎 ${message.attachment.name} (${Math.ceil(message.attachment.size / 1024)} KB)`;
+        }
+        content.appendChild(link);
+    }
+
+    return messageDiv;
+}
+
+// Add Message to UI (end of the window)
+function addMessageToUI(message) {
+    const node = renderMessage(message);
+    document.getElementById('messagesContainer').appendChild(node);
+    if (roomView) roomView.nodes.set(message.id, node);
+    return node;
+}
+
+// Show the newest messages: poll when they are in the window, reload otherwise
+function showLatestMessages() {
+    if (roomView && roomView.id === currentChatId && !roomView.hasNewer) {
+        pollRoom(true);
+    } else {
+        loadMessages();
+    }
+}
+
+// Send Message
+function sendMessage() {
+    const input = document.getElementById('messageInput');
+    const message = input.value.trim();
+
+    if (!message || !currentChatId) return;
+
+    const formData = new FormData();
+    formData.append('message', message);
+    formData.append('chat_room_id', currentChatId);
+    formData.append('csrfmiddlewaretoken', csrfToken);
+
+    fetch('/chat/send/', {
+        method: 'POST',
+        body: formData
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            input.value = '';
+            lastTypingSent = 0;
+            showLatestMessages();
+            updateChatList();
+        }
+    })
+    .catch(error => console.error('Error sending message:', error));
+}
+
+// File Attachments
+// Files are sent in chunks (size suggested by the server) so a dropped
+// connection only costs the chunk in flight: on failure the server is asked
+// for its offset and the upload continues from there.
+const UPLOAD_RETRIES = 5;
+
+async function uploadFile(file) {
+    const headers = {'X-CSRFToken': csrfToken};
+    const start = await fetch('/chat/uploads/', {
+        method: 'POST',
+        headers: {...headers, 'Content-Type': 'application/json'},
+        body: JSON.stringify({filename: file.name, size: file.size, content_type: file.type})
+    }).then(response => response.json());
+    if (!start.success) throw new Error(start.error);
+
+    const url = `/chat/uploads/${start.upload_id}/`;
+    let offset = start.offset;
+    let retries = 0;
+    let result = null;
+    while (offset < file.size) {
+        try {
+            const response = await fetch(url, {
+                method: 'PUT',
+                headers: {...headers, 'X-Upload-Offset': String(offset)},
+                body: file.slice(offset, offset + start.chunk_size)
+            });
+            result = await response.json();
+            if (!response.ok && response.status !== 409) throw new Error(result.error);
+            offset = result.offset;
+        } catch (error) {
+            if (++retries > UPLOAD_RETRIES) throw error;
+            result = await fetch(url).then(response => response.json());
+            offset = result.offset;
+        }
+    }
+    return result.attachment_id;
+}
+
+function sendAttachment(input) {
+    const file = input.files[0];
+    input.value = '';
+    if (!file || !currentChatId) return;
+
+    uploadFile(file)
+        .then(attachmentId => {
+            const formData = new FormData();
+            formData.append('attachment_id', attachmentId);
+            formData.append('chat_room_id', currentChatId);
+            formData.append('csrfmiddlewaretoken', csrfToken);
+            return fetch('/chat/send/', {method: 'POST', body: formData});
+        })
+        .then(() => {
+            showLatestMessages();
+            updateChatList();
+        })
+        .catch(error => console.error('Error sending attachment:', error));
+}
+
+// Typing Indicators
+// Events are ephemeral (kept for a few seconds in the shared cache every
+// worker reads, never in the database) and throttled here
+// so a fast typist sends at most one request per TYPING_THROTTLE_MS
+const TYPING_THROTTLE_MS = 2000;
+let lastTypingSent = 0;
+
+function notifyTyping() {
+    const now = Date.now();
+    if (!currentChatId || now - lastTypingSent < TYPING_THROTTLE_MS) return;
+    lastTypingSent = now;
+
+    const formData = new FormData();
+    formData.append('event', 'typing');
+    formData.append('csrfmiddlewaretoken', csrfToken);
+    fetch(`/chat/room/${currentChatId}/typing/`, {
+        method: 'POST',
+        body: formData
+    }).catch(error => console.error('Error sending typing event:', error));
+}
+
+function showRoomEvents(roomEvents) {
+    const typing = roomEvents.filter(e => e.kind === 'typing').map(e => e.username);
+    const status = document.getElementById('currentChatStatus');
+    if (typing.length === 1) {
+        status.textContent = `${typing[0]} is typing...`;
+    } else if (typing.length > 1) {
+        status.textContent = `${typing.length} people are typing...`;
+    } else {
+        status.textContent = 'Online';
+    }
+}
+
+document.getElementById('messageInput').addEventListener('input', notifyTyping);
+
+// Handle Enter Key
+function handleKeyPress(event) {
+    if (event.key === 'Enter' && !event.shiftKey) {
+        event.preventDefault();
+        sendMessage();
+    }
+}
+
+// Create New Chat
+document.getElementById('newChatForm').addEventListener('submit', function(e) {
+    e.preventDefault();
+
+    const formData = new FormData();
+    formData.append('name', document.getElementById('chatName').value);
+    formData.append('description', document.getElementById('chatDescription').value);
+    formData.append('is_group', document.getElementById('isGroup').checked);
+    formData.append('csrfmiddlewaretoken', csrfToken);
+
+    fetch('/chat/create-room/', {
+        method: 'POST',
+        body: formData
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            hideNewChatModal();
+            location.reload(); // Refresh to show new chat
+        }
+    })
+    .catch(error => console.error('Error creating chat:', error));
+});
+
+// Login Form Handler
+document.getElementById('loginForm').addEventListener('submit', function(e) {
+    e.preventDefault();
+
+    const formData = new FormData();
+    formData.append('username', document.getElementById('loginUsername').value);
+    formData.append('password', document.getElementById('loginPassword').value);
+    formData.append('csrfmiddlewaretoken', csrfToken);
+
+    fetch('/login/', {
+        method: 'POST',
+        body: formData,
+        headers: {
+            'X-Requested-With': 'XMLHttpRequest'
+        }
+    })
+    .then(response => {
+        if (response.ok) {
+            // Login successful - reload page to show authenticated state
+            location.reload();
+        } else {
+            return response.text().then(text => {
+                throw new Error('Login failed');
+            });
+        }
+    })
+    .catch(error => {
+        const errorDiv = document.getElementById('loginError');
+        errorDiv.textContent = 'Invalid username or password. Please try again.';
+        errorDiv.style.display = 'block';
+    });
+});
+
+// Signup Form Handler
+document.getElementById('signupForm').addEventListener('submit', function(e) {
+    e.preventDefault();
+
+    const password1 = document.getElementById('signupPassword1').value;
+    const password2 = document.getElementById('signupPassword2').value;
+
+    // Check if passwords match
+    if (password1 !== password2) {
+        const errorDiv = document.getElementById('signupError');
+        errorDiv.textContent = 'Passwords do not match.';
+        errorDiv.style.display = 'block';
+        return;
+    }
+
+    const formData = new FormData();
+    formData.append('username', document.getElementById('signupUsername').value);
+    formData.append('password1', password1);
+    formData.append('password2', password2);
+    formData.append('csrfmiddlewaretoken', csrfToken);
+
+    fetch('/signup/', {
+        method: 'POST',
+        body: formData,
+        headers: {
+            'X-Requested-With': 'XMLHttpRequest'
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            const successDiv = document.getElementById('signupSuccess');
+            successDiv.textContent = 'Account created successfully! Logging you in...';
+            successDiv.style.display = 'block';
+
+            // Auto-login after successful signup
+            setTimeout(() => {
+                location.reload();
+            }, 1500);
+        } else {
+            const errorDiv = document.getElementById('signupError');
+            let errorMsg = 'Registration failed. ';
+            if (data.errors) {
+                const errorList = [];
+                for (const [field, errors] of Object.entries(data.errors)) {
+                    errorList.push(...errors);
+                }
+                errorMsg += errorList.join(' ');
+            }
+            errorDiv.textContent = errorMsg;
+            errorDiv.style.display = 'block';
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        const errorDiv = document.getElementById('signupError');
+        errorDiv.textContent = 'An error occurred. Please try again.';
+        errorDiv.style.display = 'block';
+    });
+});
+
+// Update Chat List
+// One /chat/sync/ request refreshes previews and unread badges for every
+// room in the sidebar, instead of polling each room separately. The sidebar
+// only shows the last message and unread count, so messages=0 leaves out the
+// new messages themselves
+const SYNC_INTERVAL_MS = 10000;
+const lastSeenIds = {};
+
+document.querySelectorAll('.chat-item').forEach(item => {
+    lastSeenIds[item.getAttribute('data-room-id')] = Number(item.getAttribute('data-last-message-id') || 0);
+});
+
+function markRoomSeen(roomId, messageId) {
+    lastSeenIds[roomId] = Math.max(lastSeenIds[roomId] || 0, messageId);
+    setUnreadBadge(document.querySelector(`.chat-item[data-room-id="${roomId}"]`), 0);
+}
+
+function setUnreadBadge(item, count) {
+    if (!item) return;
+    let badge = item.querySelector('.unread-count');
+    if (!count) {
+        if (badge) badge.remove();
+        return;
+    }
+    if (!badge) {
+        badge = document.createElement('div');
+        badge.className = 'unread-count';
+        item.querySelector('.chat-meta').appendChild(badge);
+    }
+    badge.textContent = count;
+}
+
+function updateChatList() {
+    if (!Object.keys(lastSeenIds).length) return;
+
+    fetch('/chat/sync/?compact=1&messages=0', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken},
+        body: JSON.stringify({rooms: lastSeenIds})
+    })
+    .then(response => response.json())
+    .then(data => {
+        for (const [roomId, room] of Object.entries(data.rooms || {})) {
+            const item = document.querySelector(`.chat-item[data-room-id="${roomId}"]`);
+            if (!item || !room.last_message) continue;
+            const lastMessage = expandMessage(room.last_message);
+            item.querySelector('.chat-last-message').textContent = lastMessage.content;
+            item.querySelector('.chat-time').textContent = new Date(lastMessage.timestamp)
+                .toLocaleTimeString([], {hour: '2-digit', minute: '2-digit'});
+            setUnreadBadge(item, roomId === String(currentChatId) ? 0 : (room.unread || 0));
+        }
+    })
+    .catch(error => console.error('Error syncing chats:', error));
+}
+
+setInterval(() => {
+    if (!document.hidden) updateChatList();
+}, SYNC_INTERVAL_MS);
+
+// Online Indicators
+// The sidebar markup is cached per user, so live online counts are injected
+// from the small JSON blob rendered next to it
+function applyOnlineCounts() {
+    const source = document.getElementById('online-counts');
+    if (!source) return;
+    const counts = JSON.parse(source.textContent);
+    document.querySelectorAll('.chat-item').forEach(item => {
+        const indicator = item.querySelector('.chat-online');
+        const count = counts[item.getAttribute('data-room-id')];
+        if (!indicator) return;
+        indicator.textContent = count ? `● ${count}` : '';
+        indicator.hidden = !count;
+    });
+}
+
+applyOnlineCounts();
+
+// Auto-refresh the open room (change feed only; hidden tabs do not poll)
+setInterval(() => {
+    if (currentChatId && !document.hidden) {
+        pollRoom();
+    }
+}, ROOM_POLL_MS);
+
+// Page Visibility: polling pauses while the tab is hidden and catches up
+// with one request per endpoint as soon as it is visible again
+document.addEventListener('visibilitychange', () => {
+    if (document.hidden) return;
+    pollRoom();
+    updateChatList();
+});
+
+// Click outside modal to close
+window.onclick = function(event) {
+    const newChatModal = document.getElementById('newChatModal');
+    const loginModal = document.getElementById('loginModal');
+    const signupModal = document.getElementById('signupModal');
+
+    if (event.target === newChatModal) {
+        hideNewChatModal();
+    } else if (event.target === loginModal) {
+        hideLoginModal();
+    } else if (event.target === signupModal) {
+        hideSignupModal();
+    }
+}
+
+// Logout Confirmation
+function confirmLogout() {
+    if (confirm('Are you sure you want to logout from Nisha? 👋')) {
+        // Show logout animation
+        const logoutBtn = document.querySelector('.logout-btn');
+        logoutBtn.innerHTML = '⏳';
+        logoutBtn.style.background = '#ffa726';
+
+        // Redirect to logout after short delay
+        setTimeout(() => {
+            window.location.href = '/logout/';
+        }, 500);
+    }
+}
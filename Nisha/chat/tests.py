@@ -1,12 +1,49 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth.models import User
 from django.urls import reverse
-from .models import Message, ChatRoom, UserProfile
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from .models import Message, ChatRoom, UserProfile, ChatEvent, ConsumerCheckpoint, Attachment, Upload, RoomActivity, UserActivity
+from .middleware import brotli
+from . import cache as chat_cache
+from . import presence
+from . import events
+from . import ratelimit
+from . import hashing
+from . import eventlog
+from . import sharding
+from . import profiling
+from . import changes
+from . import rooms
+from . import attachments
+from . import rollups
+from . import memory
+from . import rendering
+from .sqlite_cache import SQLiteCache
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+import gzip
 import json
+import os
+import signal
+import time
+import tracemalloc
+from io import StringIO
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock, skipUnless
 
 # Create your tests here.
 
 class ChatModelTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
     def setUp(self):
         self.user = User.objects.create_user(
             username='testuser',
@@ -24,7 +61,7 @@ class ChatModelTests(TestCase):
         self.assertEqual(self.room.name, 'Test Room')
         self.assertEqual(self.room.created_by, self.user)
         self.assertTrue(self.room.is_group)
-        self.assertIn(self.user, self.room.members.all())
+        self.assertTrue(self.room.members.filter(id=self.user.id).exists())
 
     def test_message_creation(self):
         message = Message.objects.create(
@@ -43,6 +80,8 @@ class ChatModelTests(TestCase):
         self.assertEqual(self.profile.status, 'Available')
 
 class ChatViewTests(TestCase):
+    databases = '__all__'  # The legacy chat page reads messages from CHAT_SHARD_COUNT shards
+
     def setUp(self):
         self.client = Client()
         self.user = User.objects.create_user(
@@ -74,3 +113,1329 @@ class ChatViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         # Check if user was created
         self.assertTrue(User.objects.filter(username='newuser').exists())
+
+
+class RoomCacheTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='member', password='testpass123')
+        self.other = User.objects.create_user(username='outsider', password='testpass123')
+        self.room = ChatRoom.objects.create(name='Cached Room', created_by=self.user)
+        self.room.members.add(self.user)
+        self.url = reverse('chat:get_room_messages', args=[self.room.id])
+
+    def test_repeat_poll_skips_room_and_membership_queries(self):
+        self.client.login(username='member', password='testpass123')
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries.captured_queries if 'chat_chatroom' in q['sql']])
+
+    def test_non_member_is_forbidden(self):
+        self.client.login(username='outsider', password='testpass123')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(reverse('chat:send_message'), {'message': 'hi', 'chat_room_id': self.room.id})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Message.objects.exists())
+
+    def test_membership_change_invalidates_cache(self):
+        self.client.login(username='outsider', password='testpass123')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.room.members.add(self.other)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.room.members.remove(self.other)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_membership_recached_before_commit_is_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.room.members.add(self.other)
+                # A concurrent poll reads the old rows before the commit and caches them
+                cache.set(chat_cache.membership_key(self.other.id), frozenset(), 300)
+                cache.set(chat_cache.room_members_key(self.room.id), frozenset({self.user.id}), 300)
+                chat_cache.local_cache.clear()
+        self.assertTrue(chat_cache.is_member(self.other, self.room.id))
+        self.assertIn(self.other.id, chat_cache.get_room_member_ids(self.room.id))
+
+    def test_join_does_not_trust_a_stale_membership_cache(self):
+        # The cache still lists the room although the membership row is gone
+        cache.set(chat_cache.membership_key(self.other.id), frozenset({self.room.id}), 300)
+        self.client.login(username='outsider', password='testpass123')
+        self.assertTrue(self.client.post(reverse('chat:join_chat_room', args=[self.room.id])).json()['success'])
+        self.assertTrue(self.room.members.filter(pk=self.other.pk).exists())
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.member_count, 2)
+        # Joining again changes nothing
+        self.client.post(reverse('chat:join_chat_room', args=[self.room.id]))
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.member_count, 2)
+
+    def test_room_deletion_invalidates_cache(self):
+        self.client.login(username='member', password='testpass123')
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.room.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(chat_cache.get_user_room_ids(self.user.id), frozenset())
+
+
+class PresenceTests(TestCase):
+    databases = '__all__'  # The sidebar reads last messages from CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        presence.tracker.reset()
+        self.user = User.objects.create_user(username='alice', password='testpass123')
+        self.other = User.objects.create_user(username='bob', password='testpass123')
+        UserProfile.objects.create(user=self.user)
+
+    def test_heartbeat_does_not_write_until_flush(self):
+        tracker = presence.PresenceTracker(ttl=30, flush_interval=3600)
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                tracker.heartbeat(self.user.id)
+        self.assertTrue(tracker.is_online(self.user.id))
+        self.assertFalse(UserProfile.objects.get(user=self.user).is_online)
+
+    def test_flush_writes_last_seen_in_bulk(self):
+        tracker = presence.PresenceTracker(ttl=30, flush_interval=3600)
+        now = time.time()
+        tracker.heartbeat(self.user.id, now=now)
+        tracker.heartbeat(self.other.id, now=now)
+        tracker.flush(now)
+        profiles = UserProfile.objects.filter(user__in=[self.user, self.other])
+        self.assertEqual(profiles.count(), 2)
+        self.assertTrue(all(p.is_online for p in profiles))
+        # Once last_seen is older than TTL + flush interval, the next flush marks both users offline
+        tracker.flush(now + 31)
+        self.assertEqual(UserProfile.objects.filter(is_online=True).count(), 2)
+        tracker.flush(now + 3631)
+        self.assertFalse(UserProfile.objects.filter(is_online=True).exists())
+
+    def test_other_workers_do_not_mark_users_offline(self):
+        busy, idle = presence.PresenceTracker(ttl=30, flush_interval=60), presence.PresenceTracker(ttl=30, flush_interval=60)
+        now = time.time()
+        busy.heartbeat(self.user.id, now=now)
+        busy.flush(now)
+        idle.heartbeat(self.other.id, now=now + 40)  # Never saw alice's heartbeats
+        idle.flush(now + 40)
+        self.assertTrue(UserProfile.objects.get(user=self.user).is_online)
+        # Stale for every worker: any flush marks her offline
+        idle.flush(now + 95)
+        self.assertFalse(UserProfile.objects.get(user=self.user).is_online)
+
+    def test_get_users_reports_online_from_memory(self):
+        presence.tracker.heartbeat(self.other.id)
+        self.client.login(username='alice', password='testpass123')
+        response = self.client.get(reverse('chat:get_users'))
+        users = {u['username']: u for u in response.json()['users']}
+        self.assertTrue(users['bob']['is_online'])
+        self.assertFalse(UserProfile.objects.filter(user=self.other).exists())
+
+    def test_views_see_users_online_on_other_workers(self):
+        # bob's heartbeats went to another worker, which flushed them; this worker never saw him
+        other_worker = presence.PresenceTracker(ttl=30, flush_interval=60)
+        other_worker.heartbeat(self.other.id)
+        other_worker.flush()
+        room = ChatRoom.objects.create(name='Pair', created_by=self.user)
+        room.members.add(self.user, self.other)
+        self.client.login(username='alice', password='testpass123')
+
+        self.assertEqual(self.client.get(reverse('chat:get_presence')).json()['online_user_ids'], [self.user.id, self.other.id])
+        members = self.client.get(reverse('chat:room_members', args=[room.id])).json()['members']
+        self.assertEqual({m['username']: m['is_online'] for m in members}, {'alice': True, 'bob': True})
+        self.assertEqual(self.client.get(reverse('chat:whatsapp')).context['online_counts'], {room.id: 1})
+
+        # Once bob's last_seen is stale for every worker he is offline everywhere
+        UserProfile.objects.filter(user=self.other).update(last_seen=presence.tracker.stale_before(time.time() - 1))
+        self.assertEqual(self.client.get(reverse('chat:get_presence')).json()['online_user_ids'], [self.user.id])
+
+
+class RoomEventTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()  # Also drops the shared typing events
+        self.user = User.objects.create_user(username='typist', password='testpass123')
+        self.reader = User.objects.create_user(username='reader', password='testpass123')
+        self.room = ChatRoom.objects.create(name='Group', created_by=self.user, is_group=True)
+        self.room.members.add(self.user, self.reader)
+
+    def test_bursts_are_coalesced(self):
+        channel = events.EphemeralChannel(ttl=5, min_interval=0.5)
+        broadcasts = [channel.publish(1, 7, 'typist', 'typing', now=i * 0.05) for i in range(20)]
+        # 20 keystrokes within one second produce two broadcasts
+        self.assertEqual(len([b for b in broadcasts if b is not None]), 2)
+        self.assertEqual(len(channel.poll(1, now=1.0)), 1)
+        self.assertEqual(channel.poll(1, now=10.0), [])
+
+    def test_stopped_clears_typing(self):
+        channel = events.EphemeralChannel(ttl=5, min_interval=0.5)
+        channel.publish(1, 7, 'typist', 'typing', now=0)
+        channel.publish(1, 7, 'typist', 'stopped', now=1)
+        self.assertEqual(channel.poll(1, now=1.1), [])
+
+    def test_workers_sharing_a_cache_see_each_others_events(self):
+        shared = LocMemCache('room-events', {})
+        publisher = events.EphemeralChannel(ttl=5, min_interval=0.5, backend=shared)
+        reader = events.EphemeralChannel(ttl=5, min_interval=0.5, backend=shared)
+        self.assertIsNotNone(publisher.publish(1, 7, 'typist', 'typing', now=100))
+        self.assertEqual([e['username'] for e in reader.poll(1, now=101)], ['typist'])
+        # Coalescing state is shared too: a burst on the other worker is not re-broadcast
+        self.assertIsNone(reader.publish(1, 7, 'typist', 'typing', now=100.2))
+        reader.publish(1, 7, 'typist', 'stopped', now=102)
+        self.assertEqual(publisher.poll(1, now=102.1), [])
+
+    def test_typing_is_delivered_with_poll_without_db_writes(self):
+        self.client.login(username='typist', password='testpass123')
+        self.client.get(reverse('chat:get_room_messages', args=[self.room.id]))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('chat:room_event', args=[self.room.id]), {'event': 'typing'})
+        self.assertTrue(response.json()['broadcast'])
+        self.assertFalse([q for q in queries.captured_queries if not q['sql'].startswith('SELECT')])
+
+        self.client.login(username='reader', password='testpass123')
+        data = self.client.get(reverse('chat:get_room_messages', args=[self.room.id])).json()
+        self.assertEqual([e['username'] for e in data['events']], ['typist'])
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.user = User.objects.create_user(username='spammer', password='testpass123')
+        self.room = ChatRoom.objects.create(name='Busy', created_by=self.user)
+        self.room.members.add(self.user)
+
+    def test_token_bucket_refills(self):
+        backend = ratelimit.LocalBackend()
+        limit = ratelimit.parse_limit({'rate': '1/s', 'burst': 2})
+        self.assertTrue(backend.consume('k', limit, now=0)[0])
+        self.assertTrue(backend.consume('k', limit, now=0)[0])
+        allowed, retry_after = backend.consume('k', limit, now=0.5)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 0.5)
+        self.assertTrue(backend.consume('k', limit, now=1.0)[0])
+
+    def test_forwarded_for_is_only_trusted_behind_configured_proxies(self):
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='6.6.6.6, 10.0.0.1', REMOTE_ADDR='10.0.0.2')
+        request.user = AnonymousUser()
+        # A client can send any X-Forwarded-For; without trusted proxies it is ignored
+        self.assertEqual(ratelimit.client_key(request), 'ip10.0.0.2')
+        with mock.patch.object(ratelimit, 'TRUSTED_PROXIES', 1):
+            self.assertEqual(ratelimit.client_key(request), 'ip10.0.0.1')
+        with mock.patch.object(ratelimit, 'TRUSTED_PROXIES', 3):
+            self.assertEqual(ratelimit.client_key(request), 'ip10.0.0.2')
+
+    def test_send_message_returns_429_with_retry_after(self):
+        self.client.login(username='spammer', password='testpass123')
+        url = reverse('chat:send_message')
+        statuses = [
+            self.client.post(url, {'message': f'msg {i}', 'chat_room_id': self.room.id}).status_code
+            for i in range(15)
+        ]
+        self.assertIn(429, statuses)
+        response = self.client.post(url, {'message': 'again', 'chat_room_id': self.room.id})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertLess(Message.objects.count(), 15)
+
+    def test_refused_requests_give_back_earlier_tokens(self):
+        request = RequestFactory().post('/', {'chat_room_id': self.room.id})
+        request.user = self.user
+        limits = [ratelimit.parse_limit({'rate': '1/m', 'burst': 3}), ratelimit.parse_limit({'rate': '1/m', 'burst': 1, 'scope': 'room'})]
+        self.assertIsNone(ratelimit.check(request, 'refund', limits))
+        # The room limit refuses these; the user limit must not be drained by them
+        for _ in range(5):
+            self.assertEqual(ratelimit.check(request, 'refund', limits).status_code, 429)
+        self.assertIsNone(ratelimit.check(request, 'refund', limits[:1]))
+        self.assertIsNone(ratelimit.check(request, 'refund', limits[:1]))
+
+    def test_overhead_benchmark_runs(self):
+        # Per-request timings are only meaningful on a quiet machine: the
+        # budget is enforced by `manage.py bench_ratelimit --budget-us`
+        out = StringIO()
+        call_command('bench_ratelimit', iterations=200, keys=10, budget_us=1e6, stdout=out)
+        self.assertIn('local:', out.getvalue())
+
+
+class SidebarCacheTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='sider', password='testpass123')
+        self.room = ChatRoom.objects.create(name='Sidebar Room', created_by=self.user)
+        self.room.members.add(self.user)
+        self.client.login(username='sider', password='testpass123')
+
+    def test_sidebar_fragment_served_from_cache(self):
+        self.client.get(reverse('chat:whatsapp'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('chat:whatsapp'))
+        self.assertContains(response, 'Sidebar Room')
+        self.assertFalse([q for q in queries.captured_queries if 'chat_message' in q['sql']])
+
+    def test_new_message_refreshes_sidebar(self):
+        self.client.get(reverse('chat:whatsapp'))
+        Message.objects.create(user=self.user, username='sider', content='fresh preview', chat_room=self.room)
+        response = self.client.get(reverse('chat:whatsapp'))
+        self.assertContains(response, 'fresh preview')
+
+    def test_sidebar_rendered_before_commit_is_not_reused(self):
+        self.client.get(reverse('chat:whatsapp'))
+        alias = sharding.alias_for_room(self.room.id)
+        with self.captureOnCommitCallbacks(using=alias, execute=True):
+            with transaction.atomic(using=alias):
+                Message.objects.create(user=self.user, username='sider', content='fresh preview', chat_room=self.room)
+                # A concurrent request renders the old sidebar under the bumped version
+                stale_version = chat_cache.sidebar_version(self.user)
+        self.assertNotEqual(chat_cache.sidebar_version(self.user), stale_version)
+
+    def test_assets_are_external(self):
+        response = self.client.get(reverse('chat:whatsapp'))
+        self.assertContains(response, 'chat/whatsapp.js')
+        self.assertNotContains(response, '<style>')
+
+
+class SyncTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.user = User.objects.create_user(username='syncer', password='testpass123')
+        self.friend = User.objects.create_user(username='friend', password='testpass123')
+        self.client.login(username='syncer', password='testpass123')
+
+    def make_room(self, name, messages=3):
+        room = ChatRoom.objects.create(name=name, created_by=self.user)
+        room.members.add(self.user, self.friend)
+        for i in range(messages):
+            Message.objects.create(user=self.friend, username='friend', content=f'{name} {i}', chat_room=room)
+        return room
+
+    def sync(self, rooms):
+        response = self.client.post(
+            reverse('chat:sync'), json.dumps({'rooms': rooms}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['rooms']
+
+    def test_returns_new_messages_and_unread_counts(self):
+        room = self.make_room('Alpha', messages=3)
+        first = room.messages.order_by('id').first()
+        data = self.sync({room.id: first.id})[str(room.id)]
+        self.assertEqual([m['content'] for m in data['messages']], ['Alpha 1', 'Alpha 2'])
+        self.assertEqual(data['unread'], 2)
+        self.assertEqual(data['last_message']['content'], 'Alpha 2')
+        self.assertFalse(data['truncated'])
+
+    @override_settings(CHAT_SYNC_MESSAGES_PER_ROOM=2)
+    def test_caps_messages_per_room(self):
+        room = self.make_room('Busy', messages=5)
+        data = self.sync({})[str(room.id)]
+        self.assertEqual([m['content'] for m in data['messages']], ['Busy 3', 'Busy 4'])
+        self.assertTrue(data['truncated'])
+        self.assertEqual(data['unread'], 5)
+
+    def test_query_count_does_not_grow_with_rooms(self):
+        rooms = [self.make_room(f'Room {i}') for i in range(2)]
+        self.sync({})
+        with CaptureQueriesContext(connection) as few:
+            self.sync({room.id: 0 for room in rooms})
+        rooms += [self.make_room(f'More {i}') for i in range(4)]
+        self.sync({})
+        with CaptureQueriesContext(connection) as many:
+            self.sync({room.id: 0 for room in rooms})
+        self.assertEqual(len(few), len(many))
+
+    def test_user_in_more_than_a_thousand_rooms(self):
+        busy = self.make_room('Busy', messages=2)
+        crowd = ChatRoom.objects.bulk_create(ChatRoom(name=f'Crowd {i}', created_by=self.user) for i in range(1200))
+        ChatRoom.members.through.objects.bulk_create(
+            ChatRoom.members.through(chatroom_id=room.id, user_id=self.user.id) for room in crowd
+        )
+        chat_cache.invalidate_memberships([self.user.id])
+        data = self.sync({})
+        self.assertEqual(len(data), 1201)
+        self.assertEqual([m['content'] for m in data[str(busy.id)]['messages']], ['Busy 0', 'Busy 1'])
+        self.assertEqual(data[str(crowd[-1].id)]['unread'], 0)
+
+    def test_sidebar_sync_leaves_out_messages(self):
+        room = self.make_room('Sidebar', messages=3)
+        response = self.client.post(
+            reverse('chat:sync') + '?messages=0', json.dumps({'rooms': {}}), content_type='application/json'
+        )
+        data = response.json()['rooms'][str(room.id)]
+        self.assertEqual(data['messages'], [])
+        self.assertEqual((data['unread'], data['last_message']['content']), (3, 'Sidebar 2'))
+
+
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        chat_cache.user_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.user = User.objects.create_user(username='poller', password='testpass123')
+        self.room = ChatRoom.objects.create(name='Polled', created_by=self.user)
+        self.room.members.add(self.user)
+
+    def auth_queries(self, url):
+        """Run a GET and return the session/user queries it issued."""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in ctx.captured_queries if 'django_session' in q['sql'] or '"auth_user"' in q['sql']]
+
+    def test_polls_reuse_the_resolved_user(self):
+        self.client.login(username='poller', password='testpass123')
+        url = reverse('chat:get_room_messages', args=[self.room.id])
+        self.auth_queries(url)  # Warm the caches
+        queries = self.auth_queries(url)
+        self.assertFalse([q for q in queries if '"auth_user"' in q])
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions_need_no_auth_queries(self):
+        self.client.login(username='poller', password='testpass123')
+        url = reverse('chat:get_room_messages', args=[self.room.id])
+        self.auth_queries(url)
+        self.assertEqual(self.auth_queries(url), [])
+
+    def test_password_change_signs_out_cached_sessions(self):
+        self.client.login(username='poller', password='testpass123')
+        url = reverse('chat:get_room_messages', args=[self.room.id])
+        self.client.get(url)
+        self.user.set_password('another-pass-456')
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class HashingTests(TestCase):
+    def setUp(self):
+        ratelimit.backend.reset()
+
+    def test_registration_hashes_the_password_once(self):
+        with mock.patch.object(hashing.executor, 'run', wraps=hashing.executor.run) as run:
+            response = self.client.post(reverse('chat:register'), {
+                'username': 'newcomer', 'password1': 'complex-pass-123', 'password2': 'complex-pass-123',
+            })
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(run.call_count, 1)
+        self.assertTrue(User.objects.get(username='newcomer').check_password('complex-pass-123'))
+        self.assertEqual(self.client.get(reverse('chat:whatsapp')).status_code, 200)
+
+    def test_full_queue_rejects_immediately(self):
+        pool = hashing.HashingExecutor(workers=1, queue_limit=0, timeout=5)
+        release = threading.Event()
+        blocker = threading.Thread(target=pool.run, args=(release.wait,))
+        blocker.start()
+        while pool.stats()['in_flight'] == 0:
+            time.sleep(0.001)
+        with self.assertRaises(hashing.HashingBusy):
+            pool.run(lambda: None)
+        release.set()
+        blocker.join()
+        stats = pool.stats()
+        self.assertEqual((stats['rejected'], stats['completed'], stats['in_flight']), (1, 1, 0))
+
+    def test_login_returns_503_when_hashing_is_busy(self):
+        User.objects.create_user(username='crowd', password='testpass123')
+        with mock.patch.object(hashing.executor, 'run', side_effect=hashing.HashingBusy(retry_after=2)):
+            response = self.client.post(reverse('login'), {'username': 'crowd', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+
+    def test_login_with_wrong_password_fails(self):
+        User.objects.create_user(username='crowd', password='testpass123')
+        self.assertFalse(self.client.login(username='crowd', password='wrong-pass'))
+        self.assertTrue(self.client.login(username='crowd', password='testpass123'))
+
+
+class CountingConsumer(eventlog.Consumer):
+    """Test projection: message count per room, kept in memory."""
+    name = 'test-counter'
+    kinds = ['message.created']
+    batch_size = 2
+
+    def __init__(self):
+        self.counts = {}
+
+    def handle(self, events):
+        for event in events:
+            self.counts[event.room_id] = self.counts.get(event.room_id, 0) + 1
+
+    def reset(self):
+        self.counts = {}
+
+
+class EventLogTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.user = User.objects.create_user(username='writer', password='testpass123')
+        self.room = ChatRoom.objects.create(name='Logged', created_by=self.user)
+        self.room.members.add(self.user)
+
+    def test_send_message_appends_event(self):
+        self.client.login(username='writer', password='testpass123')
+        self.client.post(reverse('chat:send_message'), {'message': 'hello', 'chat_room_id': self.room.id})
+        event = ChatEvent.objects.using(sharding.alias_for_room(self.room.id)).get()
+        message = sharding.room_messages(self.room.id).get()
+        self.assertEqual((event.kind, event.room_id, event.user_id), ('message.created', self.room.id, self.user.id))
+        self.assertEqual(event.payload['message_id'], message.id)
+
+    def test_event_rolls_back_with_message(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Message.objects.create(user=self.user, username='writer', content='lost', chat_room=self.room)
+                raise RuntimeError
+        self.assertFalse(ChatEvent.objects.exists())
+
+    def test_consumer_checkpoints_and_rebuild(self):
+        for i in range(5):
+            Message.objects.create(user=self.user, username='writer', content=str(i), chat_room=self.room)
+        eventlog.append('room.renamed', room_id=self.room.id)
+        consumer = CountingConsumer()
+
+        self.assertEqual(eventlog.consume(consumer), 6)
+        self.assertEqual(consumer.counts, {self.room.id: 5})
+        self.assertEqual(ConsumerCheckpoint.objects.get(name='test-counter').position, ChatEvent.objects.last().id)
+
+        # Nothing new: the checkpoint prevents double counting
+        self.assertEqual(eventlog.consume(consumer), 0)
+        self.assertEqual(consumer.counts, {self.room.id: 5})
+
+        # A rebuild starts over from an empty projection
+        self.assertEqual(eventlog.rebuild(consumer), 6)
+        self.assertEqual(consumer.counts, {self.room.id: 5})
+
+
+@skipUnless(settings.CHAT_SHARD_COUNT >= 2, 'run with CHAT_SHARD_COUNT=2 to test sharding')
+class ShardingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.user = User.objects.create_user(username='sharded', password='testpass123')
+        self.room = ChatRoom.objects.create(name='Sharded', created_by=self.user)
+        self.room.members.add(self.user)
+        self.client.login(username='sharded', password='testpass123')
+
+    def send(self, text):
+        self.client.post(reverse('chat:send_message'), {'message': text, 'chat_room_id': self.room.id})
+
+    def test_room_messages_live_on_the_room_shard(self):
+        self.room.refresh_from_db()
+        alias = sharding.alias_for_shard(self.room.shard)
+        self.assertNotEqual(alias, 'default')
+        self.send('one')
+        self.send('two')
+        self.assertEqual(Message.objects.using(alias).filter(chat_room=self.room).count(), 2)
+        self.assertFalse(Message.objects.using('default').filter(chat_room=self.room).exists())
+        self.assertEqual(ChatEvent.objects.using(alias).count(), 2)
+
+        messages = self.client.get(reverse('chat:get_room_messages', args=[self.room.id])).json()['messages']
+        self.assertEqual([m['content'] for m in messages], ['one', 'two'])
+        self.assertLess(messages[0]['id'], messages[1]['id'])
+        synced = self.client.post(
+            reverse('chat:sync'), json.dumps({'rooms': {}}), content_type='application/json'
+        ).json()['rooms'][str(self.room.id)]
+        self.assertEqual(synced['last_message']['content'], 'two')
+        self.assertContains(self.client.get(reverse('chat:whatsapp')), 'data-last-message="two"')
+
+    def test_move_room_keeps_history_and_id_order(self):
+        self.send('before')
+        self.room.refresh_from_db()
+        target = (self.room.shard + 1) % settings.CHAT_SHARD_COUNT
+        self.assertEqual(sharding.move_room(self.room.id, target, drain_seconds=0), 1)
+        self.send('after')
+        messages = list(sharding.room_messages(self.room.id).order_by('id'))
+        self.assertEqual([m.content for m in messages], ['before', 'after'])
+        self.assertEqual(messages[0]._state.db, sharding.alias_for_shard(target))
+
+    def test_move_room_keeps_changes_made_through_a_stale_mapping(self):
+        for text in ('kept', 'edited', 'deleted', 'edited early'):
+            self.send(text)
+        self.room.refresh_from_db()
+        source = sharding.alias_for_shard(self.room.shard)
+        target_shard = (self.room.shard + 1) % settings.CHAT_SHARD_COUNT
+        target = sharding.alias_for_shard(target_shard)
+        on_source = {m.content: m for m in Message.objects.using(source).filter(chat_room=self.room)}
+        feed_seq = changes.current_seq(self.room.id)
+
+        def stale_writes(line):
+            if 'copied' in line and 'late' not in line:
+                # Edited on the source after the bulk copy, before the switch
+                changes.edit_message(on_source['edited early'], 'edited early!')
+            if 'now served from' in line:
+                # The room is switched; a fresh worker writes to the target...
+                self.send('fresh')
+                # ...while a worker with the old mapping still writes to the source
+                with transaction.atomic(using=source):
+                    late = Message(user=self.user, username='sharded', content='late', chat_room=self.room)
+                    late.id = sharding.next_id(source)
+                    late.save(force_insert=True, using=source)
+                changes.edit_message(on_source['edited'], 'edited!')
+                changes.delete_message(on_source['deleted'])
+
+        sharding.move_room(self.room.id, target_shard, drain_seconds=0, log=stale_writes)
+
+        self.assertFalse(Message.objects.using(source).filter(chat_room=self.room).exists())
+        moved = list(Message.objects.using(target).filter(chat_room=self.room).order_by('id'))
+        self.assertEqual(
+            [(m.content, m.deleted_at is not None) for m in moved],
+            [('kept', False), ('edited!', False), ('', True), ('edited early!', False), ('fresh', False), ('late', False)],
+        )
+        self.assertEqual(len({m.seq for m in moved}), len(moved))
+        # Clients following the change feed see every change made during the move
+        changed, _ = changes.changes_since(self.room.id, feed_seq)
+        self.assertEqual({m.content for m in changed}, {'edited early!', 'fresh', 'late', 'edited!', ''})
+
+    def test_deleting_room_deletes_shard_messages(self):
+        self.send('gone soon')
+        self.room.refresh_from_db()
+        alias = sharding.alias_for_shard(self.room.shard)
+        self.room.delete()
+        self.assertFalse(Message.objects.using(alias).exists())
+
+    def test_admin_and_legacy_chat_read_the_shards(self):
+        self.send('on a shard')
+        Message.objects.create(user=self.user, username='sharded', content='legacy')
+        self.room.refresh_from_db()
+        alias = sharding.alias_for_shard(self.room.shard)
+        message = Message.objects.using(alias).get(chat_room=self.room)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True, is_superuser=True)
+        url = reverse('admin:chat_message_changelist')
+
+        # Unfiltered: the messages stored in 'default'
+        self.assertEqual([m.content for m in self.client.get(url).context['cl'].result_list], ['legacy'])
+        for params in ({'room': str(self.room.id)}, {'db': alias}, {'db': alias, 'room': 'Shard'}):
+            shown = self.client.get(url, params).context['cl'].result_list
+            self.assertEqual([(m.content, m.chat_room.name) for m in shown], [('on a shard', 'Sharded')])
+        self.assertContains(self.client.get(reverse('admin:chat_message_change', args=[message.id])), 'on a shard')
+
+        # The legacy chat page lists every database; its poll only legacy messages, which stay in 'default'
+        self.assertEqual([m.content for m in self.client.get(reverse('chat:chat')).context['messages']], ['on a shard', 'legacy'])
+        self.assertEqual([m['content'] for m in self.client.get(reverse('chat:get_messages')).json()['messages']], ['legacy'])
+
+
+class MessageAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('boss', 'boss@example.com', 'testpass123')
+        self.room = ChatRoom.objects.create(name='Ops', created_by=self.admin)
+        self.other = ChatRoom.objects.create(name='Other', created_by=self.admin)
+        Message.objects.bulk_create(
+            Message(user=self.admin, username='boss', content=f'm{i}', chat_room=self.room if i % 2 else self.other)
+            for i in range(250)
+        )
+        self.client.login(username='boss', password='testpass123')
+        self.url = reverse('admin:chat_message_changelist')
+
+    def test_changelist_avoids_exact_counts(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT COUNT(*)')])
+        self.assertContains(response, 'id__lt=')
+
+    def test_keyset_and_room_filters(self):
+        newest = Message.objects.order_by('-id')[0]
+        response = self.client.get(self.url, {'id__lt': newest.id, 'room': 'Ops'})
+        self.assertEqual(response.status_code, 200)
+        shown = list(response.context['cl'].result_list)
+        self.assertTrue(shown)
+        self.assertTrue(all(m.id < newest.id and m.chat_room_id == self.room.id for m in shown))
+        self.assertEqual(self.client.get(self.url, {'q': str(newest.id)}).context['cl'].result_count, 1)
+
+    def test_profile_changelist_joins_users_and_searches_by_prefix(self):
+        users = User.objects.bulk_create(User(username=f'profiled{i}') for i in range(30))
+        UserProfile.objects.bulk_create(UserProfile(user=user, status='Busy' if i % 2 else 'Away') for i, user in enumerate(users))
+        url = reverse('admin:chat_userprofile_changelist')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'last_seen__gte': '2000-01-01 00:00:00+00:00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 30)
+        # Only request.user is looked up on its own; the rows come with their users
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('SELECT "auth_user"')]), 1)
+        # The filtered count is capped instead of counting the whole table
+        counts = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT COUNT(*)')]
+        self.assertTrue(counts and all('LIMIT 10000' in sql for sql in counts))
+        found = self.client.get(url, {'q': 'profiled1'}).context['cl']
+        self.assertEqual(found.result_count, 11)
+        self.assertNotIn(' LIKE ', str(found.queryset.query))  # LIKE cannot use the BINARY username index
+        self.assertEqual(self.client.get(url, {'q': 'Profiled1'}).context['cl'].result_count, 0)
+        self.assertEqual(self.client.get(url, {'q': 'status:bus'}).context['cl'].result_count, 15)
+
+
+class CompressionTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+        self.room = ChatRoom.objects.create(name='Verbose', created_by=self.user)
+        self.room.members.add(self.user)
+        for i in range(30):
+            Message.objects.create(user=self.user, username='reader', content=f'Message number {i}', chat_room=self.room)
+        Message.objects.create(user=None, username='System', content='Room created', chat_room=self.room)
+        self.client.login(username='reader', password='testpass123')
+        self.url = reverse('chat:get_room_messages', args=[self.room.id])
+
+    def test_compact_schema_uses_short_keys_and_omits_nulls(self):
+        full = self.client.get(self.url)
+        compact = self.client.get(self.url + '?compact=1')
+        self.assertLess(len(compact.content), len(full.content))
+        messages = compact.json()['messages']
+        self.assertEqual(messages[0]['c'], 'Message number 0')
+        self.assertEqual(messages[0]['s'], self.user.id)
+        self.assertNotIn('s', messages[-1])
+        self.assertEqual(len(messages), len(full.json()['messages']))
+
+    def test_gzip_for_clients_without_brotli(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['messages']), 31)
+
+    @skipUnless(brotli is not None, 'brotli is not installed')
+    def test_brotli_for_json_only(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(len(json.loads(brotli.decompress(response.content))['messages']), 31)
+        # Random padding makes the compressed length of identical responses vary
+        lengths = {len(self.client.get(self.url, HTTP_ACCEPT_ENCODING='br').content) for _ in range(10)}
+        self.assertGreater(len(lengths), 1)
+        page = self.client.get(reverse('chat:whatsapp'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(page['Content-Encoding'], 'gzip')
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get(reverse('chat:get_presence'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ProfilingTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        chat_cache.user_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        profiling.sampler.profiles.clear()
+        self.staff = User.objects.create_user(username='oncall', password='testpass123', is_staff=True)
+        self.room = ChatRoom.objects.create(name='Profiled', created_by=self.staff)
+        self.room.members.add(self.staff)
+        self.url = reverse('chat:get_room_messages', args=[self.room.id])
+
+    def test_staff_header_keeps_profile_with_sql(self):
+        self.client.login(username='oncall', password='testpass123')
+        response = self.client.get(self.url, HTTP_X_CHAT_PROFILE='1')
+        profile_id = int(response['X-Chat-Profile-Id'])
+        detail = self.client.get(reverse('chat:profile_detail', args=[profile_id])).json()
+        self.assertEqual(detail['path'], self.url)
+        self.assertTrue(any('chat_message' in q['sql'] for q in detail['queries']))
+        listing = self.client.get(reverse('chat:profile_list')).json()['profiles']
+        self.assertEqual([p['id'] for p in listing], [profile_id])
+
+    def test_header_ignored_for_regular_users(self):
+        User.objects.create_user(username='member', password='testpass123')
+        self.room.members.add(User.objects.get(username='member'))
+        self.client.login(username='member', password='testpass123')
+        response = self.client.get(self.url, HTTP_X_CHAT_PROFILE='1')
+        self.assertFalse(response.has_header('X-Chat-Profile-Id'))
+        self.assertEqual(len(profiling.sampler.profiles), 0)
+        self.assertEqual(self.client.get(reverse('chat:profile_list')).status_code, 302)
+
+    def test_sampler_records_folded_stacks(self):
+        request = Client().get('/').wsgi_request
+        profile = profiling.Profile(request, forced=True)
+        profiling.sampler.begin(profile)
+        try:
+            profiling.sampler.sample()
+        finally:
+            profiling.sampler.end(profile, 200)
+        folded = profile.folded()
+        self.assertIn('ProfilingTests.test_sampler_records_folded_stacks', folded)
+        self.assertTrue(folded.strip().endswith(' 1'))
+
+    def test_slow_requests_are_kept_without_header(self):
+        self.client.login(username='oncall', password='testpass123')
+        with mock.patch.object(profiling, 'SLOW_MS', 1), mock.patch.object(profiling.sampler, 'slow', 0.001):
+            with mock.patch('chat.views.presence.record', side_effect=lambda request: time.sleep(0.02)):
+                self.client.get(self.url)
+        kept = profiling.sampler.recent()
+        self.assertEqual(len(kept), 1)
+        self.assertFalse(kept[0].forced)
+        self.assertGreaterEqual(kept[0].duration_ms, 20)
+
+
+class ChangeFeedTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.user = User.objects.create_user(username='author', password='testpass123')
+        self.other = User.objects.create_user(username='reader', password='testpass123')
+        self.room = ChatRoom.objects.create(name='Edits', created_by=self.user)
+        self.room.members.add(self.user, self.other)
+        self.first = Message.objects.create(user=self.user, username='author', content='frist', chat_room=self.room)
+        self.second = Message.objects.create(user=self.other, username='reader', content='hello', chat_room=self.room)
+        self.client.login(username='author', password='testpass123')
+
+    def changes(self, since):
+        response = self.client.get(reverse('chat:room_changes', args=[self.room.id]), {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_history_is_paged_by_message_id(self):
+        for i in range(8):
+            Message.objects.create(user=self.user, username='author', content=f'm{i}', chat_room=self.room)
+        changes.edit_message(self.first, 'first')
+        url = reverse('chat:get_room_messages', args=[self.room.id])
+        newest = self.client.get(url, {'limit': 4}).json()
+        self.assertEqual([m['content'] for m in newest['messages']], ['m4', 'm5', 'm6', 'm7'])
+        self.assertTrue(newest['more'])
+        self.assertEqual(newest['seq'], 11)  # The edit of an older message counts too
+        older = self.client.get(url, {'limit': 4, 'before': newest['messages'][0]['id']}).json()
+        self.assertEqual([m['content'] for m in older['messages']], ['m0', 'm1', 'm2', 'm3'])
+        oldest = self.client.get(url, {'limit': 4, 'before': older['messages'][0]['id']}).json()
+        self.assertEqual(([m['content'] for m in oldest['messages']], oldest['more']), (['first', 'hello'], False))
+        newer = self.client.get(url, {'limit': 2, 'after': older['messages'][1]['id']}).json()
+        self.assertEqual(([m['content'] for m in newer['messages']], newer['more']), (['m2', 'm3'], True))
+        self.assertEqual(self.client.get(url, {'before': 'x'}).status_code, 400)
+
+    def test_new_messages_take_the_next_room_sequence_number(self):
+        self.assertEqual((self.first.seq, self.second.seq), (1, 2))
+        other_room = ChatRoom.objects.create(name='Other', created_by=self.user)
+        self.assertEqual(Message.objects.create(username='x', content='y', chat_room=other_room).seq, 1)
+
+    def test_only_content_edits_and_deletions_take_a_new_number(self):
+        message = sharding.room_messages(self.room.id).get(id=self.first.id)
+        message.is_read = True
+        with CaptureQueriesContext(connections[message._state.db]) as queries:
+            message.save()
+        self.assertEqual(len(queries.captured_queries), 1)  # The UPDATE, no sequence lookup
+        message.save(update_fields=['is_read'])
+        message.refresh_from_db()
+        self.assertEqual((message.seq, message.is_read), (1, True))
+
+        message.content = 'edited in the admin'
+        message.save()
+        self.assertEqual(message.seq, 3)
+        self.assertEqual(changes.current_seq(self.room.id), 3)
+
+    def test_edit_and_delete_are_returned_as_deltas(self):
+        seq = self.client.get(reverse('chat:get_room_messages', args=[self.room.id])).json()['seq']
+        edit = self.client.post(
+            reverse('chat:edit_message', args=[self.room.id, self.first.id]), {'message': 'first'}
+        ).json()
+        self.assertTrue(edit['success'])
+        self.client.post(reverse('chat:delete_message', args=[self.room.id, self.first.id]))
+
+        feed = self.changes(seq)
+        self.assertEqual(len(feed['changes']), 1)
+        change = feed['changes'][0]
+        self.assertEqual((change['id'], change['deleted'], change['content']), (self.first.id, True, None))
+        self.assertIsNotNone(change['edited_at'])
+        self.assertEqual(feed['seq'], change['seq'])
+        self.assertFalse(feed['more'])
+        self.assertEqual(self.changes(feed['seq'])['changes'], [])
+
+        remaining = self.client.get(reverse('chat:get_room_messages', args=[self.room.id])).json()['messages']
+        self.assertEqual([m['content'] for m in remaining], ['hello'])
+        self.assertEqual(
+            list(ChatEvent.objects.using(sharding.alias_for_room(self.room.id))
+                 .filter(room_id=self.room.id).values_list('kind', flat=True)),
+            ['message.created', 'message.created', 'message.edited', 'message.deleted'],
+        )
+
+    def test_only_the_author_can_change_a_message(self):
+        response = self.client.post(reverse('chat:edit_message', args=[self.room.id, self.second.id]), {'message': 'x'})
+        self.assertEqual(response.status_code, 403)
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.content, 'hello')
+
+    def test_feed_pages_by_sequence(self):
+        page, more = changes.changes_since(self.room.id, 0, limit=1)
+        self.assertEqual([m.seq for m in page], [1])
+        self.assertTrue(more)
+        page, more = changes.changes_since(self.room.id, page[-1].seq, limit=1)
+        self.assertEqual([m.seq for m in page], [2])
+        self.assertFalse(more)
+
+
+class DirectRoomTests(TestCase):
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.alice = User.objects.create_user(username='alice', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', password='testpass123')
+
+    def test_same_room_from_either_side(self):
+        self.client.login(username='alice', password='testpass123')
+        first = self.client.post(reverse('chat:direct_room', args=[self.bob.id])).json()
+        self.assertTrue(first['created'])
+        again = self.client.post(
+            reverse('chat:create_chat_room'), {'name': 'Bob', 'is_group': 'false', 'user_id': self.bob.id}
+        ).json()
+        self.client.login(username='bob', password='testpass123')
+        other_side = self.client.post(reverse('chat:direct_room', args=[self.alice.id])).json()
+        self.assertEqual({first['room_id'], again['room_id'], other_side['room_id']}, {first['room_id']})
+        self.assertFalse(other_side['created'])
+        room = ChatRoom.objects.get(id=first['room_id'])
+        self.assertEqual(set(room.members.values_list('username', flat=True)), {'alice', 'bob'})
+        self.assertEqual(ChatRoom.objects.count(), 1)
+
+    def test_lookup_is_one_query(self):
+        rooms.get_or_create_direct_room(self.alice, self.bob)
+        with self.assertNumQueries(1):
+            room, created = rooms.get_or_create_direct_room(self.bob, self.alice)
+        self.assertFalse(created)
+
+    def test_losing_a_creation_race_returns_the_winner(self):
+        winner = ChatRoom.objects.create(
+            name='winner', created_by=self.bob, dm_key=ChatRoom.dm_key_for(self.alice.id, self.bob.id)
+        )
+        # Simulate the other request inserting between our lookup and our insert
+        with mock.patch.object(ChatRoom.objects, 'filter', return_value=ChatRoom.objects.none()):
+            room, created = rooms.get_or_create_direct_room(self.alice, self.bob)
+        self.assertEqual((room, created), (winner, False))
+        self.assertEqual(ChatRoom.objects.count(), 1)
+
+    def test_unknown_user(self):
+        self.client.login(username='alice', password='testpass123')
+        self.assertEqual(self.client.post(reverse('chat:direct_room', args=[9999])).status_code, 404)
+
+    def test_others_cannot_join_a_direct_room(self):
+        room, _ = rooms.get_or_create_direct_room(self.alice, self.bob)
+        User.objects.create_user(username='mallory', password='testpass123')
+        self.client.login(username='mallory', password='testpass123')
+        self.assertEqual(self.client.post(reverse('chat:join_chat_room', args=[room.id])).status_code, 404)
+        self.client.login(username='alice', password='testpass123')
+        self.assertTrue(self.client.post(reverse('chat:join_chat_room', args=[room.id])).json()['success'])
+        added = self.client.post(
+            reverse('chat:add_room_members', args=[room.id]),
+            json.dumps({'user_ids': [User.objects.get(username='mallory').id]}), content_type='application/json',
+        )
+        self.assertEqual(added.status_code, 400)
+        self.assertEqual(set(room.members.values_list('username', flat=True)), {'alice', 'bob'})
+
+
+class MembershipTests(TestCase):
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.users = [User(username=f'member{i:03}') for i in range(120)]
+        User.objects.bulk_create(self.users)
+        self.users = list(User.objects.filter(username__startswith='member').order_by('id'))
+        self.room = ChatRoom.objects.create(name='Crowd', created_by=self.owner, is_group=True)
+        self.room.members.add(self.owner)
+        self.client.login(username='owner', password='testpass123')
+
+    def post_ids(self, name, ids):
+        return self.client.post(
+            reverse(f'chat:{name}', args=[self.room.id]), json.dumps({'user_ids': ids}), content_type='application/json'
+        )
+
+    def member_count(self):
+        return ChatRoom.objects.get(id=self.room.id).member_count
+
+    def test_member_count_follows_every_kind_of_change(self):
+        self.assertEqual(self.member_count(), 1)
+        self.room.members.add(self.users[0], self.owner)  # owner already a member
+        self.assertEqual(self.member_count(), 2)
+        self.users[1].chat_rooms.add(self.room)
+        self.room.members.remove(self.users[0], self.users[2])  # users[2] never joined
+        self.assertEqual(self.member_count(), 2)
+        self.room.members.clear()
+        self.assertEqual(self.member_count(), 0)
+
+    def test_room_recached_during_add_members_is_dropped_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                rooms.add_members(self.room, [user.id for user in self.users[:5]])
+                # A concurrent request caches the room as it was before the commit
+                stale = ChatRoom.objects.get(id=self.room.id)
+                stale.member_count = 1
+                cache.set(chat_cache.room_key(self.room.id), stale, 300)
+                chat_cache.local_cache.clear()
+        self.assertEqual(chat_cache.get_room(self.room.id).member_count, 6)
+
+    def test_bulk_add_and_remove(self):
+        ids = [user.id for user in self.users] + [999999]
+        response = self.post_ids('add_room_members', ids)
+        self.assertEqual(response.json()['changed'], 120)
+        self.assertEqual(self.member_count(), 121)
+        self.assertIn(self.room.id, chat_cache.get_user_room_ids(self.users[-1].id))
+
+        self.assertEqual(rooms.remove_members(self.room, ids[:20], batch_size=7), 20)
+        self.assertEqual(self.member_count(), 101)
+        self.assertNotIn(self.room.id, chat_cache.get_user_room_ids(self.users[0].id))
+
+    def test_only_owner_changes_others_but_members_can_leave(self):
+        self.room.members.add(*self.users[:2])
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.post_ids('add_room_members', [self.users[5].id]).status_code, 403)
+        self.assertEqual(self.post_ids('remove_room_members', [self.users[1].id]).status_code, 403)
+        self.assertEqual(self.post_ids('remove_room_members', [self.users[0].id]).json()['changed'], 1)
+
+    def test_member_list_is_paged_and_searchable(self):
+        rooms.add_members(self.room, [user.id for user in self.users])
+        url = reverse('chat:room_members', args=[self.room.id])
+        first = self.client.get(url, {'limit': 50}).json()
+        self.assertEqual(first['count'], 121)
+        self.assertEqual(len(first['members']), 50)
+        second = self.client.get(url, {'limit': 50, 'after': first['next']}).json()
+        self.assertGreater(second['members'][0]['id'], first['members'][-1]['id'])
+        found = self.client.get(url, {'q': 'MEMBER01'}).json()
+        self.assertEqual(len(found['members']), 10)
+        self.assertIsNone(found['next'])
+
+
+class AttachmentTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        ratelimit.backend.reset()
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        patcher = mock.patch.object(attachments, 'ROOT', Path(storage.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='sender', password='pw12345')
+        self.peer = User.objects.create_user(username='peer')
+        self.stranger = User.objects.create_user(username='stranger')
+        self.room = ChatRoom.objects.create(name='Files', created_by=self.user)
+        self.room.members.add(self.user, self.peer)
+        self.client.force_login(self.user)
+
+    def upload(self, data, chunk=4, content_type='text/plain'):
+        start = self.client.post(
+            reverse('chat:start_upload'),
+            json.dumps({'filename': 'notes.txt', 'size': len(data), 'content_type': content_type}),
+            content_type='application/json',
+        ).json()
+        url = reverse('chat:upload_chunk', args=[start['upload_id']])
+        for offset in range(0, len(data), chunk):
+            response = self.client.put(
+                url, data=data[offset:offset + chunk],
+                content_type='application/octet-stream', HTTP_X_UPLOAD_OFFSET=str(offset),
+            )
+        return url, response.json()
+
+    def test_chunked_upload_resumes_and_deduplicates(self):
+        start = self.client.post(
+            reverse('chat:start_upload'),
+            json.dumps({'filename': '../notes.txt', 'size': 10, 'content_type': 'text/plain'}),
+            content_type='application/json',
+        ).json()
+        url = reverse('chat:upload_chunk', args=[start['upload_id']])
+        self.client.put(url, data=b'01234', content_type='application/octet-stream', HTTP_X_UPLOAD_OFFSET='0')
+        stale = self.client.put(url, data=b'01234', content_type='application/octet-stream', HTTP_X_UPLOAD_OFFSET='0')
+        self.assertEqual(stale.status_code, 409)
+        self.assertEqual(self.client.get(url).json()['offset'], 5)
+        done = self.client.put(url, data=b'56789', content_type='application/octet-stream', HTTP_X_UPLOAD_OFFSET='5')
+        self.assertTrue(done.json()['complete'])
+        attachment = Attachment.objects.get(id=done.json()['attachment_id'])
+        self.assertEqual(attachments.blob_path(attachment.sha256).read_bytes(), b'0123456789')
+        self.assertEqual(Upload.objects.get(id=start['upload_id']).filename, 'notes.txt')
+
+        _, again = self.upload(b'0123456789')
+        self.assertEqual(again['attachment_id'], attachment.id)
+        self.assertEqual(Attachment.objects.count(), 1)
+
+    def test_message_attachment_download_and_ranges(self):
+        data = bytes(range(256)) * 4
+        _, done = self.upload(data, chunk=300)
+        response = self.client.post(reverse('chat:send_message'), {
+            'chat_room_id': self.room.id, 'attachment_id': done['attachment_id'],
+        })
+        self.assertTrue(response.json()['success'])
+        messages = self.client.get(reverse('chat:get_room_messages', args=[self.room.id])).json()['messages']
+        self.assertEqual(messages[-1]['attachment']['name'], 'notes.txt')
+
+        self.client.force_login(self.peer)
+        url = messages[-1]['attachment']['url']
+        whole = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(b''.join(whole.streaming_content), data)
+        self.assertNotIn('Content-Encoding', whole)
+        part = self.client.get(url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(part.status_code, 206)
+        self.assertEqual(part['Content-Range'], f'bytes 100-199/{len(data)}')
+        self.assertEqual(b''.join(part.streaming_content), data[100:200])
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=5000-').status_code, 416)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=whole['ETag']).status_code, 304)
+
+        self.client.force_login(self.stranger)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.post(reverse('chat:send_message'), {
+            'chat_room_id': self.room.id, 'attachment_id': done['attachment_id'],
+        }).status_code, 400)
+
+    def test_unsafe_types_are_downloaded_not_rendered(self):
+        _, done = self.upload(b'<script>alert(1)</script>', content_type='text/html')
+        response = self.client.get(reverse('chat:attachment_download', args=[done['attachment_id']]))
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertEqual(response['Content-Disposition'], 'attachment')
+
+
+class SQLiteCacheTests(TestCase):
+    def setUp(self):
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        self.path = str(Path(storage.name) / 'cache.sqlite3')
+        self.cache = SQLiteCache(self.path, {'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 2, 'CULL_EVERY': 1}})
+
+    def test_refuses_files_other_users_could_write(self):
+        shared = Path(self.path).parent / 'shared'
+        shared.mkdir()
+        shared.chmod(0o777)
+        with self.assertRaises(ImproperlyConfigured):
+            SQLiteCache(str(shared / 'cache.sqlite3'), {}).get('key')
+        if os.getuid() == 0:
+            planted = Path(self.path).parent / 'planted.sqlite3'
+            planted.touch()
+            os.chown(planted, 65534, 65534)
+            with self.assertRaises(ImproperlyConfigured):
+                SQLiteCache(str(planted), {}).get('key')
+
+    @skipUnless(settings.CHAT_CACHE_BACKEND == 'sqlite', 'the default cache is not SQLiteCache')
+    def test_test_runs_do_not_share_the_server_cache(self):
+        location = settings.CACHES['default']['LOCATION']
+        self.assertTrue(os.path.basename(os.path.dirname(location)).startswith('nisha-test-cache-'))
+
+    def test_django_cache_api(self):
+        self.cache.set('room', {'name': 'General'}, 60)
+        self.assertEqual(self.cache.get('room'), {'name': 'General'})
+        self.assertFalse(self.cache.add('room', 'other'))
+        self.cache.set('gone', 1, 0)
+        self.assertIsNone(self.cache.get('gone'))
+        self.assertTrue(self.cache.add('gone', 2))
+        self.assertEqual(self.cache.get_many(['room', 'gone', 'missing']), {'room': {'name': 'General'}, 'gone': 2})
+        self.assertEqual(self.cache.incr('gone', 5), 7)
+        self.assertEqual(self.cache.decr('gone'), 6)
+        self.cache.set('ratio', 0.5)
+        self.assertEqual(self.cache.incr('ratio'), 1.5)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        # A second instance (another worker) sees the same entries
+        self.assertEqual(SQLiteCache(self.path, {}).get('gone'), 6)
+
+    def test_increments_from_concurrent_threads_are_not_lost(self):
+        self.cache.set('counter', 0, None)
+        threads = [threading.Thread(target=lambda: [self.cache.incr('counter') for _ in range(200)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('counter'), 800)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        with mock.patch('chat.sqlite_cache.ACCESS_RESOLUTION', 0):
+            for index in range(10):
+                self.cache.set(f'k{index}', index)
+            self.cache.get('k0')  # Recently used: survives the cull
+            self.cache.set('k10', 10)
+        self.assertEqual(self.cache.get('k0'), 0)
+        self.assertIsNone(self.cache.get('k1'))
+        self.assertEqual(self.cache.get('k10'), 10)
+        self.assertLessEqual(len(self.cache.get_many([f'k{index}' for index in range(11)])), 6)
+
+
+class ColdStartTests(TestCase):
+    def test_cold_start_check_runs(self):
+        # Import times depend on the machine: the budget is enforced by running
+        # `manage.py check_cold_start` in CI, not by the test suite
+        out = StringIO()
+        call_command('check_cold_start', runs=1, budget_ms=10**9, stdout=out)
+        self.assertIn('Total import time', out.getvalue())
+
+    def test_lazy_admin_urlconf_includes_model_admins(self):
+        from Nisha.urls import LazyAdminURLConf
+        routes = [str(pattern.pattern) for pattern in LazyAdminURLConf().urlpatterns]
+        self.assertIn('chat/message/', routes)
+
+
+class ActivityRollupTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.alice = User.objects.create_user(username='alice', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', password='testpass123', is_staff=True)
+        self.busy = ChatRoom.objects.create(name='Busy', created_by=self.alice)
+        self.quiet = ChatRoom.objects.create(name='Quiet', created_by=self.bob)
+        for content in ('one', 'two', 'three'):
+            Message.objects.create(user=self.alice, username='alice', content=content, chat_room=self.busy)
+        Message.objects.create(user=self.bob, username='bob', content='hello', chat_room=self.busy)
+        Message.objects.create(user=self.bob, username='bob', content='hi', chat_room=self.quiet)
+
+    def test_consumer_counts_messages_per_bucket(self):
+        consumer = rollups.ActivityRollupConsumer()
+        eventlog.consume(consumer)
+        hours = RoomActivity.objects.filter(period='hour', room_id=self.busy.id)
+        self.assertEqual(hours.aggregate(m=Sum('messages'), c=Sum('characters')), {'m': 4, 'c': 16})
+        self.assertEqual(UserActivity.objects.filter(period='day', user_id=self.bob.id).aggregate(m=Sum('messages'))['m'], 2)
+
+        # A later batch adds to the existing buckets; a rebuild gives the same totals
+        Message.objects.create(user=self.alice, username='alice', content='four', chat_room=self.busy)
+        days = RoomActivity.objects.filter(period='day', room_id=self.busy.id)
+        eventlog.consume(consumer)
+        self.assertEqual(days.aggregate(m=Sum('messages'))['m'], 5)
+        eventlog.rebuild(consumer)
+        self.assertEqual(days.aggregate(m=Sum('messages'))['m'], 5)
+
+    def test_report_reads_rollups_only(self):
+        eventlog.consume(rollups.ActivityRollupConsumer())
+        self.client.login(username='bob', password='testpass123')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('chat:activity_stats'), {'period': 'hour'})
+        self.assertFalse(any('chat_message' in query['sql'] for query in queries.captured_queries))
+        data = response.json()
+        self.assertEqual(sum(row['messages'] for row in data['series']), 5)
+        self.assertEqual(data['top_rooms'][0], {'room_id': self.busy.id, 'name': 'Busy', 'messages': 4})
+        self.assertEqual(data['top_users'][0]['username'], 'alice')
+        self.assertEqual(data['pending_events'], 0)
+
+        response = self.client.get(reverse('chat:activity_stats'), {'user_id': self.bob.id})
+        self.assertEqual(sum(row['messages'] for row in response.json()['series']), 2)
+        self.assertEqual(self.client.get(reverse('chat:activity_stats'), {'period': 'week'}).status_code, 400)
+
+    def test_report_is_staff_only(self):
+        self.client.login(username='alice', password='testpass123')
+        self.assertEqual(self.client.get(reverse('chat:activity_stats')).status_code, 302)
+
+
+class MemoryMonitorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        ratelimit.backend.reset()
+        self.was_tracing = tracemalloc.is_tracing()
+        if not self.was_tracing:
+            tracemalloc.start(1)
+        self.monitor = memory.Monitor(trace=True, top=10)
+
+    def tearDown(self):
+        if not self.was_tracing:
+            tracemalloc.stop()
+
+    def test_diff_shows_growing_allocation_site(self):
+        self.monitor.sample()
+        retained = [bytearray(1024) for _ in range(2000)]
+        summary = self.monitor.sample()
+        self.assertGreater(summary['rss'], 0)
+        self.assertTrue(summary['top'])
+        sites = self.monitor.diff('previous')
+        self.assertIn('chat/tests.py', sites[0]['site'])
+        self.assertGreater(sites[0]['size_diff'], 2000 * 1024)
+        del retained
+
+    def test_recycles_once_past_threshold(self):
+        monitor = memory.Monitor(recycle_mb=1)
+        with mock.patch('chat.memory.os.kill') as kill, self.assertLogs('chat.memory', 'WARNING'):
+            monitor.sample()
+            monitor.sample()
+        kill.assert_called_once_with(os.getpid(), signal.SIGTERM)
+
+    def test_endpoints_are_staff_only(self):
+        User.objects.create_user(username='member', password='testpass123')
+        User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        self.client.login(username='member', password='testpass123')
+        self.assertEqual(self.client.get(reverse('chat:memory_stats')).status_code, 302)
+        self.client.login(username='admin', password='testpass123')
+        with mock.patch('chat.memory.monitor', self.monitor):
+            data = self.client.get(reverse('chat:memory_stats'), {'sample': '1'}).json()
+            self.assertEqual(len(data['samples']), 1)
+            self.assertEqual(self.client.get(reverse('chat:memory_diff')).status_code, 404)  # One snapshot only
+            self.monitor.sample()
+            response = self.client.get(reverse('chat:memory_diff'), {'against': 'baseline'})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('sites', response.json())
+
+
+class MessageRenderingTests(TestCase):
+    databases = '__all__'  # Messages may be stored on CHAT_SHARD_COUNT shards
+
+    def setUp(self):
+        chat_cache.local_cache.clear()
+        cache.clear()
+        ratelimit.backend.reset()
+        self.user = User.objects.create_user(username='writer', password='testpass123')
+        self.room = ChatRoom.objects.create(name='Rendered', created_by=self.user)
+        self.room.members.add(self.user)
+        self.client.login(username='writer', password='testpass123')
+
+    def test_renderer_escapes_and_formats(self):
+        self.assertEqual(
+            rendering.render_html('<script>alert(1)</script> **bold** _it_ `a<b>`\nhttps://example.com/?a=1&b=2.'),
+            '&lt;script&gt;alert(1)&lt;/script&gt; <strong>bold</strong> <em>it</em> <code>a&lt;b&gt;</code><br>'
+            '<a href="https://example.com/?a=1&amp;b=2" target="_blank" rel="noopener noreferrer nofollow">'
+            'https://example.com/?a=1&amp;b=2</a>.',
+        )
+        self.assertNotIn('"onmouseover', rendering.render_html('https://x.test/"onmouseover="alert(1)'))
+        self.assertEqual(rendering.render_html('snake_case_name'), 'snake_case_name')
+        self.assertEqual(rendering.render_preview('a\n\n' + 'b' * 200), 'a ' + 'b' * 98 + '…')
+
+    def test_rendered_on_write_and_copied_on_read(self):
+        message = Message.objects.create(user=self.user, username='writer', content='<b>hi</b>', chat_room=self.room)
+        self.assertEqual((message.content_html, message.preview), ('&lt;b&gt;hi&lt;/b&gt;', '<b>hi</b>'))
+        changes.edit_message(message, '**bye**')
+        message.refresh_from_db()
+        self.assertEqual((message.content_html, message.render_version), ('<strong>bye</strong>', rendering.RENDER_VERSION))
+
+        with mock.patch('chat.rendering.render_html') as render_html:
+            data = self.client.get(reverse('chat:get_room_messages', args=[self.room.id]), {'compact': '1'}).json()
+        render_html.assert_not_called()
+        self.assertEqual(data['messages'][0]['h'], '<strong>bye</strong>')
+
+        changes.delete_message(message)
+        change = self.client.get(reverse('chat:room_changes', args=[self.room.id])).json()['changes'][0]
+        self.assertIsNone(change['html'])
+
+    def test_rerender_updates_stale_rows(self):
+        message = Message.objects.create(user=self.user, username='writer', content='**x**', chat_room=self.room)
+        Message.objects.filter(pk=message.pk).update(content_html='old', render_version=0)
+        # Never-rendered rows are rendered on read until the command has run
+        data = self.client.get(reverse('chat:get_room_messages', args=[self.room.id])).json()
+        self.assertEqual(data['messages'][0]['html'], '<strong>x</strong>')
+        call_command('rerender_messages', stdout=StringIO())
+        message.refresh_from_db()
+        self.assertEqual((message.content_html, message.render_version), ('<strong>x</strong>', rendering.RENDER_VERSION))
+
+    def test_sidebar_renders_previews_until_rerendered(self):
+        message = Message.objects.create(user=self.user, username='writer', content='old  rows', chat_room=self.room)
+        # Rows written before previews were stored (migration 0013) have none
+        sharding.room_messages(self.room.id).filter(pk=message.pk).update(preview='', render_version=0)
+        chat_cache.touch_room(self.room.id)
+        self.assertContains(self.client.get(reverse('chat:whatsapp')), 'data-last-message="old rows"')
+        version = chat_cache.sidebar_version(self.user)
+        call_command('rerender_messages', stdout=StringIO())
+        # Cached sidebars are rebuilt from the re-rendered rows
+        self.assertNotEqual(chat_cache.sidebar_version(self.user), version)
+        self.assertContains(self.client.get(reverse('chat:whatsapp')), 'data-last-message="old rows"')
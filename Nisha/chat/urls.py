@@ -6,9 +6,16 @@ from django.urls import path  # For defining URL patterns
 from .views import (  # Import all view functions from the current app
     chat_view, send_message, get_messages, whatsapp_view,
     get_room_messages, create_chat_room, join_chat_room,
-    register_view, get_users
+    register_view, get_users, get_presence, room_event, sync, hashing_stats,
+    profile_list, profile_detail, room_changes, edit_message, delete_message, direct_room,
+    room_members, add_room_members, remove_room_members,
+    start_upload, upload_chunk, attachment_download, activity_stats,
+    memory_stats, memory_diff
 )
 
+# URL namespace so views can be reversed as 'chat:<name>'
+app_name = 'chat'
+
 # URL patterns for the chat application
 # Each path() defines a route: path(route, view_function, name)
 urlpatterns = [
@@ -24,14 +31,35 @@ urlpatterns = [
     
     # Room-specific message endpoints
     path('room/<int:room_id>/messages/', get_room_messages, name='get_room_messages'),  # GET messages for specific room
+    path('room/<int:room_id>/changes/', room_changes, name='room_changes'),  # GET messages sent/edited/deleted after ?since=<seq>
+    path('room/<int:room_id>/messages/<int:message_id>/edit/', edit_message, name='edit_message'),  # POST new content
+    path('room/<int:room_id>/messages/<int:message_id>/delete/', delete_message, name='delete_message'),  # POST delete (tombstone)
+    path('room/<int:room_id>/typing/', room_event, name='room_event'),  # POST ephemeral typing/activity events
+    path('uploads/', start_upload, name='start_upload'),  # POST announce a file upload
+    path('uploads/<uuid:upload_id>/', upload_chunk, name='upload_chunk'),  # GET resume offset / PUT next chunk
+    path('attachments/<int:attachment_id>/', attachment_download, name='attachment_download'),  # GET file (Range aware)
+    path('sync/', sync, name='sync'),  # POST one request covering new messages/unread counts for all rooms
     
     # Chat room management endpoints
     path('create-room/', create_chat_room, name='create_chat_room'),  # POST endpoint to create new chat rooms
     path('join-room/<int:room_id>/', join_chat_room, name='join_chat_room'),  # POST endpoint to join existing rooms
+    path('dm/<int:user_id>/', direct_room, name='direct_room'),  # POST get-or-create the DM room with a user
+    path('room/<int:room_id>/members/', room_members, name='room_members'),  # GET paged, searchable member list
+    path('room/<int:room_id>/members/add/', add_room_members, name='add_room_members'),  # POST bulk add (JSON user_ids)
+    path('room/<int:room_id>/members/remove/', remove_room_members, name='remove_room_members'),  # POST bulk remove / leave
     
     # User management endpoints
     path('register/', register_view, name='register'),  # User registration page and handler
     path('users/', get_users, name='get_users'),  # GET endpoint to retrieve user list for room invitations
+    path('presence/', get_presence, name='get_presence'),  # GET endpoint for online users (also a heartbeat)
+    
+    # Operational endpoints (staff only)
+    path('stats/hashing/', hashing_stats, name='hashing_stats'),  # GET password hashing queue depth/timings
+    path('stats/profiles/', profile_list, name='profile_list'),  # GET recent slow/requested request profiles
+    path('stats/profiles/<int:profile_id>/', profile_detail, name='profile_detail'),  # GET stacks + SQL of one profile
+    path('stats/activity/', activity_stats, name='activity_stats'),  # GET messages per hour/day, top rooms and users
+    path('stats/memory/', memory_stats, name='memory_stats'),  # GET RSS and top allocation sites of this worker
+    path('stats/memory/diff/', memory_diff, name='memory_diff'),  # GET allocation growth since startup/last sample
     
     # Dynamic room access (legacy support)
     path('<str:room_name>/', chat_view, name='room'),  # Access specific room by name (e.g., /chat/general/)
@@ -44,8 +72,27 @@ urlpatterns = [
 # 3. 'send/' - AJAX endpoint for sending messages
 # 4. 'messages/' - AJAX endpoint for getting messages (polling)
 # 5. 'room/<int:room_id>/messages/' - Get messages for specific room by ID
-# 6. 'create-room/' - Create new chat rooms
-# 7. 'join-room/<int:room_id>/' - Join existing room by ID
-# 8. 'register/' - User registration functionality
-# 9. 'users/' - Get list of users for room management
-# 10. '<str:room_name>/' - Access rooms by name (catch-all pattern)
\ No newline at end of file
+# 6. 'room/<int:room_id>/changes/' - Change feed: messages created, edited or deleted after a sequence number
+# 7. 'room/<int:room_id>/messages/<int:message_id>/edit/' - Edit own message (author or staff)
+# 8. 'room/<int:room_id>/messages/<int:message_id>/delete/' - Delete own message, leaving a tombstone
+# 9. 'room/<int:room_id>/typing/' - Publish typing indicators (memory only, no DB writes)
+# 10. 'uploads/' - Start a chunked, resumable file upload
+# 11. 'uploads/<uuid:upload_id>/' - Upload progress (GET) and chunks (PUT with X-Upload-Offset)
+# 12. 'attachments/<int:attachment_id>/' - Download a file sent to one of the user's rooms (Range requests supported)
+# 13. 'sync/' - New messages, last message and unread counts for all of the user's rooms
+# 14. 'create-room/' - Create new chat rooms
+# 15. 'join-room/<int:room_id>/' - Join existing room by ID
+# 16. 'dm/<int:user_id>/' - Canonical direct-message room with a user (created on first use)
+# 17. 'room/<int:room_id>/members/' - Members page by page (?q= prefix search, ?after= cursor) and the member count
+# 18. 'room/<int:room_id>/members/add/' - Add many members in batches (room creator or staff)
+# 19. 'room/<int:room_id>/members/remove/' - Remove many members in batches, or leave the room
+# 20. 'register/' - User registration functionality
+# 21. 'users/' - Get list of users for room management
+# 22. 'presence/' - Online user ids served from memory
+# 23. 'stats/hashing/' - Password hashing pool statistics for this worker (staff only)
+# 24. 'stats/profiles/' - Profiles of slow or X-Chat-Profile requests kept by this worker (staff only)
+# 25. 'stats/profiles/<int:profile_id>/' - One profile as JSON or folded stacks for flame graphs (staff only)
+# 26. 'stats/activity/' - Messages per hour or day and the most active rooms and users, from precomputed rollups (staff only)
+# 27. 'stats/memory/' - Memory samples (RSS, top allocation sites) of the worker answering (staff only)
+# 28. 'stats/memory/diff/' - Allocation sites that grew since the worker's first or previous snapshot (staff only)
+# 29. '<str:room_name>/' - Access rooms by name (catch-all pattern)
\ No newline at end of file
@@ -1,14 +1,127 @@
 # Import necessary Django modules and Python libraries
-from django.shortcuts import render, get_object_or_404  # For rendering templates and safe object retrieval
-from django.http import JsonResponse  # For sending JSON responses to AJAX requests
+from django.shortcuts import render  # For rendering templates
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse  # JSON for AJAX, files for attachments
+from django.views.decorators.http import require_http_methods  # Upload chunks are PUT requests
 from django.views.decorators.csrf import csrf_exempt  # To exempt views from CSRF protection (not used)
 from django.views.decorators.http import require_POST  # To ensure view only accepts POST requests
 from django.contrib.auth.decorators import login_required  # To require user authentication
 from django.contrib.auth.models import User  # Built-in Django User model
-from django.contrib.auth import login, authenticate  # For user authentication functions
-from django.contrib.auth.forms import UserCreationForm  # Built-in user registration form
+from django.contrib.auth import login  # For logging users in after registration
+from django.contrib.auth.decorators import user_passes_test  # Staff-only operational endpoints
 import json  # For handling JSON data
-from .models import Message, ChatRoom, UserProfile  # Import our custom models
+from collections import defaultdict  # Sync results grouped by room
+import os  # Process id in per-worker statistics
+from .models import Message, ChatRoom, UserProfile, Attachment, Upload  # Import our custom models
+from django.conf import settings  # Project settings (cache timeouts)
+from django.db import transaction  # Messages and their event log entries commit together
+from django.db.models import Case, Count, F, Max, OuterRef, Q, Subquery, When, Window  # Query expressions for previews and sync
+from django.db.models.functions import RowNumber  # Per-room ranking of new messages
+from . import cache as chat_cache  # Cached room metadata and membership lookups
+from . import presence  # In-memory presence tracking (heartbeats, online status)
+from . import events  # Ephemeral typing/activity events (shared cache only)
+from . import hashing  # Password hashing on a bounded thread pool
+from . import profiling  # Kept request profiles
+from . import memory  # Allocation samples of this worker
+from . import sharding  # Which database holds a room's messages
+from . import changes  # Message edits/deletions and the change feed
+from . import rooms  # Canonical direct-message rooms
+from . import attachments  # Chunked uploads and content-addressed file storage
+from . import rendering  # Stored message HTML and previews
+from . import rollups  # Precomputed activity counts for the staff report
+from .middleware import hashing_busy  # 503 response when the hashing pool is saturated
+
+def serialize_message(msg):
+    """
+    Convert a room message into the JSON shape used by the chat endpoints.
+    Messages with a file also carry 'attachment' (load them with
+    attachments.prefetch() first).
+    
+    'content' is the text as written; clients display 'html', which was
+    escaped and formatted once when the message was saved (chat/rendering.py).
+    
+    Args:
+        msg: Message instance
+        
+    Returns:
+        Dictionary ready for JsonResponse
+    """
+    return {
+        'id': msg.id,                                # Message ID (clients track the last one seen)
+        'username': msg.username,                    # Sender's display name
+        'content': msg.content,                      # Message content
+        'html': rendering.stored(msg)[0],            # Safe HTML of the content (stored, not rendered per request)
+        'timestamp': msg.timestamp.isoformat(),      # ISO timestamp
+        'user_id': msg.user_id,                      # User ID for styling own messages
+        **({'attachment': attachments.describe(msg)} if msg.attachment_id else {}),  # File details, if any
+    }
+
+def serialize_message_compact(msg):
+    """
+    Compact variant of serialize_message() for clients that ask for it with
+    ?compact=1 (see whatsapp.js expandMessage()).
+    
+    Keys are shortened (i=id, u=username, c=content, h=html, t=timestamp,
+    s=user_id, a=attachment), the timestamp is epoch milliseconds and null values are
+    left out.
+    
+    Args:
+        msg: Message instance
+        
+    Returns:
+        Dictionary ready for JsonResponse
+    """
+    data = {
+        'i': msg.id,
+        'u': msg.username,
+        'c': msg.content,
+        'h': rendering.stored(msg)[0],
+        't': int(msg.timestamp.timestamp() * 1000),
+        's': msg.user_id,
+        'a': attachments.describe(msg) if msg.attachment_id else None,
+    }
+    return {key: value for key, value in data.items() if value is not None}
+
+def serialize_change(msg, compact=False):
+    """
+    Convert a message into a change feed entry: the message plus its change
+    sequence number, edit time and, for tombstones, the deleted flag.
+    
+    Args:
+        msg: Message instance
+        compact: Use the ?compact=1 schema (q=seq, e=edited_at, d=deleted)
+        
+    Returns:
+        Dictionary ready for JsonResponse
+    """
+    if compact:
+        data = serialize_message_compact(msg)
+        data['q'] = msg.seq
+        if msg.edited_at:
+            data['e'] = int(msg.edited_at.timestamp() * 1000)
+        if msg.deleted_at:
+            data['d'] = 1
+            data.pop('c', None)
+            data.pop('h', None)
+        return data
+    data = serialize_message(msg)
+    data['seq'] = msg.seq
+    data['edited_at'] = msg.edited_at.isoformat() if msg.edited_at else None
+    data['deleted'] = msg.deleted_at is not None
+    if data['deleted']:
+        data['content'] = data['html'] = None
+    return data
+
+def wants_compact(request):
+    """True when the client asked for the compact message schema."""
+    return request.GET.get('compact') == '1'
+
+def message_json_response(request, data, **kwargs):
+    """
+    JsonResponse for message payloads, without whitespace in compact mode.
+    """
+    if wants_compact(request):
+        kwargs.setdefault('json_dumps_params', {'separators': (',', ':')})
+    return JsonResponse(data, **kwargs)
 
 def chat_view(request, room_name='global'):
     """
@@ -23,8 +136,9 @@ def chat_view(request, room_name='global'):
         Rendered chat template with messages and user context
     """
     # Get all messages ordered by timestamp (oldest first)
-    # This creates a chronological conversation flow
-    messages = Message.objects.order_by('timestamp')
+    # This creates a chronological conversation flow; with CHAT_SHARD_COUNT
+    # the messages of most rooms live on the shards, which are read as well
+    messages = sharding.all_messages() if sharding.SHARD_COUNT else Message.objects.order_by('timestamp')
     
     # Render the original chat template with context data
     return render(request, 'chat/index.html', {
@@ -33,6 +147,17 @@ def chat_view(request, room_name='global'):
         'user': request.user,    # Current user information
     })
 
+def _render_missing_previews(rooms):
+    """
+    Evaluate `rooms` and render the previews of last messages that were
+    never rendered, like rendering.stored() does for message lists.
+    """
+    rooms = list(rooms)
+    for room in rooms:
+        if room.last_message_unrendered is not None:
+            room.last_message_preview = rendering.render_preview(room.last_message_unrendered)
+    return rooms
+
 def whatsapp_view(request):
     """
     Main WhatsApp-like interface view.
@@ -49,18 +174,68 @@ def whatsapp_view(request):
         # Get or create user profile for additional user data
         # This ensures every authenticated user has a profile
         profile, created = UserProfile.objects.get_or_create(user=request.user)
+
+        # Opening the interface counts as a presence heartbeat
+        presence.record(request)
         
         # Get all chat rooms where the user is a member
         # Ordered by creation date (newest first) for better UX
-        chat_rooms = request.user.chat_rooms.all().order_by('-created_at')
+        # The last message preview is annotated so the sidebar needs one query;
+        # the queryset is lazy and is not evaluated at all when the cached
+        # sidebar fragment is still valid
+        if sharding.SHARD_COUNT:
+            # Messages may live on other databases, so previews are attached per
+            # shard instead; passing a callable keeps this lazy too (templates
+            # call it only when the fragment is rendered)
+            rooms = request.user.chat_rooms.order_by('-created_at')
+            chat_rooms = lambda: sharding.with_last_messages(rooms)
+        else:
+            # The text is only selected for rows never rendered (render_version 0),
+            # whose stored preview is still empty
+            last_message = Message.objects.filter(chat_room=OuterRef('pk'), deleted_at__isnull=True).order_by('-timestamp').annotate(
+                unrendered=Case(When(render_version=0, then='content')),
+            )
+            rooms = request.user.chat_rooms.annotate(
+                last_message_preview=Subquery(last_message.values('preview')[:1]),
+                last_message_unrendered=Subquery(last_message.values('unrendered')[:1]),
+                last_message_at=Subquery(last_message.values('timestamp')[:1]),
+                last_message_id=Subquery(last_message.values('id')[:1]),
+            ).order_by('-created_at')
+            chat_rooms = lambda: _render_missing_previews(rooms)
+
+        # Number of other members currently online in each room, from shared
+        # presence and cached member sets (rendered outside the cached fragment by whatsapp.js).
+        # Member sets of large groups are not loaded: their online members are
+        # counted with one query over the online users instead.
+        online_ids = presence.online_user_ids() - {request.user.id}
+        online_counts, large_room_ids = {}, []
+        for room_id in chat_cache.get_user_room_ids(request.user.id) if online_ids else ():
+            room = chat_cache.get_room(room_id)
+            if room is not None and room.member_count > settings.CHAT_LARGE_ROOM_MEMBERS:
+                large_room_ids.append(room_id)
+                continue
+            count = len(chat_cache.get_room_member_ids(room_id) & online_ids)
+            if count:
+                online_counts[room_id] = count
+        if large_room_ids:
+            online_counts.update(
+                ChatRoom.members.through.objects.filter(chatroom_id__in=large_room_ids, user_id__in=online_ids)
+                .values('chatroom_id').annotate(count=Count('id')).values_list('chatroom_id', 'count')
+            )
     else:
         # For anonymous users, show empty chat room list
+        profile = None
         chat_rooms = ChatRoom.objects.none()
+        online_counts = {}
 
     # Render the WhatsApp-style interface
     return render(request, 'chat/whatsapp.html', {
         'chat_rooms': chat_rooms,  # User's chat rooms for sidebar
         'user': request.user,      # Current user info
+        'profile': profile,        # Current user's profile (avatar) without an extra lookup
+        'sidebar_version': chat_cache.sidebar_version(request.user),  # Fragment cache key component
+        'sidebar_timeout': settings.CHAT_SIDEBAR_CACHE_TIMEOUT,  # Fragment cache lifetime
+        'online_counts': online_counts,  # room id -> other members online
     })
 
 @login_required  # Require authentication to send messages
@@ -70,6 +245,9 @@ def send_message(request):
     AJAX endpoint for sending chat messages.
     Handles message creation and storage in database.
     
+    A message may carry a file: post the 'attachment_id' returned by a
+    finished upload of the sender's (the text is optional then).
+    
     Args:
         request: HTTP POST request with message data
         
@@ -83,27 +261,46 @@ def send_message(request):
         # Extract chat room ID if message is for specific room
         chat_room_id = request.POST.get('chat_room_id')
 
+        # Optional attachment: only files the sender uploaded themselves can be attached
+        attachment_id = request.POST.get('attachment_id')
+        upload = None
+        if attachment_id:
+            upload = Upload.objects.filter(
+                user_id=request.user.id, attachment_id=attachment_id if attachment_id.isdigit() else None
+            ).order_by('-created_at').first()
+            if upload is None:
+                return JsonResponse({'success': False, 'error': 'Unknown attachment'}, status=400)
+
         # Only process non-empty messages
-        if message_content:
+        if message_content or upload:
             # Determine username: authenticated user's name or 'Anonymous'
             username = request.user.username if request.user.is_authenticated else 'Anonymous'
 
             # Get chat room object if room ID provided
-            chat_room = None
-            if chat_room_id:
-                try:
-                    chat_room = ChatRoom.objects.get(id=chat_room_id)
-                except ChatRoom.DoesNotExist:
-                    # If room doesn't exist, continue without room (legacy support)
-                    pass
-
-            # Create and save new message to database
-            Message.objects.create(
-                user=request.user if request.user.is_authenticated else None,  # Link to user if authenticated
-                username=username,        # Store username for display
-                content=message_content,  # Message text
-                chat_room=chat_room      # Link to specific chat room if applicable
-            )
+            # If room doesn't exist, continue without room (legacy support)
+            chat_room = chat_cache.get_room(chat_room_id) if chat_room_id else None
+
+            # Only members may post into a room (answered from the membership cache)
+            if chat_room is not None and not chat_cache.is_member(request.user, chat_room.id):
+                return JsonResponse({'success': False, 'error': 'Not a member of this chat room'}, status=403)
+
+            # Create and save new message to database (on the room's shard, if
+            # sharded); the 'message.created' event log entry (chat/signals.py)
+            # is written in the same transaction
+            with transaction.atomic():
+                Message.objects.create(
+                    user=request.user if request.user.is_authenticated else None,  # Link to user if authenticated
+                    username=username,        # Store username for display
+                    content=message_content,  # Message text
+                    chat_room_id=chat_room.id if chat_room else None,  # Link to specific chat room if applicable
+                    attachment_id=upload.attachment_id if upload else None,  # Stored file, if any
+                    attachment_name=upload.filename if upload else '',  # File name as uploaded
+                )
+
+            # Sending a message marks the sender as active and ends their typing indicator
+            presence.record(request)
+            if chat_room is not None:
+                events.channel.publish(chat_room.id, request.user.id, username, 'stopped')
 
             # Return success response for AJAX handler
             return JsonResponse({'success': True, 'message': 'Message sent'})
@@ -128,7 +325,8 @@ def get_messages(request):
     """
     try:
         # Get messages not linked to specific chat rooms (legacy system)
-        # Ordered by timestamp for chronological display
+        # Ordered by timestamp for chronological display. They always live in
+        # 'default': only messages of rooms are stored on shards
         messages = Message.objects.filter(chat_room__isnull=True).order_by('timestamp')
         
         # Convert message objects to JSON-serializable format
@@ -137,6 +335,7 @@ def get_messages(request):
             messages_data.append({
                 'username': msg.username,                    # Sender's username
                 'content': msg.content,                      # Message text
+                'html': rendering.stored(msg)[0],            # Safe HTML of the text (rendered when saved)
                 'timestamp': msg.timestamp.isoformat()       # ISO format timestamp for JavaScript
             })
 
@@ -152,6 +351,11 @@ def get_room_messages(request, room_id):
     AJAX endpoint for retrieving messages from a specific chat room.
     Used by the WhatsApp-style interface for real-time message loading.
     
+    Returns one page of history: the newest messages by default, or the
+    page before/after a message id (?before=<id> / ?after=<id>), with up to
+    ?limit= messages. 'more' tells whether further messages exist in that
+    direction; 'seq' is where to start following room_changes.
+    
     Args:
         request: HTTP request object
         room_id: ID of the chat room to get messages from
@@ -160,35 +364,450 @@ def get_room_messages(request, room_id):
         JSON response with room-specific message data
     """
     try:
-        # Get chat room object or return 404 if not found
-        chat_room = get_object_or_404(ChatRoom, id=room_id)
+        before = int(request.GET['before']) if 'before' in request.GET else None
+        after = int(request.GET['after']) if 'after' in request.GET else None
+        limit = min(max(int(request.GET.get('limit', changes.MESSAGE_PAGE_SIZE)), 1), 200)
+    except ValueError:
+        return JsonResponse({'error': 'before, after and limit must be integers'}, status=400)
+
+    try:
+        # Get chat room metadata from the cache or return 404 if not found
+        chat_room = chat_cache.get_room(room_id)
+        if chat_room is None:
+            return JsonResponse({'error': 'Chat room not found'}, status=404)
+
+        # Only members may read a room; the check is served from the membership cache
+        if not chat_cache.is_member(request.user, chat_room.id):
+            return JsonResponse({'error': 'Not a member of this chat room'}, status=403)
+
+        # Each poll doubles as a presence heartbeat (memory only, flushed in bulk)
+        presence.record(request)
         
-        # Get all messages for this specific room, ordered by time
-        messages = chat_room.messages.order_by('timestamp')
+        # Read the change sequence first: anything written while the page is
+        # loaded has a higher number, so the client's next room_changes call
+        # returns it rather than missing it
+        seq = changes.current_seq(chat_room.id)
+
+        # One page of the room's history, oldest first (deleted ones are tombstones)
+        messages, more = changes.message_page(chat_room.id, before=before, after=after, limit=limit)
+        attachments.prefetch(messages)
         
-        # Convert messages to JSON format
-        messages_data = []
-        for msg in messages:
-            messages_data.append({
-                'username': msg.username,                    # Sender's display name
-                'content': msg.content,                      # Message content
-                'timestamp': msg.timestamp.isoformat(),      # ISO timestamp
-                'user_id': msg.user.id if msg.user else None  # User ID for styling own messages
-            })
+        # Convert messages to JSON format (short keys when the client asks for them)
+        serialize = serialize_message_compact if wants_compact(request) else serialize_message
+        messages_data = [serialize(msg) for msg in messages]
 
-        # Return room messages as JSON
-        return JsonResponse({'messages': messages_data})
+        # Return room messages as JSON, plus live typing/activity events from other members
+        return message_json_response(request, {
+            'messages': messages_data,
+            'more': more,
+            'seq': seq,
+            'events': events.channel.poll(chat_room.id, exclude_user_id=request.user.id),
+        })
         
     except Exception as e:
         # Handle errors gracefully
         return JsonResponse({'error': str(e)})
 
+@login_required  # The change feed is only for room members
+def room_changes(request, room_id):
+    """
+    AJAX endpoint returning what changed in a room after a change sequence number.
+    
+    Every message sent, edited or deleted after ?since=N is returned once, in
+    its latest state (deleted messages as tombstones without content), ordered
+    by sequence number. Clients keep the last 'seq' they received and ask for
+    the next page while 'more' is true. Live typing/activity events are
+    included, so an open room needs only this one poll.
+    
+    Args:
+        request: HTTP request object (?since=<seq>, optional ?compact=1)
+        room_id: ID of the chat room
+        
+    Returns:
+        JSON response with the changes, the new 'seq' and 'more'
+    """
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return JsonResponse({'error': 'since must be an integer'}, status=400)
+
+    chat_room = chat_cache.get_room(room_id)
+    if chat_room is None:
+        return JsonResponse({'error': 'Chat room not found'}, status=404)
+    if not chat_cache.is_member(request.user, chat_room.id):
+        return JsonResponse({'error': 'Not a member of this chat room'}, status=403)
+
+    presence.record(request)
+
+    messages, more = changes.changes_since(chat_room.id, since)
+    attachments.prefetch(messages)
+    compact = wants_compact(request)
+    return message_json_response(request, {
+        'changes': [serialize_change(msg, compact) for msg in messages],
+        'seq': messages[-1].seq if messages else since,
+        'more': more,
+        'events': events.channel.poll(chat_room.id, exclude_user_id=request.user.id),
+    })
+
+def _own_room_message(request, room_id, message_id):
+    """
+    Load a message the requesting user may change, or build the error response.
+    
+    Returns:
+        (message, None) or (None, JsonResponse)
+    """
+    if not chat_cache.is_member(request.user, room_id):
+        return None, JsonResponse({'success': False, 'error': 'Not a member of this chat room'}, status=403)
+    message = sharding.room_messages(room_id).filter(id=message_id, deleted_at__isnull=True).first()
+    if message is None:
+        return None, JsonResponse({'success': False, 'error': 'Message not found'}, status=404)
+    if message.user_id != request.user.id and not request.user.is_staff:
+        return None, JsonResponse({'success': False, 'error': 'You can only change your own messages'}, status=403)
+    return message, None
+
+@login_required  # Only the author (or staff) may edit a message
+@require_POST  # The new content is posted like send_message
+def edit_message(request, room_id, message_id):
+    """
+    AJAX endpoint for editing a message's content.
+    
+    Args:
+        request: HTTP POST request with 'message' (the new content)
+        room_id: ID of the chat room
+        message_id: ID of the message to edit
+        
+    Returns:
+        JSON response with the new change sequence number
+    """
+    content = request.POST.get('message', '').strip()
+    if not content:
+        return JsonResponse({'success': False, 'error': 'Empty message'}, status=400)
+    message, error = _own_room_message(request, room_id, message_id)
+    if error:
+        return error
+    changes.edit_message(message, content)
+    return JsonResponse({'success': True, 'seq': message.seq})
+
+@login_required  # Only the author (or staff) may delete a message
+@require_POST  # Deletion changes state
+def delete_message(request, room_id, message_id):
+    """
+    AJAX endpoint for deleting a message (kept as a tombstone for the change feed).
+    
+    Args:
+        request: HTTP POST request
+        room_id: ID of the chat room
+        message_id: ID of the message to delete
+        
+    Returns:
+        JSON response with the new change sequence number
+    """
+    message, error = _own_room_message(request, room_id, message_id)
+    if error:
+        return error
+    changes.delete_message(message)
+    return JsonResponse({'success': True, 'seq': message.seq})
+
+@login_required  # Only signed-in users can upload files
+@require_POST  # Creates an upload
+def start_upload(request):
+    """
+    AJAX endpoint announcing a file upload.
+    
+    Request body (JSON): {"filename": ..., "size": <bytes>, "content_type": ...}
+    The file is then sent with PUT requests to upload_chunk.
+    
+    Returns:
+        JSON response with the upload ID, the offset to start at (0) and the
+        suggested chunk size
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+        upload = attachments.start_upload(
+            request.user, str(data.get('filename', '')), int(data.get('size', 0)), str(data.get('content_type', ''))
+        )
+    except (ValueError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Body must be {"filename", "size", "content_type"}'}, status=400)
+    except attachments.UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=e.status)
+    return JsonResponse({
+        'success': True,
+        'upload_id': str(upload.id),
+        'offset': 0,
+        'chunk_size': attachments.CHUNK_SIZE,
+    })
+
+@login_required  # Uploads belong to their user
+@require_http_methods(['GET', 'PUT'])  # GET = where to resume, PUT = next chunk
+def upload_chunk(request, upload_id):
+    """
+    Resumable upload endpoint.
+    
+    GET reports how many bytes the server has (resume from there). PUT
+    appends the request body at the offset given in the X-Upload-Offset
+    header; the body is streamed to disk, never read into memory. The
+    chunk completing the file turns it into an attachment.
+    
+    Args:
+        request: HTTP GET, or PUT with the raw chunk as body
+        upload_id: UUID returned by start_upload
+        
+    Returns:
+        JSON response with the current offset and, once complete, the attachment ID
+    """
+    upload = Upload.objects.filter(id=upload_id, user_id=request.user.id).first()
+    if upload is None:
+        return JsonResponse({'success': False, 'error': 'Upload not found'}, status=404)
+    if request.method == 'PUT':
+        try:
+            offset = int(request.headers.get('X-Upload-Offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'X-Upload-Offset header required'}, status=400)
+        try:
+            attachments.write_chunk(upload, offset, request, length)
+        except attachments.UploadError as e:
+            upload.refresh_from_db()
+            return JsonResponse({'success': False, 'error': str(e), 'offset': upload.received}, status=e.status)
+    return JsonResponse({
+        'success': True,
+        'offset': upload.received,
+        'size': upload.size,
+        'complete': upload.attachment_id is not None,
+        'attachment_id': upload.attachment_id,
+    })
+
+# Types browsers may display inline; everything else is downloaded as a file
+# so uploaded HTML/SVG/scripts can never run on this origin
+INLINE_CONTENT_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'video/', 'audio/', 'text/plain')
+
+def _can_read_attachment(user, attachment):
+    """
+    True if `user` uploaded the file or belongs to a room where it was sent
+    (one query per database holding the user's rooms).
+    """
+    if Upload.objects.filter(user_id=user.id, attachment_id=attachment.id).exists():
+        return True
+    for alias, room_ids in sharding.group_rooms(chat_cache.get_user_room_ids(user.id)).items():
+        if Message.objects.using(alias).filter(
+            attachment_id=attachment.id, chat_room_id__in=room_ids, deleted_at__isnull=True
+        ).exists():
+            return True
+    return False
+
+@login_required  # Files are only visible to the rooms they were sent to
+def attachment_download(request, attachment_id):
+    """
+    Serve an attachment (or its thumbnail with ?thumbnail=1).
+    
+    Whole files are FileResponses, which the WSGI server sends with
+    sendfile() without copying through Python. Range requests get 206
+    responses streamed in small blocks. With
+    settings.CHAT_ATTACHMENT_SENDFILE_HEADER (e.g. X-Accel-Redirect) the
+    front proxy serves the file, ranges included. Content is immutable,
+    so the SHA-256 doubles as a strong ETag.
+    
+    Args:
+        request: HTTP request object (optional Range / If-None-Match headers)
+        attachment_id: ID of the attachment
+        
+    Returns:
+        The file (200/206), 304 when unchanged, 416 for bad ranges
+    """
+    attachment = Attachment.objects.filter(id=attachment_id).first()
+    if attachment is None or not _can_read_attachment(request.user, attachment):
+        return JsonResponse({'error': 'Attachment not found'}, status=404)
+
+    thumbnail = request.GET.get('thumbnail') == '1' and attachment.has_thumbnail
+    path = attachments.thumbnail_path(attachment.sha256) if thumbnail else attachments.blob_path(attachment.sha256)
+    content_type = 'image/jpeg' if thumbnail else attachment.content_type
+    etag = f'"{attachment.sha256}{"-thumb" if thumbnail else ""}"'
+    inline = content_type.startswith(INLINE_CONTENT_TYPES)
+    if not inline:
+        content_type = 'application/octet-stream'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'X-Content-Type-Options': 'nosniff',
+        'Content-Security-Policy': "default-src 'none'; sandbox",
+        'Accept-Ranges': 'bytes',
+    }
+
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    elif settings.CHAT_ATTACHMENT_SENDFILE_HEADER:
+        # The proxy reads the file from its internal location and handles Range itself
+        response = HttpResponse(content_type=content_type)
+        internal = path.relative_to(attachments.ROOT).as_posix()
+        response[settings.CHAT_ATTACHMENT_SENDFILE_HEADER] = settings.CHAT_ATTACHMENT_SENDFILE_PREFIX + internal
+    else:
+        size = path.stat().st_size
+        if_range = request.headers.get('If-Range')
+        try:
+            byte_range = None if if_range and if_range != etag else attachments.parse_range(request.headers.get('Range'), size)
+        except attachments.UploadError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(attachments.read_range(path, start, end), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+    for name, value in headers.items():
+        response[name] = value
+    if not inline and response.status_code != 304:
+        response['Content-Disposition'] = 'attachment'
+    return response
+
+@login_required  # Sync covers the signed-in user's own rooms
+@require_POST  # The room map is sent as a JSON body
+def sync(request):
+    """
+    Multiplexed AJAX endpoint covering every room the user belongs to.
+    Replaces polling get_room_messages per room (or reloading whatsapp_view)
+    to learn about activity elsewhere.
+    
+    Request body (JSON):
+        {"rooms": {"<room_id>": <last seen message id>, ...}}
+        Rooms missing from the map are treated as never seen (last id 0).
+    
+    Each room in the response carries the new messages (at most
+    CHAT_SYNC_MESSAGES_PER_ROOM, newest kept, with "truncated" set when
+    older ones were dropped), the last message summary and the unread
+    count (messages from others after the last seen id). Deleted messages
+    are left out; edits and deletions reach clients through room_changes.
+    
+    With ?compact=1 messages use serialize_message_compact() and empty
+    fields (no messages, not truncated, no last message, nothing unread)
+    are left out of each room. With ?messages=0 only the last message and
+    the unread count are returned (the sidebar needs nothing else).
+    
+    The work is three queries per CHAT_SYNC_ROOM_BATCH rooms (per database
+    when messages are sharded): new messages (windowed per room), per-room
+    aggregates, and the last message rows not already loaded. Membership
+    comes from the cache.
+    
+    Args:
+        request: HTTP POST request with a JSON body
+        
+    Returns:
+        JSON response keyed by room id
+    """
+    try:
+        payload = json.loads(request.body or b'{}')
+        seen = {int(room_id): int(last_id) for room_id, last_id in (payload.get('rooms') or {}).items()}
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Body must be {"rooms": {room_id: last_seen_id}}'}, status=400)
+
+    presence.record(request)
+
+    room_ids = chat_cache.get_user_room_ids(request.user.id)
+    if not room_ids:
+        return JsonResponse({'rooms': {}})
+    limit = settings.CHAT_SYNC_MESSAGES_PER_ROOM
+    with_messages = request.GET.get('messages') != '0'
+    batch_size = settings.CHAT_SYNC_ROOM_BATCH
+
+    new_messages, stats, by_id = defaultdict(list), {}, {}
+    # One round per database holding some of the rooms (just 'default' unless
+    # sharded) and per batch of rooms, keeping the OR-ed condition small
+    batches = [
+        (alias, alias_room_ids[start:start + batch_size])
+        for alias, alias_room_ids in sharding.group_rooms(sorted(room_ids)).items()
+        for start in range(0, len(alias_room_ids), batch_size)
+    ]
+    for alias, alias_room_ids in batches:
+        queryset = Message.objects.using(alias).filter(deleted_at__isnull=True)
+
+        # "After the last seen id" for every room of the batch, as one OR-ed condition
+        after_seen = Q()
+        for room_id in alias_room_ids:
+            after_seen |= Q(chat_room_id=room_id, id__gt=seen.get(room_id, 0))
+
+        # Query 1: new messages, newest `limit` per room via ROW_NUMBER()
+        alias_new = []
+        if with_messages:
+            alias_new = list(
+                queryset.filter(after_seen)
+                .annotate(rank=Window(RowNumber(), partition_by=F('chat_room_id'), order_by=F('id').desc()))
+                .filter(rank__lte=limit)
+                .order_by('chat_room_id', 'id')
+            )
+        for msg in alias_new:
+            new_messages[msg.chat_room_id].append(msg)
+
+        # Query 2: per-room last message id, new message and unread counts
+        alias_stats = (
+            queryset.filter(chat_room_id__in=alias_room_ids)
+            .values('chat_room_id')
+            .annotate(
+                last_id=Max('id'),
+                new=Count('id', filter=after_seen),
+                unread=Count('id', filter=after_seen & ~Q(user_id=request.user.id)),
+            )
+        )
+        alias_stats = {row['chat_room_id']: row for row in alias_stats}
+        stats.update(alias_stats)
+
+        # Query 3: last message rows that query 1 did not already return
+        by_id.update((msg.id, msg) for msg in alias_new)
+        missing = [row['last_id'] for row in alias_stats.values() if row['last_id'] not in by_id]
+        if missing:
+            by_id.update((msg.id, msg) for msg in queryset.filter(id__in=missing))
+
+    compact = wants_compact(request)
+    serialize = serialize_message_compact if compact else serialize_message
+    attachments.prefetch(list(by_id.values()))  # by_id holds every message serialized below
+    rooms = {}
+    for room_id in room_ids:
+        row = stats.get(room_id)
+        messages = [serialize(msg) for msg in new_messages.get(room_id, ())]
+        room = {
+            'messages': messages,
+            'truncated': with_messages and bool(row) and row['new'] > len(messages),
+            'last_message': serialize(by_id[row['last_id']]) if row else None,
+            'unread': row['unread'] if row else 0,
+        }
+        rooms[room_id] = {key: value for key, value in room.items() if value} if compact else room
+    return message_json_response(request, {'rooms': rooms})
+
+@login_required  # Only signed-in members can signal activity
+@require_POST  # Events are published with POST
+def room_event(request, room_id):
+    """
+    AJAX endpoint for publishing an ephemeral room event (typing indicator).
+    Events live only in the shared cache and are delivered with the next message poll.
+    
+    Args:
+        request: HTTP POST request with optional 'event' (typing, active or stopped)
+        room_id: ID of the chat room the event belongs to
+        
+    Returns:
+        JSON response telling whether a new event was broadcast or coalesced
+    """
+    kind = request.POST.get('event', 'typing')
+    if kind not in events.EVENT_KINDS:
+        return JsonResponse({'success': False, 'error': 'Unknown event'}, status=400)
+
+    # Membership is answered from the cache so typing costs no database query
+    if not chat_cache.is_member(request.user, room_id):
+        return JsonResponse({'success': False, 'error': 'Not a member of this chat room'}, status=403)
+
+    event = events.channel.publish(int(room_id), request.user.id, request.user.username, kind)
+    return JsonResponse({'success': True, 'broadcast': event is not None})
+
 @require_POST  # Only accept POST requests for security
 def create_chat_room(request):
     """
     AJAX endpoint for creating new chat rooms.
     Allows users to create both individual and group chats.
     
+    An individual chat posted with 'user_id' is the canonical direct-message
+    room with that user (see direct_room): it is only created once per pair.
+    
     Args:
         request: HTTP POST request with room creation data
         
@@ -204,6 +823,11 @@ def create_chat_room(request):
         name = request.POST.get('name', '').strip()           # Room name
         description = request.POST.get('description', '').strip()  # Optional description
         is_group = request.POST.get('is_group') == 'true'     # Group vs individual chat
+        user_id = request.POST.get('user_id')                 # Other participant of a direct chat
+
+        # A direct chat with a given user reuses the canonical DM room (name optional)
+        if user_id and not is_group:
+            return _direct_room_response(request, user_id, name=name, description=description)
 
         # Validate required fields
         if not name:
@@ -231,6 +855,129 @@ def create_chat_room(request):
         # Handle any creation errors
         return JsonResponse({'success': False, 'error': str(e)})
 
+def _direct_room_response(request, user_id, name=None, description=''):
+    """
+    Get or create the DM room between the requesting user and `user_id`.
+    
+    Returns:
+        JSON response with the room ID and whether it was just created
+    """
+    other = User.objects.filter(id=user_id).first() if str(user_id).isdigit() else None
+    if other is None:
+        return JsonResponse({'success': False, 'error': 'User not found'}, status=404)
+    chat_room, created = rooms.get_or_create_direct_room(request.user, other, name=name, description=description)
+    return JsonResponse({
+        'success': True,
+        'room_id': chat_room.id,   # Existing or new room ID for frontend
+        'created': created,        # False when the DM already existed
+        'message': 'Chat room created successfully' if created else 'Chat room already exists',
+    })
+
+@login_required  # Direct chats are between the signed-in user and someone else
+@require_POST  # May create a room
+def direct_room(request, user_id):
+    """
+    AJAX endpoint returning the direct-message room with another user,
+    creating it on first use. Repeated or concurrent calls for the same
+    pair of users always return the same room.
+    
+    Args:
+        request: HTTP POST request
+        user_id: ID of the other participant
+        
+    Returns:
+        JSON response with the room ID and whether it was just created
+    """
+    return _direct_room_response(request, user_id)
+
+@login_required  # Member lists are only visible to members
+def room_members(request, room_id):
+    """
+    AJAX endpoint listing a room's members one page at a time.
+    
+    Members are ordered by user id and paged with ?after=<next from the
+    previous page>, so every page costs the same however large the group
+    is. ?q= filters by username prefix.
+    
+    Args:
+        request: HTTP request object (?q=, ?after=, ?limit= up to 200)
+        room_id: ID of the chat room
+        
+    Returns:
+        JSON response with the page of members, the member count and 'next'
+    """
+    chat_room = chat_cache.get_room(room_id)
+    if chat_room is None:
+        return JsonResponse({'error': 'Chat room not found'}, status=404)
+    if not chat_cache.is_member(request.user, chat_room.id):
+        return JsonResponse({'error': 'Not a member of this chat room'}, status=403)
+    try:
+        after = int(request.GET.get('after', 0))
+        limit = min(max(int(request.GET.get('limit', rooms.MEMBER_PAGE_SIZE)), 1), 200)
+    except ValueError:
+        return JsonResponse({'error': 'after and limit must be integers'}, status=400)
+
+    members, next_after = rooms.member_page(chat_room.id, request.GET.get('q', '').strip(), after, limit)
+    online_ids = presence.online_user_ids(user_id for user_id, _ in members)
+    return JsonResponse({
+        'members': [
+            {'id': user_id, 'username': username, 'is_online': user_id in online_ids}
+            for user_id, username in members
+        ],
+        'count': chat_room.member_count,  # Maintained on add/remove, no COUNT query
+        'next': next_after,                # Pass as ?after= for the next page (None on the last one)
+    })
+
+def _change_members(request, room_id, change):
+    """
+    Shared body of the bulk add/remove endpoints.
+    
+    Only the room's creator and staff may change other people's membership;
+    anyone may remove themselves (leave the room).
+    """
+    chat_room = ChatRoom.objects.filter(id=room_id).first()
+    if chat_room is None:
+        return JsonResponse({'success': False, 'error': 'Chat room not found'}, status=404)
+    try:
+        user_ids = {int(user_id) for user_id in json.loads(request.body or b'{}')['user_ids']}
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({'success': False, 'error': 'Body must be {"user_ids": [id, ...]}'}, status=400)
+    leaving = change is rooms.remove_members and user_ids == {request.user.id}
+    if not (leaving or chat_room.created_by_id == request.user.id or request.user.is_staff):
+        return JsonResponse({'success': False, 'error': 'Only the room creator can change members'}, status=403)
+    if change is rooms.add_members and not all(rooms.may_join(chat_room, user_id) for user_id in user_ids):
+        return JsonResponse({'success': False, 'error': 'Direct message rooms cannot get other members'}, status=400)
+    changed = change(chat_room, user_ids)
+    return JsonResponse({'success': True, 'changed': changed})
+
+@login_required  # Bulk membership changes need an owner
+@require_POST  # JSON body with the user ids
+def add_room_members(request, room_id):
+    """
+    AJAX endpoint adding many users to a room at once.
+    
+    Request body (JSON): {"user_ids": [id, ...]}. Inserts are batched;
+    unknown users and existing members are skipped.
+    
+    Returns:
+        JSON response with the number of members added
+    """
+    return _change_members(request, room_id, rooms.add_members)
+
+@login_required  # Bulk membership changes need an owner
+@require_POST  # JSON body with the user ids
+def remove_room_members(request, room_id):
+    """
+    AJAX endpoint removing many users from a room at once.
+    
+    Request body (JSON): {"user_ids": [id, ...]}. Members may also post
+    just their own id to leave the room.
+    
+    Returns:
+        JSON response with the number of members removed
+    """
+    return _change_members(request, room_id, rooms.remove_members)
+
 @require_POST  # Only accept POST requests
 def join_chat_room(request, room_id):
     """
@@ -250,10 +997,17 @@ def join_chat_room(request, room_id):
             return JsonResponse({'success': False, 'error': 'Authentication required'})
 
         # Get the chat room or return 404 if not found
-        chat_room = get_object_or_404(ChatRoom, id=room_id)
+        chat_room = chat_cache.get_room(room_id)
+        if chat_room is None:
+            return JsonResponse({'success': False, 'error': 'Chat room not found'}, status=404)
+
+        # Direct-message rooms are private to their two participants
+        if not rooms.may_join(chat_room, request.user.id):
+            return JsonResponse({'success': False, 'error': 'Chat room not found'}, status=404)
         
-        # Add current user to room's member list
-        # Django's ManyToManyField automatically handles duplicates
+        # Add current user to room's member list. add() inserts only missing
+        # rows, so it is not guarded by the cached membership set, which may
+        # be stale; the m2m_changed signal invalidates that set
         chat_room.members.add(request.user)
 
         # Return success confirmation
@@ -275,25 +1029,31 @@ def register_view(request):
         For GET: Rendered registration template
         For POST: JSON response (AJAX) or redirect (regular form)
     """
+    # Imported here so the auth forms stay off the cold-start import path
+    from django.contrib.auth.forms import UserCreationForm  # Built-in user registration form
+
     if request.method == 'POST':
         # Handle registration form submission
         form = UserCreationForm(request.POST)
         
         # Validate form data
         if form.is_valid():
+            # Hash the password once, on the bounded pool; form.save() would hash it
+            # on this thread and authenticate() would then hash it a second time
+            user = form.instance  # Populated from the form data during validation
+            try:
+                hashing.set_password(user, form.cleaned_data['password1'])
+            except hashing.HashingBusy as busy:
+                return hashing_busy(request, busy)
+
             # Save new user to database
-            user = form.save()
+            user.save()
             
             # Create associated user profile for additional data
             UserProfile.objects.create(user=user)
             
-            # Extract credentials for automatic login
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password1')
-            
-            # Authenticate and log in the new user
-            user = authenticate(username=username, password=password)
-            login(request, user)
+            # The password was just set, so log in directly without re-checking it
+            login(request, user, backend='chat.backends.BoundedHashingBackend')
             
             # Return JSON response for AJAX requests
             return JsonResponse({'success': True, 'redirect': '/chat/whatsapp/'})
@@ -304,6 +1064,124 @@ def register_view(request):
     # For GET requests, display the registration form
     return render(request, 'registration/register.html', {'form': UserCreationForm()})
 
+@user_passes_test(lambda u: u.is_staff)  # Operational data for staff only
+def hashing_stats(request):
+    """
+    Report the password hashing pool's queue depth and timings.
+    
+    Returns:
+        JSON response with this worker's chat.hashing statistics
+    """
+    return JsonResponse(hashing.executor.stats())
+
+@user_passes_test(lambda u: u.is_staff)  # Operational data for staff only
+def profile_list(request):
+    """
+    List the request profiles kept by this worker, newest first.
+    
+    Returns:
+        JSON response with one summary (path, duration, samples, SQL totals) per profile
+    """
+    return JsonResponse({
+        'slow_ms': profiling.SLOW_MS,
+        'profiles': [profile.summary() for profile in profiling.sampler.recent()],
+    })
+
+@user_passes_test(lambda u: u.is_staff)  # Operational data for staff only
+def profile_detail(request, profile_id):
+    """
+    Return one kept profile with its stack samples and SQL.
+    
+    Args:
+        request: HTTP request object (?format=folded for flame graph input)
+        profile_id: Id from profile_list or the X-Chat-Profile-Id header
+        
+    Returns:
+        JSON response, or text/plain folded stacks ("frame;frame;frame count" lines)
+    """
+    profile = profiling.sampler.get(profile_id)
+    if profile is None:
+        return JsonResponse({'error': 'Profile not found (profiles are kept per worker)'}, status=404)
+    if request.GET.get('format') == 'folded':
+        return HttpResponse(profile.folded(), content_type='text/plain; charset=utf-8')
+    return JsonResponse(profile.as_dict())
+
+@user_passes_test(lambda u: u.is_staff)  # Operational data for staff only
+def activity_stats(request):
+    """
+    Report message activity per hour or day, read from the precomputed rollups.
+    
+    Args:
+        request: HTTP request object (?period=hour|day, ?days=, optional
+            ?room_id= or ?user_id= to restrict the series, ?limit= for the top lists)
+        
+    Returns:
+        JSON response with the series, top rooms and users and the rollup lag
+    """
+    period = request.GET.get('period', 'day')
+    if period not in rollups.PERIODS:
+        return JsonResponse({'error': 'period must be hour or day'}, status=400)
+    try:
+        days = int(request.GET['days']) if 'days' in request.GET else None
+        room_id = int(request.GET['room_id']) if 'room_id' in request.GET else None
+        user_id = int(request.GET['user_id']) if 'user_id' in request.GET else None
+        limit = min(int(request.GET.get('limit', 10)), 100)
+    except ValueError:
+        return JsonResponse({'error': 'days, room_id, user_id and limit must be integers'}, status=400)
+    if (days is not None and days < 1) or limit < 1:
+        return JsonResponse({'error': 'days and limit must be positive'}, status=400)
+    return JsonResponse(rollups.activity_report(period, days, room_id=room_id, user_id=user_id, limit=limit))
+
+@user_passes_test(lambda u: u.is_staff)  # Operational data for staff only
+def memory_stats(request):
+    """
+    Report this worker's memory samples (RSS, traced memory, top allocation sites).
+    
+    Args:
+        request: HTTP request object (?sample=1 takes a fresh sample first)
+        
+    Returns:
+        JSON response with the monitor settings and the samples, newest first
+    """
+    monitor = memory.monitor
+    if request.GET.get('sample') == '1':
+        monitor.sample()
+    return JsonResponse({
+        'pid': os.getpid(),
+        'tracing': monitor.trace,
+        'interval': monitor.interval,
+        'recycle_mb': monitor.recycle_bytes // memory.MB,
+        'rss': memory.rss_bytes(),
+        'samples': monitor.history(),
+    })
+
+@user_passes_test(lambda u: u.is_staff)  # Operational data for staff only
+def memory_diff(request):
+    """
+    Compare this worker's latest allocation snapshot with an earlier one.
+    
+    Args:
+        request: HTTP request object (?against=baseline|previous,
+            ?group=lineno|traceback, ?limit=)
+        
+    Returns:
+        JSON response with the allocation sites that grew or shrank the most
+    """
+    against = request.GET.get('against', 'baseline')
+    group = request.GET.get('group', 'lineno')
+    if against not in ('baseline', 'previous') or group not in ('lineno', 'traceback'):
+        return JsonResponse({'error': 'against must be baseline or previous, group lineno or traceback'}, status=400)
+    try:
+        limit = min(int(request.GET.get('limit', memory.TOP)), 500)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    if not memory.monitor.trace:
+        return JsonResponse({'error': 'Allocation tracing is off (CHAT_MEMORY_MONITOR=True enables it)'}, status=404)
+    sites = memory.monitor.diff(against, group, limit)
+    if sites is None:
+        return JsonResponse({'error': 'Not enough snapshots yet (try again after a sample)'}, status=404)
+    return JsonResponse({'pid': os.getpid(), 'against': against, 'group': group, 'sites': sites})
+
 def get_users(request):
     """
     AJAX endpoint for retrieving list of users.
@@ -318,7 +1196,10 @@ def get_users(request):
     try:
         # Get all users except the current user (if authenticated)
         # This prevents users from seeing themselves in selection lists
-        users = User.objects.exclude(id=request.user.id if request.user.is_authenticated else None)
+        # Profiles are joined in the same query instead of one lookup per user
+        users = User.objects.exclude(
+            id=request.user.id if request.user.is_authenticated else None
+        ).select_related('userprofile')
         
         # Convert user objects to JSON format
         users_data = []
@@ -331,7 +1212,7 @@ def get_users(request):
                 'username': user.username,                               # Username
                 'full_name': user.get_full_name() or user.username,     # Full name or username fallback
                 'avatar': profile.avatar if profile else '👤',          # User avatar or default emoji
-                'is_online': profile.is_online if profile else False    # Online status
+                'is_online': presence.is_online_profile(user.id, profile)  # Online status (memory first)
             })
 
         # Return user list as JSON
@@ -340,3 +1221,18 @@ def get_users(request):
     except Exception as e:
         # Handle any errors
         return JsonResponse({'error': str(e)})
+
+@login_required  # Presence is only shared with signed-in users
+def get_presence(request):
+    """
+    AJAX endpoint returning the users online on any worker.
+    Also acts as an explicit heartbeat for clients that are idle in a room.
+    
+    Args:
+        request: HTTP request object
+        
+    Returns:
+        JSON response with the list of online user ids
+    """
+    presence.record(request)
+    return JsonResponse({'online_user_ids': sorted(presence.online_user_ids())})
@@ -0,0 +1,65 @@
+# Gunicorn configuration for Nisha (loaded automatically from the project root,
+# or explicitly with `gunicorn -c gunicorn.conf.py`)
+#
+# The chat UI polls every few seconds and the homepage waits on an external
+# weather API, so most request time is spent waiting, not computing. With the
+# default sync workers each of those waits holds a whole process; threaded
+# workers let one process serve other requests meanwhile.
+#
+# Environment variables:
+#   WEB_CONCURRENCY          Number of worker processes (default: derived from CPU count)
+#   GUNICORN_WORKER_MODE     'gthread' (default), 'sync' or 'asgi'
+#   GUNICORN_THREADS         Threads per gthread worker (default 4)
+#   GUNICORN_KEEPALIVE       Seconds to keep idle client connections open (default 5)
+#   GUNICORN_MAX_REQUESTS    Recycle a worker after this many requests (default 1000, 0 disables)
+#   GUNICORN_TIMEOUT         Seconds before a silent worker is killed and restarted (default 30)
+#   GUNICORN_PRELOAD         'True' to import the app once in the master before forking (default)
+#   PORT                     Port to bind (set by Render/Heroku)
+#
+# Measure changes with `python manage.py loadtest` (see chat/management/commands/loadtest.py).
+
+import multiprocessing
+import os
+
+cpu_count = multiprocessing.cpu_count()
+worker_mode = os.environ.get('GUNICORN_WORKER_MODE', 'gthread')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+if worker_mode == 'asgi':
+    # Requires `pip install uvicorn`. Django runs our sync views in a thread
+    # pool under ASGI, so this mode is meant for future streaming endpoints
+    # rather than for raw polling throughput.
+    wsgi_app = 'Nisha.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    default_workers = cpu_count + 1
+elif worker_mode == 'sync':
+    wsgi_app = 'Nisha.wsgi:application'
+    worker_class = 'sync'
+    # Classic (2 x CPU) + 1: sync workers handle one request at a time
+    default_workers = cpu_count * 2 + 1
+else:
+    wsgi_app = 'Nisha.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+    # Threads provide the concurrency, so fewer processes (less memory) are needed
+    default_workers = cpu_count + 1
+
+workers = int(os.environ.get('WEB_CONCURRENCY', default_workers))
+
+# Idle keep-alive connections let the browser reuse one TCP/TLS connection for
+# every poll; only threaded/async workers can hold them without blocking
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers periodically to cap slow memory growth; the jitter keeps all
+# workers from restarting at the same moment. CHAT_MEMORY_RECYCLE_MB (settings)
+# additionally recycles any worker whose RSS passes a threshold.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max(1, max_requests // 10) if max_requests else 0
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+
+# Import Django once in the master so workers fork with settings, URLconf and
+# views already loaded (faster restarts, shared copy-on-write memory)
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True') == 'True'
@@ -1,5 +1,9 @@
 from django.test import TestCase, Client
 from django.urls import reverse
+from django.core.cache import cache
+from unittest import mock
+import time
+from . import weather
 
 # Create your tests here.
 
@@ -21,3 +25,91 @@ class HomeViewTests(TestCase):
         response = self.client.get(reverse('home'))
         self.assertIn('weather', response.context)
         self.assertIsInstance(response.context['weather'], dict)
+
+    def test_static_pages_are_publicly_cacheable(self):
+        for name in ('about', 'features'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn('max-age', response['Cache-Control'])
+            self.assertNotIn('Cookie', response.get('Vary', ''))
+
+
+class FakeProvider(weather.Provider):
+    """Provider answering after `delay` seconds (or failing) without network access."""
+
+    def __init__(self, name, delay=0.0, fail=False, unknown=False):
+        super().__init__()
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.unknown = unknown
+        self.calls = 0
+
+    def fetch(self, city, timeout):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError('upstream down')
+        if self.unknown:
+            return {}['current_condition']  # A reply without the city's fields
+        return {'name': city, 'main': {'temp': 21.0}, 'weather': [{'main': 'Clear', 'description': 'clear'}], 'provider': self.name}
+
+
+class WeatherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_slow_primary_is_hedged_with_the_secondary(self):
+        slow, fast = FakeProvider('slow', delay=1.0), FakeProvider('fast', delay=0.01)
+        with mock.patch.object(weather, 'HEDGE_DEFAULT_MS', 50):
+            started = time.monotonic()
+            result = weather.fetch_hedged('Osaka', [slow, fast])
+        self.assertEqual(result['provider'], 'fast')
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual((slow.stats.hedges, fast.stats.wins), (1, 1))
+
+    def test_failures_fall_through_and_open_the_breaker(self):
+        broken, backup = FakeProvider('broken', fail=True), FakeProvider('backup')
+        broken.breaker = weather.CircuitBreaker(failures=2, reset=60)
+        for _ in range(3):
+            self.assertEqual(weather.fetch_hedged('Osaka', [broken, backup])['provider'], 'backup')
+        self.assertEqual((broken.calls, broken.breaker.state), (2, 'open'))
+        with self.assertRaises(weather.WeatherError):
+            weather.fetch_hedged('Osaka', [broken])
+
+    def test_unknown_cities_are_cached_and_do_not_open_the_breaker(self):
+        provider = FakeProvider('picky', unknown=True)
+        provider.breaker = weather.CircuitBreaker(failures=2, reset=60)
+        with mock.patch.object(weather, 'providers', [provider]):
+            for city in ('Atlantis', 'atlantis', 'Lemuria'):
+                with self.assertRaises(weather.UnknownLocation):
+                    weather.get_weather(city)
+        self.assertEqual((provider.calls, provider.breaker.state), (2, 'closed'))
+
+    def test_only_server_errors_count_as_upstream_failures(self):
+        for status, error in ((404, weather.UnknownLocation), (400, weather.UnknownLocation), (503, weather.WeatherError)):
+            with mock.patch('requests.get', return_value=mock.Mock(status_code=status)):
+                with self.assertRaises(error) as raised:
+                    weather._get_json('https://weather.example/', 1)
+            self.assertEqual(isinstance(raised.exception, weather.UnknownLocation), status < 500)
+
+    def test_home_page_uses_cached_provider_data_or_demo_fallback(self):
+        provider = FakeProvider('fake')
+        with mock.patch.object(weather, 'providers', [provider]):
+            self.assertEqual(self.client.get(reverse('home')).context['weather']['provider'], 'fake')
+            self.client.get(reverse('home'))
+            self.assertEqual(provider.calls, 1)
+        with mock.patch.object(weather, 'providers', [FakeProvider('down', fail=True)]):
+            fallback = self.client.get(reverse('home') + '?city=Kyoto').context['weather']
+            self.assertIn('Using demo data', fallback['note'])
+
+    def test_tsukumijima_forecast_is_normalized(self):
+        provider = weather.TsukumijimaProvider()
+        forecast = {'forecasts': [{'telop': '曇時々雨', 'temperature': {'max': {'celsius': None}, 'min': {'celsius': '19'}}}]}
+        self.assertFalse(provider.supports('Paris,France'))
+        with mock.patch.object(provider, 'fetch_raw', return_value=forecast) as fetch_raw:
+            result = provider.fetch('Osaka,Japan', 1)
+        fetch_raw.assert_called_once_with('270000', 1)
+        self.assertEqual(result['main'], {'temp': 19.0})
+        self.assertEqual(result['weather'][0]['main'], 'Rain')
@@ -6,4 +6,5 @@ urlpatterns = [
     path('about/', views.about_view, name='about'),  # About Rosan page
     path('features/', views.features_view, name='features'),  # NISHA Features page
     path('test/', views.test_view, name='test'),  # Test view
+    path('weather/stats/', views.weather_stats, name='weather_stats'),  # Weather provider latencies (staff)
 ]
\ No newline at end of file
@@ -1,9 +1,13 @@
 # Import necessary Django modules and Python libraries
+import logging  # Weather details are logged at DEBUG level
 from django.shortcuts import render  # For rendering HTML templates with context data
-from django.http import HttpResponse
-import requests  # For making HTTP requests to external APIs
-import json  # For handling JSON data (imported but not actively used)
-import os
+from django.http import HttpResponse, JsonResponse  # JsonResponse for the weather statistics
+from django.conf import settings  # Page cache timeout
+from django.contrib.auth.decorators import user_passes_test  # Staff-only statistics
+from django.views.decorators.cache import cache_control, cache_page  # Full-page caching for static pages
+from . import weather  # Weather providers (imports `requests` lazily, keeping cold starts fast)
+
+logger = logging.getLogger(__name__)
 
 def test_view(request):
     """Simple test view to check if Django is working"""
@@ -38,73 +42,14 @@ def home_view(request):
     # This allows users to check weather for different cities by adding ?city=CityName to URL
     city = request.GET.get("city", "Osaka,Japan")  # Default to Osaka, Japan for user location
     
-    # Initialize weather_data variable to store weather information
-    weather_data = {}
-    
     try:
-        # Attempt to fetch live weather data from wttr.in API
-        # wttr.in is a free weather service that doesn't require API key registration
-        # format=j1 parameter requests JSON format response
-        url = f"https://wttr.in/{city}?format=j1"
-        
-        # Make HTTP GET request with 10 second timeout to prevent hanging
-        response = requests.get(url, timeout=10)
-        
-        # Check if API request was successful (status code 200 = OK)
-        if response.status_code == 200:
-            try:
-                # Parse JSON response from weather API
-                data = response.json()
-                
-                # Check if the expected data structure exists
-                if ('current_condition' in data and len(data['current_condition']) > 0 and
-                    'nearest_area' in data and len(data['nearest_area']) > 0):
-                    
-                    # Extract current weather conditions from API response
-                    current = data['current_condition'][0]  # First (current) weather condition
-                    area_info = data['nearest_area'][0]     # Location information
-                    
-                    # Transform API data into format expected by our HTML template
-                    # This standardizes the data structure regardless of API changes
-                    weather_data = {
-                        # Format location as "City, Country" from API response
-                        "name": f"{area_info.get('areaName', [{}])[0].get('value', 'Unknown')}, {area_info.get('country', [{}])[0].get('value', 'Unknown')}",
-                        
-                        # Main weather measurements
-                        "main": {
-                            "temp": float(current.get('temp_C', 25)),           # Current temperature in Celsius
-                            "feels_like": float(current.get('FeelsLikeC', 25)), # "Feels like" temperature
-                            "humidity": int(current.get('humidity', 50))         # Humidity percentage
-                        },
-                        
-                        # Weather condition description
-                        "weather": [
-                            {
-                                "main": current.get('weatherDesc', [{}])[0].get('value', 'Clear'),
-                                "description": current.get('weatherDesc', [{}])[0].get('value', 'clear').lower(),
-                                "icon": "01d"  # Simple icon placeholder (could be enhanced with weather icons)
-                            }
-                        ],
-                        
-                        # Wind information
-                        "wind": {
-                            # Convert wind speed from km/h to m/s (multiply by 0.278)
-                            "speed": float(current.get('windspeedKmph', 10)) * 0.278
-                        }
-                    }
-                else:
-                    # Invalid data structure from API
-                    raise Exception("Invalid data structure from weather API")
-                    
-            except (KeyError, IndexError, ValueError) as e:
-                # JSON parsing or data structure issues
-                raise Exception(f"Invalid data format from weather API: {str(e)}")
-        else:
-            # If API returns non-200 status code, raise exception to trigger fallback
-            raise Exception(f"API returned status code: {response.status_code}")
-            
-    except Exception as e:
-        # Fallback weather data if API fails (network issues, API down, etc.)
+        # Normalized weather from the fastest healthy provider (wttr.in, with the
+        # JMA forecast API as hedge for Japanese cities); cached per city and
+        # bounded by settings.WEATHER_TIMEOUT (see home/weather.py)
+        weather_data = weather.get_weather(city)
+
+    except weather.WeatherError as e:
+        # Fallback weather data if every provider fails (network issues, API down, etc.)
         # This ensures the page always displays something, even without internet
         weather_data = {
             "name": "Osaka, Japan",  # Default location
@@ -134,8 +79,8 @@ def home_view(request):
             "note": f"Using demo data for Osaka - Live weather unavailable: {str(e)}"
         }
 
-    # For debugging, let's print the weather data
-    print(f"Debug: Weather data = {weather_data}")
+    # Weather details for debugging (LOG_LEVEL=DEBUG); formatted only when enabled
+    logger.debug('Weather data: %s', weather_data)
 
     # Render the home.html template with weather data
     # The weather data will be available in the template as {{ weather }}
@@ -143,6 +88,12 @@ def home_view(request):
         "weather": weather_data,  # Pass weather data to template
     })
 
+# The about and features pages render the same HTML for every visitor (they do
+# not use the session, user or CSRF token), so the whole response is cached
+# once and shared. Since nothing user-specific is read, no "Vary: Cookie" is
+# added and browsers/proxies may cache the page publicly too.
+@cache_page(settings.HOME_PAGE_CACHE_TIMEOUT)
+@cache_control(public=True)
 def about_view(request):
     """
     About page view function that displays information about Rosan.
@@ -155,6 +106,8 @@ def about_view(request):
     """
     return render(request, 'home/about.html')
 
+@cache_page(settings.HOME_PAGE_CACHE_TIMEOUT)
+@cache_control(public=True)
 def features_view(request):
     """
     Features page view function that displays detailed NISHA features.
@@ -165,4 +118,15 @@ def features_view(request):
     Returns:
         Rendered HTML template for the features page
     """
-    return render(request, 'home/features.html')
\ No newline at end of file
+    return render(request, 'home/features.html')
+
+@user_passes_test(lambda u: u.is_staff)  # Operational data for staff only
+def weather_stats(request):
+    """
+    Per-provider weather latency percentiles, failures, hedges and breaker
+    states for this worker.
+    
+    Returns:
+        JSON response keyed by provider name
+    """
+    return JsonResponse(weather.stats())
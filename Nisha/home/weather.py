@@ -0,0 +1,399 @@
+# Weather providers for the homepage
+# Two free upstreams are supported: wttr.in (any city, worldwide) and
+# weather.tsukumijima.net (Japan Meteorological Agency forecasts, for the
+# cities listed in weather_web_api.area.json). Both are normalized into the
+# `weather` dict the home.html template expects.
+#
+# get_weather() asks the first provider in settings.WEATHER_PROVIDERS. If no
+# answer arrives within that provider's hedge delay (its recent p95 latency,
+# clamped to WEATHER_HEDGE_MIN_MS..WEATHER_TIMEOUT), the next provider is asked
+# as well and whichever answers first wins; a provider that fails is replaced
+# at once. The whole lookup never takes longer than WEATHER_TIMEOUT, so one
+# slow upstream no longer decides the homepage tail latency.
+#
+# Each provider has a circuit breaker: after WEATHER_BREAKER_FAILURES failures
+# in a row it is skipped for WEATHER_BREAKER_RESET seconds, then one trial
+# request decides whether it is healthy again. Only upstream faults count
+# (connection errors, timeouts, 5xx); a 4xx or a reply without weather for the
+# city is an answer about the city (UnknownLocation), not a sign of trouble,
+# so visitors typing unknown cities cannot open the breaker. Latencies,
+# failures and hedge outcomes are kept per process (weather.stats(),
+# /home/weather/stats/). Results, including unknown locations, are cached per
+# city for WEATHER_CACHE_TIMEOUT seconds in the shared cache, so most page
+# views need no upstream request at all.
+
+import collections  # Latency windows
+import hashlib  # Cache keys for arbitrary city names
+import json  # Tsukumijima city table
+import os  # Location of the city table
+import threading  # Breaker and statistics locks
+import time  # Latency measurement and breaker timing
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait  # Concurrent (hedged) requests
+
+from django.conf import settings  # Provider order, timeouts and breaker tunables
+from django.core.cache import cache  # Normalized results per city
+
+# Provider order: the first is asked first, the others hedge for it
+PROVIDERS = getattr(settings, 'WEATHER_PROVIDERS', ['wttr', 'tsukumijima'])
+
+# Seconds a page view may wait for the weather in total
+TIMEOUT = getattr(settings, 'WEATHER_TIMEOUT', 3.0)
+
+# Hedge delay bounds and the delay used before a provider has enough samples
+HEDGE_MIN_MS = getattr(settings, 'WEATHER_HEDGE_MIN_MS', 50)
+HEDGE_DEFAULT_MS = getattr(settings, 'WEATHER_HEDGE_DEFAULT_MS', 500)
+MIN_SAMPLES = 10
+
+# Circuit breaker: consecutive failures that open it, seconds until a trial request
+BREAKER_FAILURES = getattr(settings, 'WEATHER_BREAKER_FAILURES', 5)
+BREAKER_RESET = getattr(settings, 'WEATHER_BREAKER_RESET', 30)
+
+# Seconds a normalized result is reused for the same city (0 disables caching)
+CACHE_TIMEOUT = getattr(settings, 'WEATHER_CACHE_TIMEOUT', 600)
+
+# Latency samples kept per provider
+WINDOW = 200
+
+AREA_FILE = os.path.join(os.path.dirname(__file__), 'weather_web_api.area.json')
+
+
+class WeatherError(Exception):
+    """No provider returned usable weather data."""
+
+
+class UnknownLocation(WeatherError):
+    """The upstreams answered, but have no weather for the requested city."""
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of `samples` (None when empty)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed -> open after `failures` failures in a row; open -> half-open after
+    `reset` seconds, letting exactly one trial call through; the trial's
+    outcome closes or re-opens it.
+    """
+
+    def __init__(self, failures=5, reset=30):
+        self.failures = failures
+        self.reset = reset
+        self.state = 'closed'
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may be made now."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset:
+                self.state = 'half-open'  # This caller makes the trial call
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._consecutive = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self.state == 'half-open' or self._consecutive >= self.failures:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class ProviderStats:
+    """
+    Recent latencies and outcome counters of one provider.
+    """
+
+    def __init__(self):
+        self.latencies = collections.deque(maxlen=WINDOW)  # Milliseconds of successful calls
+        self.successes = 0
+        self.failures = 0
+        self.wins = 0  # Calls whose answer was used
+        self.hedges = 0  # Times a backup request was sent because this provider was slow
+        self._lock = threading.Lock()
+
+    def record(self, milliseconds, ok):
+        with self._lock:
+            if ok:
+                self.successes += 1
+                self.latencies.append(milliseconds)
+            else:
+                self.failures += 1
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def hedge_delay(self):
+        """Seconds to wait for this provider before hedging (its recent p95)."""
+        with self._lock:
+            samples = list(self.latencies)
+        if len(samples) < MIN_SAMPLES:
+            delay_ms = HEDGE_DEFAULT_MS
+        else:
+            delay_ms = percentile(samples, 0.95)
+        return min(max(delay_ms, HEDGE_MIN_MS), TIMEOUT * 1000) / 1000
+
+    def as_dict(self):
+        with self._lock:
+            samples = list(self.latencies)
+            data = {
+                'successes': self.successes,
+                'failures': self.failures,
+                'wins': self.wins,
+                'hedges': self.hedges,
+            }
+        for name, fraction in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            value = percentile(samples, fraction)
+            data[name] = round(value, 1) if value is not None else None
+        return data
+
+
+class Provider:
+    """
+    One weather upstream. Subclasses implement supports() and fetch().
+    """
+
+    name = None
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET)
+        self.stats = ProviderStats()
+
+    def supports(self, city):
+        """True if this provider can answer for `city`."""
+        return True
+
+    def fetch(self, city, timeout):
+        """Return the normalized weather dict for `city` or raise."""
+        raise NotImplementedError
+
+    def timed_fetch(self, city, timeout):
+        """fetch() with latency, breaker and error bookkeeping (runs on the pool)."""
+        started = time.perf_counter()
+        try:
+            result = self.fetch(city, timeout)
+        except (UnknownLocation, KeyError, IndexError, TypeError) as e:
+            # A 4xx or a reply missing the city's fields: the upstream is healthy
+            self.stats.record((time.perf_counter() - started) * 1000, ok=True)
+            self.breaker.record_success()
+            raise UnknownLocation(f'{self.name}: no weather for {city} ({e})') from e
+        except Exception as e:
+            self.stats.record((time.perf_counter() - started) * 1000, ok=False)
+            self.breaker.record_failure()
+            raise WeatherError(f'{self.name}: {e}') from e
+        self.stats.record((time.perf_counter() - started) * 1000, ok=True)
+        self.breaker.record_success()
+        return result
+
+
+def _get_json(url, timeout):
+    import requests  # Deferred: ~45 ms to import, only needed on a cache miss
+
+    response = requests.get(url, timeout=timeout)
+    if 400 <= response.status_code < 500:
+        raise UnknownLocation(f'status code {response.status_code}')
+    if response.status_code != 200:
+        raise WeatherError(f'status code {response.status_code}')
+    return response.json()
+
+
+class WttrProvider(Provider):
+    """wttr.in current conditions (format=j1), worldwide."""
+
+    name = 'wttr'
+
+    def fetch(self, city, timeout):
+        data = _get_json(f'https://wttr.in/{city}?format=j1', timeout)
+        current = data['current_condition'][0]
+        area = data['nearest_area'][0]
+        description = current.get('weatherDesc', [{}])[0].get('value', 'Clear')
+        return {
+            # Location as "City, Country"
+            'name': f"{area.get('areaName', [{}])[0].get('value', 'Unknown')}, {area.get('country', [{}])[0].get('value', 'Unknown')}",
+            'main': {
+                'temp': float(current['temp_C']),
+                'feels_like': float(current.get('FeelsLikeC', current['temp_C'])),
+                'humidity': int(current.get('humidity', 0)),
+            },
+            'weather': [{'main': description, 'description': description.lower(), 'icon': '01d'}],
+            # km/h to m/s
+            'wind': {'speed': round(float(current.get('windspeedKmph', 0)) * 0.278, 1)},
+            'provider': self.name,
+        }
+
+
+class TsukumijimaProvider(Provider):
+    """
+    weather.tsukumijima.net JMA forecasts for the cities in
+    weather_web_api.area.json (today's forecast: no humidity or wind).
+    """
+
+    name = 'tsukumijima'
+
+    # Forecast text -> template condition (checked in this order)
+    CONDITIONS = (('雪', 'Snow'), ('雨', 'Rain'), ('曇', 'Clouds'), ('晴', 'Clear'))
+
+    def __init__(self):
+        super().__init__()
+        with open(AREA_FILE, encoding='utf-8') as area_file:
+            self.cities = {name.lower(): area for name, area in json.load(area_file).items() if 'jma_city' in area}
+
+    def city_code(self, city):
+        """JMA city code for 'Osaka', 'Osaka,Japan', ... or None."""
+        area = self.cities.get(city.split(',')[0].strip().lower())
+        return area['jma_city'] if area else None
+
+    def supports(self, city):
+        return self.city_code(city) is not None
+
+    def fetch(self, city, timeout):
+        data = self.fetch_raw(self.city_code(city), timeout)
+        today = data['forecasts'][0]
+        temperature = today['temperature']['max']['celsius'] or today['temperature']['min']['celsius']
+        if temperature is None:
+            raise UnknownLocation('no temperature in forecast')
+        telop = today['telop']
+        condition = next((main for mark, main in self.CONDITIONS if mark in telop), telop)
+        return {
+            'name': f"{city.split(',')[0].strip().title()}, Japan",
+            'main': {'temp': float(temperature)},
+            'weather': [{'main': condition, 'description': telop, 'icon': '01d'}],
+            'provider': self.name,
+        }
+
+    def fetch_raw(self, city_code, timeout):
+        """The upstream forecast JSON for a JMA city code."""
+        return _get_json(f'https://weather.tsukumijima.net/api/forecast?city={city_code}', timeout)
+
+
+PROVIDER_CLASSES = {cls.name: cls for cls in (WttrProvider, TsukumijimaProvider)}
+
+# Process-wide provider instances (breakers and statistics live here)
+providers = [PROVIDER_CLASSES[name]() for name in PROVIDERS]
+
+# Upstream requests run here so the page view can stop waiting for a slow one
+# (the request itself finishes in the background and still counts in the stats)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=2 * max(len(providers), 1), thread_name_prefix='weather')
+        return _pool
+
+
+def fetch_hedged(city, candidates, timeout=TIMEOUT):
+    """
+    Ask `candidates` in order, hedging slow ones with the next, and return
+    the first successful result.
+
+    Raises:
+        UnknownLocation: if every provider answered without weather for `city`
+        WeatherError: if every provider failed, was skipped or timed out
+    """
+    deadline = time.monotonic() + timeout
+    waiting = list(candidates)
+    pending = {}  # future -> provider
+    errors = []
+    unknown = []
+
+    def launch_next():
+        while waiting:
+            provider = waiting.pop(0)
+            if provider.breaker.allow():
+                pending[_get_pool().submit(provider.timed_fetch, city, max(deadline - time.monotonic(), 0.1))] = provider
+                return provider
+            errors.append(f'{provider.name}: circuit open')
+        return None
+
+    latest = launch_next()
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # Wait for the newest request's hedge delay while a backup is available
+        delay = min(latest.stats.hedge_delay(), remaining) if waiting else remaining
+        done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+        if not done:
+            if waiting:
+                latest.stats.count('hedges')
+                latest = launch_next() or latest
+            continue
+        for future in done:
+            provider = pending.pop(future)
+            try:
+                result = future.result()
+            except UnknownLocation as e:
+                unknown.append(str(e))
+                continue
+            except WeatherError as e:
+                errors.append(str(e))
+                continue
+            provider.stats.count('wins')
+            return result
+        if not pending:
+            latest = launch_next() or latest  # All in-flight requests failed: try the next provider now
+    if pending:
+        errors.append(f'timed out after {timeout}s')
+    if unknown and not errors:
+        raise UnknownLocation('; '.join(unknown))
+    raise WeatherError('; '.join(errors + unknown) or 'no weather provider available')
+
+
+def get_weather(city):
+    """
+    Normalized current weather for `city` (cached, hedged across providers).
+
+    Raises:
+        UnknownLocation: if no provider has weather for `city`
+        WeatherError: if no provider answered in time
+    """
+    key = 'weather:' + hashlib.md5(city.strip().lower().encode(), usedforsecurity=False).hexdigest()
+    if CACHE_TIMEOUT:
+        cached = cache.get(key)
+        if cached is not None:
+            if 'unknown' in cached:
+                raise UnknownLocation(cached['unknown'])
+            return cached
+    candidates = [provider for provider in providers if provider.supports(city)]
+    if not candidates:
+        raise UnknownLocation(f'no provider covers {city}')
+    try:
+        result = fetch_hedged(city, candidates)
+    except UnknownLocation as e:
+        if CACHE_TIMEOUT:
+            cache.set(key, {'unknown': str(e)}, CACHE_TIMEOUT)
+        raise
+    if CACHE_TIMEOUT:
+        cache.set(key, result, CACHE_TIMEOUT)
+    return result
+
+
+def stats():
+    """Per-provider latency percentiles, outcome counts and breaker states."""
+    return {
+        provider.name: {
+            **provider.stats.as_dict(),
+            'breaker': provider.breaker.state,
+            'hedge_delay_ms': round(provider.stats.hedge_delay() * 1000, 1),
+        }
+        for provider in providers
+    }
@@ -1,40 +1,22 @@
-import requests
-import json
-import os
-
-def get_weather_data(small_area):
-    base_dir = os.path.dirname(__file__)
-    area_file_path = os.path.join(base_dir, "weather_web_api.area.json")
-
-    with open(area_file_path, "r", encoding="utf-8") as area_json:
-        area_dict = json.load(area_json)
-
-    small_area_id = None
-    for inner_dict in area_dict:
-        for cities_dict in inner_dict['cities']:
-            if small_area == cities_dict['title']:
-                small_area_title = cities_dict['title']
-                small_area_id = cities_dict['id']
-                break
-        if small_area_id is not None:
-            break
-
-    if small_area_id is None:
-        return {"error": "City not found"}
-
-    url = f"https://weather.tsukumijima.net/api/forecast?city={small_area_id}"
-    response = requests.get(url)
-
-    if response.status_code != 200:
-        return {"error": f"Failed to fetch data: {response.status_code}"}
-
-    weather_data = response.json()
-
-    try:
-        with open(os.path.join(base_dir, "weather_web_api.json"), "w", encoding="utf-8") as file:
-            json.dump(weather_data, file, ensure_ascii=False, indent=4)
-    except Exception as error_message:
-        return {"error": f"Failed to save data: {error_message}"}
-
-    return weather_data
- 
\ No newline at end of file
+# Raw JMA forecasts from weather.tsukumijima.net
+# Kept for callers that want the full upstream forecast; the homepage uses the
+# normalized, hedged lookup in home/weather.py.
+
+from .weather import TIMEOUT, TsukumijimaProvider, WeatherError
+
+
+def get_weather_data(small_area):
+    """
+    Full tsukumijima forecast for a city listed in weather_web_api.area.json.
+
+    Returns:
+        The upstream JSON, or {"error": ...}
+    """
+    provider = TsukumijimaProvider()
+    city_code = provider.city_code(small_area)
+    if city_code is None:
+        return {"error": "City not found"}
+    try:
+        return provider.fetch_raw(city_code, TIMEOUT)
+    except (WeatherError, OSError, ValueError) as error_message:
+        return {"error": f"Failed to fetch data: {error_message}"}